@@ -0,0 +1,271 @@
+"""
+Offline performance benchmarks of ingestion, index loading, retrieval and Chat.ask.
+
+Embeddings and the LLM are replaced by deterministic fakes, the LLM answering after a
+configurable latency, and the documents are synthetic PDFs, so the results only depend
+on the code and the machine. Results are written as JSON to compare them across commits:
+
+    PYTHONPATH=src python benchmarks/run.py --output bench.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+
+import chat
+import config
+import manifest as mf
+import models
+import registry
+import vectorstore
+from synthetic import random_text, write_corpus
+
+
+def install_fakes(embedding_size: int, llm_latency: float) -> None:
+    """
+    Make every component load the fake embedding model and LLM instead of the real ones.
+
+    Args:
+        embedding_size (int): Dimension of the fake embeddings.
+        llm_latency (float): Number of seconds the fake LLM takes to answer.
+    """
+    embeddings = DeterministicFakeEmbedding(size=embedding_size)
+    llm = FakeListChatModel(responses=["Resposta sintética."], sleep=llm_latency)
+
+    models.get_embeddings = lambda *args, **kwargs: embeddings
+    models.get_llm = lambda *args, **kwargs: llm
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """
+    Summarize latencies, in milliseconds.
+
+    Args:
+        latencies (List[float]): Latencies in seconds.
+
+    Returns:
+        Dict[str, float]: Mean, p50 and p99.
+    """
+    return {
+        "mean_ms": float(np.mean(latencies) * 1000),
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+    }
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident memory of the process so far.
+
+    Returns:
+        float: The peak RSS in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def bench_ingestion(work_dir: str, num_files: int, pages_per_file: int) -> Dict[str, float]:
+    """
+    Measure the throughput of a full vectorstore.run over synthetic PDFs.
+    """
+    file_paths = write_corpus(os.path.join(work_dir, "input"), num_files, pages_per_file)
+    output_folder_path = os.path.join(work_dir, "output")
+    os.makedirs(output_folder_path, exist_ok=True)
+
+    start = time.perf_counter()
+    vectorstore.run(file_paths, output_folder_path, incremental=False)
+    seconds = time.perf_counter() - start
+
+    files = mf.load_manifest(output_folder_path)["files"]
+    chunks = sum(len(entry["chunk_ids"]) for entry in files.values())
+    pages = num_files * pages_per_file
+
+    return {
+        "files": num_files,
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": seconds,
+        "pages_per_s": pages / seconds,
+        "chunks_per_s": chunks / seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_load(output_folder_path: str, repeat: int) -> Dict[str, float]:
+    """
+    Measure the time setup_retriever takes to load the index from disk.
+    """
+    embeddings = registry.get_embeddings()
+    latencies = []
+
+    for _ in range(repeat):
+        registry.invalidate()
+        start = time.perf_counter()
+        chat.setup_retriever(output_folder_path, embeddings)
+        latencies.append(time.perf_counter() - start)
+
+    return {**summarize(latencies), "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_retrieval(
+    corpus_sizes: List[int], ks: List[int], num_queries: int
+) -> List[Dict[str, float]]:
+    """
+    Measure retriever latency, query embedding included, for several corpus sizes and k.
+    """
+    embeddings = registry.get_embeddings()
+    rng = random.Random(0)
+    queries = [random_text(rng, 8) for _ in range(num_queries)]
+    reports = []
+
+    for size in corpus_sizes:
+        chunks = (
+            (str(i), Document(page_content=random_text(rng, 150))) for i in range(size)
+        )
+        store = vectorstore.embed_in_batches(chunks, embeddings)
+
+        for k in ks:
+            retriever = store.as_retriever(search_kwargs={"k": k})
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                retriever.invoke(query)
+                latencies.append(time.perf_counter() - start)
+
+            reports.append({"corpus_size": size, "k": k, **summarize(latencies)})
+
+    return reports
+
+
+def bench_ask(
+    output_folder_path: str,
+    db_path: str,
+    concurrency: List[int],
+    questions_per_caller: int,
+) -> List[Dict[str, float]]:
+    """
+    Measure Chat.ask latency with several sessions asking questions at the same time.
+    """
+    reports = []
+
+    for callers in concurrency:
+        chats = [
+            chat.Chat(output_folder_path, db_path, config.chat_template)
+            for _ in range(callers)
+        ]
+        latencies = []
+        barrier = threading.Barrier(callers)
+
+        def ask(chat_ins: chat.Chat, caller: int) -> None:
+            barrier.wait()
+            for i in range(questions_per_caller):
+                start = time.perf_counter()
+                chat_ins.log(chat_ins.ask(f"Pergunta {caller}-{i} sobre a cobertura?"))
+                latencies.append(time.perf_counter() - start)
+
+        threads = [
+            threading.Thread(target=ask, args=(c, i)) for i, c in enumerate(chats)
+        ]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        seconds = time.perf_counter() - start
+
+        reports.append(
+            {
+                "callers": callers,
+                "questions": len(latencies),
+                "questions_per_s": len(latencies) / seconds,
+                **summarize(latencies),
+            }
+        )
+
+    return reports
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", help="JSON file to write (default: stdout)")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=10, help="pages per PDF")
+    parser.add_argument("--corpus-sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--questions", type=int, default=5, help="questions per caller")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--embedding-size", type=int, default=768)
+    parser.add_argument("--index-type", default=config.index_type)
+    args = parser.parse_args(argv)
+
+    install_fakes(args.embedding_size, args.llm_latency)
+    config.index_type = args.index_type
+    # every question is new: measure the chain, not the answer cache
+    config.semantic_cache_enabled = False
+
+    # progress messages go to stderr, so that stdout only holds the report
+    with tempfile.TemporaryDirectory() as work_dir, contextlib.redirect_stdout(sys.stderr):
+        ingestion = bench_ingestion(work_dir, args.files, args.pages)
+        output_folder_path = os.path.join(work_dir, "output")
+
+        results = {
+            "meta": {
+                "commit": get_commit(),
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "args": vars(args),
+            },
+            "ingestion": ingestion,
+            "load": bench_load(output_folder_path, repeat=5),
+            "retrieval": bench_retrieval(args.corpus_sizes, args.k, args.queries),
+            "ask": bench_ask(
+                output_folder_path,
+                os.path.join(work_dir, "history.db"),
+                args.concurrency,
+                args.questions,
+            ),
+        }
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    report = json.dumps(results, indent=2)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report)
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import os
+import random
+from typing import List
+
+WORDS = (
+    "apólice seguro segurado sinistro cobertura franquia prêmio indenização contrato "
+    "cláusula beneficiário vigência carência assistência veículo residência vida "
+    "acidente roubo incêndio responsabilidade civil terceiros reembolso prazo "
+    "comunicação documentos análise pagamento cancelamento renovação endosso"
+).split()
+
+
+def random_text(rng: random.Random, num_words: int) -> str:
+    """
+    Generate a text of random words from an insurance vocabulary.
+
+    Args:
+        rng (random.Random): Source of randomness, seeded for reproducible texts.
+        num_words (int): Number of words.
+
+    Returns:
+        str: The text.
+    """
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def write_pdf(path: str, pages: List[List[str]]) -> None:
+    """
+    Write a minimal PDF, one list of text lines per page, without any PDF library.
+
+    Args:
+        path (str): Path of the PDF file to write.
+        pages (List[List[str]]): Lines of text of each page (latin-1 characters).
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    kids = []
+
+    for lines in pages:
+        text = " T* ".join(f"({line}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 780 Td {text} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(f"{len(objects)} 0 R")
+
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_corpus(
+    folder_path: str,
+    num_files: int,
+    pages_per_file: int,
+    lines_per_page: int = 50,
+    seed: int = 0,
+) -> List[str]:
+    """
+    Write a reproducible corpus of synthetic PDFs.
+
+    Args:
+        folder_path (str): Folder where the PDFs are written.
+        num_files (int): Number of PDFs.
+        pages_per_file (int): Number of pages of each PDF.
+        lines_per_page (int): Number of lines of about 12 words per page. Defaults to 50.
+        seed (int): Seed of the random texts. Defaults to 0.
+
+    Returns:
+        List[str]: The paths of the PDFs.
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder_path, exist_ok=True)
+    file_paths = []
+
+    for i in range(num_files):
+        path = os.path.join(folder_path, f"synthetic_{i:04d}.pdf")
+        write_pdf(
+            path,
+            [
+                [random_text(rng, 12) for _ in range(lines_per_page)]
+                for _ in range(pages_per_file)
+            ],
+        )
+        file_paths.append(path)
+
+    return file_paths
@@ -3,9 +3,39 @@ import os
 import streamlit as st
 
 import config
+import jobs
 import utils
-import chat
-import vectorstore
+import warmup
+
+# chat is imported on first use: it loads LangChain, FAISS and the model clients, which
+# would delay the first render by seconds; documents are processed by a worker process
+
+
+# reruns on its own, polling the ingestion job of the session until it is over
+@st.fragment(run_every=config.jobs_poll_interval)
+def show_job_status():
+    queue = jobs.get_queue()
+    job = queue.get(st.session_state.job_id)
+
+    if job is not None and job["state"] in jobs.ACTIVE_STATES:
+        if job["state"] == "queued":
+            st.caption("⏳ Aguardando processamento...")
+        else:
+            total = job["files_total"] or 0
+            st.progress(
+                job["files_done"] / total if total else 0.0,
+                text=f"Processando documentos: {job['files_done']}/{total} arquivos, "
+                f"{job['chunks_done']} trechos",
+            )
+
+        if st.button("⏹️ Cancelar", disabled=job["cancel_requested"]):
+            queue.cancel(job["id"])
+        return
+
+    # over: the whole page is rerun to show the outcome
+    st.session_state.job_id = None
+    st.session_state.finished_job = job
+    st.rerun()
 
 
 def run():
@@ -24,6 +54,12 @@ def run():
     expander1 = st.expander("Prompt Template")
     expander1.markdown(f"```{config.chat_template}```")
 
+    if config.warmup_enabled:
+        warmup.start(config.output_folder_path)
+
+        if not warmup.is_ready():
+            st.sidebar.caption("⏳ Carregando modelos...")
+
     if "process_success" not in st.session_state:
         st.session_state.process_success = False
 
@@ -33,9 +69,22 @@ def run():
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = utils.get_unique_id()
+
+    if "history_last_id" not in st.session_state:
+        st.session_state.history_last_id = None
+
     if "input_pdfs" not in st.session_state:
         st.session_state.input_pdfs = []
 
+    if "job_id" not in st.session_state:
+        # a job submitted before the page was refreshed keeps running
+        job = jobs.get_queue().latest(config.output_folder_path)
+        st.session_state.job_id = job["id"] if job else None
+        if job:
+            jobs.start_worker()
+
     uploaded_pdf = st.sidebar.file_uploader(
         "Upload PDF", type="pdf", label_visibility="hidden"
     )
@@ -68,44 +117,76 @@ def run():
         st.rerun()
 
     if st.sidebar.button(
-        "🔄 Processar documentos", disabled=not any(st.session_state.input_pdfs.values())
+        "🔄 Processar documentos",
+        disabled=not any(st.session_state.input_pdfs.values())
+        or st.session_state.job_id is not None,
     ):
-        with st.spinner("Processando documentos de entrada..."):
-            _input_files = [f for f, c in st.session_state.input_pdfs.items() if c]
-
-            vectorstore.run(_input_files, config.output_folder_path)
+        # every uploaded PDF is indexed (only new or changed ones are embedded) by a
+        # worker process; the checked ones restrict the search below, so changing them
+        # needs no rebuild
+        st.session_state.job_id = jobs.get_queue().submit(
+            list(st.session_state.input_pdfs), config.output_folder_path
+        )
+        jobs.start_worker()
+
+    if st.session_state.job_id is not None:
+        with st.sidebar:
+            show_job_status()
+
+    job = st.session_state.pop("finished_job", None)
+
+    if job is not None and job["state"] == "done":
+        import chat
+
+        st.session_state.chat_ins = chat.Chat(
+            store_folder_path=config.output_folder_path,
+            db_path=config.db_path,
+            chat_template=config.chat_template,
+            session_id=st.session_state.session_id,
+        )
+
+        st.session_state.process_success = True
+    elif job is not None and job["state"] == "failed":
+        st.sidebar.error(f"Falha ao processar documentos: {job['error']}")
+    elif job is not None and job["state"] == "cancelled":
+        st.sidebar.warning("Processamento cancelado.")
 
-            st.session_state.chat_ins = chat.Chat(
-                store_folder_path=config.output_folder_path,
-                db_path=config.db_path,
-                chat_template=config.chat_template,
+    if st.session_state.process_success:
+        st.session_state.chat_ins.set_sources(
+            [f for f, c in st.session_state.input_pdfs.items() if c]
+        )
+
+        # transfer the latest page of the conversation, then only the new interactions,
+        # from database to streamlit session
+        if st.session_state.history_last_id is None:
+            rows = st.session_state.chat_ins.get_history(limit=config.history_page_size)
+        else:
+            rows = st.session_state.chat_ins.get_history(
+                after_id=st.session_state.history_last_id
             )
 
-            st.session_state.process_success = True
-
-    if st.session_state.process_success:
-        # transfer message history from database to streamlit session
-        for row in st.session_state.chat_ins.get_history():
+        for row in rows:
             st.session_state.messages.append({"role": "user", "content": row[1]})
             st.session_state.messages.append({"role": "assistant", "content": row[2]})
+            st.session_state.history_last_id = row[0]
+
+        if st.session_state.history_last_id is None:
+            st.session_state.history_last_id = 0
 
         for message in st.session_state.messages:
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
 
         if prompt := st.chat_input("Faça uma pergunta?"):
-            st.session_state.messages.append({"role": "user", "content": prompt})
+            # the logged interaction enters the messages with the next delta
             with st.chat_message("user"):
                 st.markdown(prompt)
 
             with st.chat_message("assistant"):
-                with st.spinner("Gerando resposta..."):
-                    qa_instance = st.session_state.chat_ins.ask(
-                        st.session_state.messages[-1]["content"]
-                    )
-                    st.write(qa_instance.answer)
+                qa_instance, tokens = st.session_state.chat_ins.ask_stream(prompt)
+                st.write_stream(tokens)
 
-                    st.session_state.chat_ins.log(qa_instance)
+                st.session_state.chat_ins.log(qa_instance)
 
 
 if __name__ == "__main__":
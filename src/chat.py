@@ -1,16 +1,321 @@
-from typing import Dict, List, Optional, Union
+import asyncio
+import heapq
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 
-from langchain_community.vectorstores import FAISS
+import numpy as np
 from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
 from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
 from langchain.embeddings.base import Embeddings
 from langchain.schema import BaseRetriever
 from langchain.llms.base import BaseLLM
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForChainRun,
+    BaseCallbackHandler,
+    CallbackManagerForChainRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.outputs import LLMResult
+from langchain_core.vectorstores import VectorStoreRetriever
+from pydantic import Field
 
+import compression
+import config
+import indexes
 import utils
 import database as db
-import models
+import manifest as mf
+import registry
+import snapshots
+import storage
+import telemetry
+from memory import TokenBudgetMemory
+
+# tags of the chain generating the answer and of the question-condensing chain
+ANSWER_TAG = "answer"
+CONDENSE_TAG = "condense"
+
+# when a follow-up question is rewritten with the chat history, see CondensingRetrievalChain
+CONDENSE_MODES = ("always", "never", "speculative")
+
+
+def search_vector_store(
+    vectorstore: FAISS,
+    embedding: List[float],
+    search_kwargs: Dict[str, Any],
+    sources: Optional[List[str]] = None,
+) -> List[Tuple[Document, float]]:
+    """
+    Search a vector store by similarity to a query embedding.
+
+    The search can be restricted to the chunks of some source documents, selected by
+    their positions in the index (see storage.SQLiteDocstore.get_ranges) during the
+    FAISS search itself.
+
+    Args:
+        vectorstore (FAISS): The vector store. It must be opened by storage.open_vector_store
+            to restrict the search to some documents.
+        embedding (List[float]): The query embedding.
+        search_kwargs (Dict[str, Any]): Parameters of similarity_search_with_score_by_vector,
+            of which only k applies to a restricted search.
+        sources (Optional[List[str]]): Paths of the documents to search. Defaults to None
+            (every document).
+
+    Returns:
+        List[Tuple[Document, float]]: The chunks and their L2 distances, nearest first.
+    """
+    if sources is None:
+        return vectorstore.similarity_search_with_score_by_vector(
+            embedding, **search_kwargs
+        )
+
+    docstore = vectorstore.docstore
+    ranges = docstore.get_ranges(sources)
+
+    if not ranges:
+        return []
+
+    scores, positions = indexes.search_ranges(
+        vectorstore.index,
+        np.array([embedding], dtype=np.float32),
+        search_kwargs.get("k", 4),
+        ranges,
+    )
+
+    return [
+        (docstore.search(vectorstore.index_to_docstore_id[i]), float(score))
+        for score, i in zip(scores[0], positions[0])
+        if i != -1
+    ]
+
+
+def compress(
+    docs: List[Document],
+    embedding: List[float],
+    compressor: Optional[compression.ContextCompressor],
+) -> List[Document]:
+    """
+    Compress retrieved chunks to the token budget of a compressor, reusing the query embedding.
+
+    Args:
+        docs (List[Document]): The chunks, most relevant first.
+        embedding (List[float]): The query embedding the chunks were retrieved with.
+        compressor (Optional[compression.ContextCompressor]): The compressor, or None to
+            return the chunks whole.
+
+    Returns:
+        List[Document]: The chunks to put in the prompt.
+    """
+    if compressor is None or not docs:
+        return docs
+
+    with telemetry.span("retrieval.compress"):
+        return compressor.compress(embedding, docs)
+
+
+class InstrumentedRetriever(VectorStoreRetriever):
+    """
+    FAISS retriever timing the query embedding and the index search separately, and
+    recording the scores of the retrieved chunks, see telemetry.
+
+    Similarity searches can be restricted to the chunks of some source documents, see
+    search_vector_store. The retrieved chunks can be compressed to a token budget, see
+    compression.ContextCompressor.
+    """
+
+    # paths of the documents to search, None for every document
+    sources: Optional[List[str]] = None
+    # compressor of the retrieved chunks, None to return them whole
+    compressor: Optional[compression.ContextCompressor] = None
+
+    def _search(self, query: str) -> List[Document]:
+        with telemetry.span("retrieval.embed_query"):
+            embedding = self.vectorstore._embed_query(query)
+
+        with telemetry.span("retrieval.search"):
+            docs_and_scores = search_vector_store(
+                self.vectorstore, embedding, self.search_kwargs, self.sources
+            )
+
+        for _, score in docs_and_scores:
+            telemetry.observe("retrieval.score", float(score))
+
+        return compress([doc for doc, _ in docs_and_scores], embedding, self.compressor)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun, **kwargs: Any
+    ) -> List[Document]:
+        if self.search_type != "similarity" or kwargs:
+            return super()._get_relevant_documents(
+                query, run_manager=run_manager, **kwargs
+            )
+
+        return self._search(query)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager, **kwargs: Any
+    ) -> List[Document]:
+        if self.search_type != "similarity" or kwargs:
+            return await super()._aget_relevant_documents(
+                query, run_manager=run_manager, **kwargs
+            )
+
+        return await asyncio.to_thread(self._search, query)
+
+
+class ShardedRetriever(BaseRetriever):
+    """
+    Retriever searching several vector stores (shards), e.g. one per upload batch or product line.
+
+    The query is embedded once, the shards are searched in parallel on a shared thread
+    pool (see registry.get_search_pool) and their results are merged into a global
+    top-k by L2 distance. Shards are loaded and unloaded independently, so that one
+    shard can be rebuilt and loaded again without touching the others.
+    """
+
+    embeddings: Embeddings
+    search_kwargs: Dict[str, Any] = Field(default_factory=lambda: {"k": 5})
+    # search-time index parameters (nprobe, ef_search), None for config.index_params
+    index_params: Optional[Dict[str, int]] = None
+    # paths of the documents to search, None for every document
+    sources: Optional[List[str]] = None
+    # index name and vector store of each loaded shard, by shard name
+    shards: Dict[str, Tuple[str, Any]] = Field(default_factory=dict)
+    # compressor of the retrieved chunks, None to return them whole
+    compressor: Optional[compression.ContextCompressor] = None
+
+    @property
+    def index_id(self) -> Tuple[str, ...]:
+        """
+        Names of the indexes of the loaded shards, identifying what is searched.
+        """
+        return tuple(sorted(index_name for index_name, _ in self.shards.values()))
+
+    def load_shard(self, name: str, store_folder_path: str) -> None:
+        """
+        Load a shard, or load it again once rebuilt, e.g. by vectorstore.run.
+
+        Args:
+            name (str): Name of the shard.
+            store_folder_path (str): Path to the folder containing the index files of the shard.
+        """
+        index_name = get_index_name(store_folder_path)
+        vectorstore = load_index(
+            store_folder_path, index_name, self.embeddings, self.index_params
+        )
+
+        # replaced rather than updated, so that searches in progress keep their shards
+        self.shards = {**self.shards, name: (index_name, vectorstore)}
+
+    def unload_shard(self, name: str) -> None:
+        """
+        Stop searching a shard.
+
+        Args:
+            name (str): Name of the shard.
+        """
+        self.shards = {n: shard for n, shard in self.shards.items() if n != name}
+
+    def _search(self, query: str) -> List[Document]:
+        shards = self.shards
+
+        if not shards:
+            return []
+
+        with telemetry.span("retrieval.embed_query"):
+            embedding = self.embeddings.embed_query(query)
+
+        def search(name: str) -> List[Tuple[Document, float]]:
+            with telemetry.span("retrieval.shard_search", shard=name):
+                return search_vector_store(
+                    shards[name][1], embedding, self.search_kwargs, self.sources
+                )
+
+        with telemetry.span("retrieval.search"):
+            if len(shards) == 1:
+                results = [search(name) for name in shards]
+            else:
+                results = list(registry.get_search_pool().map(search, shards))
+
+        docs_and_scores = heapq.nsmallest(
+            self.search_kwargs.get("k", 4), chain(*results), key=lambda pair: pair[1]
+        )
+
+        for _, score in docs_and_scores:
+            telemetry.observe("retrieval.score", float(score))
+
+        return compress([doc for doc, _ in docs_and_scores], embedding, self.compressor)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self._search(query)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager
+    ) -> List[Document]:
+        return await asyncio.to_thread(self._search, query)
+
+
+def load_index(
+    store_folder_path: str,
+    index_name: str,
+    embeddings: Embeddings,
+    index_params: Optional[Dict[str, int]] = None,
+) -> FAISS:
+    """
+    Return the shared vector store of an index, opening it on first use.
+
+    Args:
+        store_folder_path (str): Path to the folder containing the FAISS index files.
+        index_name (str): Name of the index, see get_index_name.
+        embeddings (Embeddings): Embedding model instance.
+        index_params (Optional[Dict[str, int]]): Search-time index parameters (nprobe, ef_search).
+            Defaults to config.index_params.
+
+    Returns:
+        FAISS: The vector store, shared by every Chat of the process.
+    """
+    vectorstore = registry.get_index(
+        index_name,
+        lambda: storage.open_vector_store(store_folder_path, index_name, embeddings),
+    )
+    indexes.set_search_params(vectorstore.index, index_params or config.index_params)
+
+    return vectorstore
+
+
+def list_shards(store_folder_path: str) -> Dict[str, str]:
+    """
+    List the shards of a folder: its sub-folders holding a complete index.
+
+    Args:
+        store_folder_path (str): Path to the folder.
+
+    Returns:
+        Dict[str, str]: The path of each shard folder, by shard name (the sub-folder name).
+    """
+    if not os.path.isdir(store_folder_path):
+        return {}
+
+    shards = {}
+
+    for name in sorted(os.listdir(store_folder_path)):
+        path = os.path.join(store_folder_path, name)
+        if os.path.isdir(path) and mf.load_manifest(path)["index_name"] is not None:
+            shards[name] = path
+
+    return shards
 
 
 def setup_retriever(
@@ -18,20 +323,113 @@ def setup_retriever(
     embeddings: Embeddings,
     search_type: str = "similarity",
     search_kwargs: Optional[Dict[str, Union[str, int]]] = None,
+    index_params: Optional[Dict[str, int]] = None,
+    compressor: Optional[compression.ContextCompressor] = None,
 ) -> BaseRetriever:
     """
     Set up the retriever using FAISS and embeddings.
 
+    A folder holds either an index, built by vectorstore.run, or shards: sub-folders
+    each holding an index, searched together by a ShardedRetriever.
+
     Args:
         store_folder_path (str): Path to the folder containing the FAISS index files.
         embeddings (Embeddings): Embedding model instance.
         search_type (str): The type of search to perform. Defaults to 'similarity'.
         search_kwargs (Optional[Dict[str, Union[str, int]]]): Additional search parameters. Defaults to {"k": 5}.
+        index_params (Optional[Dict[str, int]]): Search-time index parameters (nprobe, ef_search).
+            Defaults to config.index_params.
+        compressor (Optional[compression.ContextCompressor]): Compressor of the retrieved chunks.
+            Defaults to None (chunks returned whole).
 
     Returns:
         BaseRetriever: Configured retriever object.
     """
     search_kwargs = search_kwargs or {"k": 5}
+    shards = list_shards(store_folder_path)
+
+    if shards and mf.load_manifest(store_folder_path)["index_name"] is None:
+        retriever = ShardedRetriever(
+            embeddings=embeddings,
+            search_kwargs=search_kwargs,
+            index_params=index_params,
+            compressor=compressor,
+        )
+        for name, shard_folder_path in shards.items():
+            retriever.load_shard(name, shard_folder_path)
+
+        return retriever
+
+    index_name = get_index_name(store_folder_path)
+    vectorstore = load_index(store_folder_path, index_name, embeddings, index_params)
+
+    return InstrumentedRetriever(
+        vectorstore=vectorstore,
+        search_type=search_type,
+        search_kwargs=search_kwargs,
+        compressor=compressor,
+    )
+
+
+def get_active_versions(
+    store_folder_path: str, sharded: bool = False
+) -> Dict[str, str]:
+    """
+    Get the active version of the index of a folder, or of each of its shards.
+
+    Args:
+        store_folder_path (str): Path to the folder containing the FAISS index files.
+        sharded (bool): Whether the folder holds shards, see setup_retriever. Defaults to False.
+
+    Returns:
+        Dict[str, str]: The vector ID of the active version, by path of the folder holding
+            it. Folders without a complete index, or saved without a manifest, are left out.
+    """
+    folder_paths = (
+        list_shards(store_folder_path).values() if sharded else [store_folder_path]
+    )
+    versions = {}
+
+    for folder_path in folder_paths:
+        vector_id = mf.load_manifest(folder_path)["index_name"]
+        if vector_id is not None:
+            versions[folder_path] = vector_id
+
+    return versions
+
+
+def get_index_name(store_folder_path: str) -> str:
+    """
+    Get the name of the FAISS index to load from a folder.
+
+    Args:
+        store_folder_path (str): Path to the folder containing the FAISS index files.
+
+    Returns:
+        str: The index name, without the '.faiss' extension.
+    """
+    manifest = mf.load_manifest(store_folder_path)
+
+    if manifest["index_name"] is not None:
+        return f"{manifest['index_name']}.bin"
+
+    if "pending_index" in manifest:
+        # the files of an unfinished first build must not be served
+        raise Exception("no complete index in " + store_folder_path)
+
+    return find_index_name(store_folder_path)
+
+
+def find_index_name(store_folder_path: str) -> str:
+    """
+    Find the name of the oldest FAISS index saved in a folder without a manifest.
+
+    Args:
+        store_folder_path (str): Path to the folder containing the FAISS index files.
+
+    Returns:
+        str: The index name, without the '.faiss' extension.
+    """
     files = utils.list_files_by_datetime(store_folder_path)
 
     if not files:
@@ -42,24 +440,203 @@ def setup_retriever(
     if not files:
         raise Exception("*.faiss file not found" + ",".join(files))
 
-    index_name = [f.split(".faiss")[0] for f in files][0]
+    return [f.split(".faiss")[0] for f in files][0]
 
-    vectorstore = FAISS.load_local(
-        index_name=index_name,
-        folder_path=store_folder_path,
-        embeddings=embeddings,
-        allow_dangerous_deserialization=True,
-    )
 
-    return vectorstore.as_retriever(
-        search_type=search_type, search_kwargs=search_kwargs
-    )
+class CondensingRetrievalChain(ConversationalRetrievalChain):
+    """
+    Conversational retrieval chain choosing how follow-up questions are rewritten before retrieval.
+
+    With condense_mode "always", a follow-up question is rewritten by the LLM into a
+    standalone question, then retrieved, as by ConversationalRetrievalChain. With "never",
+    it is retrieved as asked, and the chat history only reaches the answer prompt, which
+    saves an LLM call. With "speculative", chunks are retrieved for the question as asked
+    while the LLM rewrites it. They are kept if the rewritten question is at least
+    speculation_threshold similar (cosine similarity of the embeddings) to the original
+    one, and retrieved again for the rewritten question otherwise. A question without
+    chat history is never rewritten.
+    """
+
+    condense_mode: str = "always"
+    speculation_threshold: float = 0.9
+    # model comparing the original and rewritten questions in the speculative mode
+    embeddings: Optional[Embeddings] = None
+
+    def _condenses(self, chat_history_str: str) -> bool:
+        return bool(chat_history_str) and self.condense_mode != "never"
+
+    def _speculates(self, chat_history_str: str) -> bool:
+        return bool(chat_history_str) and self.condense_mode == "speculative"
+
+    def _speculation_holds(
+        self, question: str, new_question: str, embedding: List[float]
+    ) -> bool:
+        holds = new_question.strip() == question.strip()
+
+        if not holds:
+            new_embedding = np.array(self.embeddings.embed_query(new_question))
+            similarity = np.dot(embedding, new_embedding) / (
+                np.linalg.norm(embedding) * np.linalg.norm(new_embedding) or 1
+            )
+            holds = similarity >= self.speculation_threshold
+
+        telemetry.count(
+            "condense.speculation_hits" if holds else "condense.speculation_misses"
+        )
+        return holds
+
+    def _speculate(
+        self,
+        question: str,
+        inputs: Dict[str, Any],
+        run_manager: CallbackManagerForChainRun,
+    ) -> Tuple[List[Document], List[float]]:
+        embedding = self.embeddings.embed_query(question)
+        return self._get_docs(question, inputs, run_manager=run_manager), embedding
+
+    async def _aspeculate(
+        self,
+        question: str,
+        inputs: Dict[str, Any],
+        run_manager: AsyncCallbackManagerForChainRun,
+    ) -> Tuple[List[Document], List[float]]:
+        embedding, docs = await asyncio.gather(
+            asyncio.to_thread(self.embeddings.embed_query, question),
+            self._aget_docs(question, inputs, run_manager=run_manager),
+        )
+        return docs, embedding
+
+    def _answer_inputs(
+        self, inputs: Dict[str, Any], new_question: str, chat_history_str: str
+    ) -> Dict[str, Any]:
+        new_inputs = inputs.copy()
+        if self.rephrase_question:
+            new_inputs["question"] = new_question
+        new_inputs["chat_history"] = chat_history_str
+        return new_inputs
+
+    def _output(
+        self, docs: List[Document], new_question: str, answer: Optional[str]
+    ) -> Dict[str, Any]:
+        output: Dict[str, Any] = {
+            self.output_key: (
+                self.response_if_no_docs_found if answer is None else answer
+            )
+        }
+        if self.return_source_documents:
+            output["source_documents"] = docs
+        if self.return_generated_question:
+            output["generated_question"] = new_question
+        return output
+
+    def _no_docs(self, docs: List[Document]) -> bool:
+        return self.response_if_no_docs_found is not None and not docs
+
+    def _call(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        question = inputs["question"]
+        chat_history_str = (self.get_chat_history or _get_chat_history)(
+            inputs["chat_history"]
+        )
+        new_question = question
+        speculation: Optional[Future] = None
+        docs = None
+
+        if self._speculates(chat_history_str):
+            pool = ThreadPoolExecutor(max_workers=1)
+            speculation = pool.submit(self._speculate, question, inputs, _run_manager)
+            pool.shutdown(wait=False)
+
+        if self._condenses(chat_history_str):
+            new_question = self.question_generator.run(
+                question=question,
+                chat_history=chat_history_str,
+                callbacks=_run_manager.get_child(),
+            )
+
+        if speculation is not None:
+            speculated, embedding = speculation.result()
+            if self._speculation_holds(question, new_question, embedding):
+                docs = speculated
+
+        if docs is None:
+            docs = self._get_docs(new_question, inputs, run_manager=_run_manager)
+
+        answer = None
+        if not self._no_docs(docs):
+            answer = self.combine_docs_chain.run(
+                input_documents=docs,
+                callbacks=_run_manager.get_child(),
+                **self._answer_inputs(inputs, new_question, chat_history_str),
+            )
+
+        return self._output(docs, new_question, answer)
+
+    async def _acall(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        _run_manager = run_manager or AsyncCallbackManagerForChainRun.get_noop_manager()
+        question = inputs["question"]
+        chat_history_str = (self.get_chat_history or _get_chat_history)(
+            inputs["chat_history"]
+        )
+        new_question = question
+        speculation: Optional[asyncio.Task] = None
+        docs = None
+
+        if self._speculates(chat_history_str):
+            speculation = asyncio.ensure_future(
+                self._aspeculate(question, inputs, _run_manager)
+            )
+
+        try:
+            if self._condenses(chat_history_str):
+                new_question = await self.question_generator.arun(
+                    question=question,
+                    chat_history=chat_history_str,
+                    callbacks=_run_manager.get_child(),
+                )
+        except BaseException:
+            if speculation is not None:
+                speculation.cancel()
+            raise
+
+        if speculation is not None:
+            speculated, embedding = await speculation
+            if await asyncio.to_thread(
+                self._speculation_holds, question, new_question, embedding
+            ):
+                docs = speculated
+
+        if docs is None:
+            docs = await self._aget_docs(new_question, inputs, run_manager=_run_manager)
+
+        answer = None
+        if not self._no_docs(docs):
+            answer = await self.combine_docs_chain.arun(
+                input_documents=docs,
+                callbacks=_run_manager.get_child(),
+                **self._answer_inputs(inputs, new_question, chat_history_str),
+            )
+
+        return self._output(docs, new_question, answer)
 
 
 def setup_chain(
     retriever: BaseRetriever,
     llm: BaseLLM,
     chat_template: str,
+    use_memory: bool = True,
+    max_history_tokens: Optional[int] = None,
+    condense_mode: str = "always",
+    embeddings: Optional[Embeddings] = None,
+    speculation_threshold: float = 0.9,
 ) -> ConversationalRetrievalChain:
     """
     Set up a conversational retrieval chain with memory.
@@ -68,28 +645,157 @@ def setup_chain(
         retriever (BaseRetriever): The retriever object.
         llm (BaseLLM): The language model instance.
         chat_template (str): Template string for the conversational prompt.
+        use_memory (bool): Whether the chain remembers the conversation. Without memory, the
+            chat history must be passed with each question. Defaults to True.
+        max_history_tokens (Optional[int]): Token budget of the remembered history, beyond which
+            older turns are summarized, see TokenBudgetMemory. Defaults to None (keep every turn).
+        condense_mode (str): When follow-up questions are rewritten with the chat history:
+            'always', 'never' or 'speculative', see CondensingRetrievalChain. Defaults to 'always'.
+        embeddings (Optional[Embeddings]): Embedding model comparing the original and rewritten
+            questions. Required by the 'speculative' mode. Defaults to None.
+        speculation_threshold (float): Minimum cosine similarity between the original and
+            rewritten questions to keep the chunks retrieved for the original one. Defaults to 0.9.
 
     Returns:
         ConversationalRetrievalChain: Configured conversational retrieval chain.
     """
-    memory = ConversationBufferMemory(
+    if condense_mode not in CONDENSE_MODES:
+        raise ValueError(f"Unknown condense mode: {condense_mode}")
+
+    if condense_mode == "speculative" and embeddings is None:
+        raise ValueError("The speculative condense mode requires embeddings")
+
+    memory = None
+    memory_kwargs = dict(
         memory_key="chat_history",
         input_key="question",
         output_key="answer",
         return_messages=True,
     )
 
+    if use_memory and max_history_tokens:
+        memory = TokenBudgetMemory(
+            llm=llm, max_token_limit=max_history_tokens, **memory_kwargs
+        )
+    elif use_memory:
+        memory = ConversationBufferMemory(**memory_kwargs)
+
     prompt_template = PromptTemplate(
         template=chat_template,
         input_variables=["context", "question", "chat_history"],
     )
 
-    return ConversationalRetrievalChain.from_llm(
+    chain = CondensingRetrievalChain.from_llm(
         llm=llm,
         retriever=retriever,
         memory=memory,
-        combine_docs_chain_kwargs={"prompt": prompt_template},
+        combine_docs_chain_kwargs={"prompt": prompt_template, "tags": [ANSWER_TAG]},
+        condense_mode=condense_mode,
+        embeddings=embeddings,
+        speculation_threshold=speculation_threshold,
     )
+    chain.question_generator.tags = [CONDENSE_TAG]
+
+    return chain
+
+
+class TokenUsage(BaseCallbackHandler):
+    """
+    Callback adding up the tokens reported by the LLM calls made for a question.
+
+    Attributes:
+        usage (Dict[str, int]): Input, output and total tokens, and number of LLM calls.
+    """
+
+    run_inline = True
+
+    def __init__(self) -> None:
+        """
+        Initialize the counters at zero.
+        """
+        self.usage = {
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "total_tokens": 0,
+            "llm_calls": 0,
+        }
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        """
+        Add the usage metadata of a finished LLM call. Models that do not report it only count as a call.
+
+        Args:
+            response (LLMResult): The output of the call.
+        """
+        self.usage["llm_calls"] += 1
+
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(
+                    getattr(generation, "message", None), "usage_metadata", None
+                )
+                for key in ("input_tokens", "output_tokens", "total_tokens"):
+                    self.usage[key] += (metadata or {}).get(key, 0)
+
+
+class StageTimer(BaseCallbackHandler):
+    """
+    Callback recording the duration of the stages of a question as telemetry spans.
+
+    The spans are ask.condense (rewriting the question with the chat history), ask.answer
+    (prompt assembly and generation) and ask.llm (each LLM call). Retrieval is timed
+    by InstrumentedRetriever.
+    """
+
+    run_inline = True
+
+    def __init__(self) -> None:
+        """
+        Initialize the timer, with no stage in progress.
+        """
+        self._stages: Dict[Any, str] = {}
+        self._starts: Dict[Any, float] = {}
+
+    def _start(self, stage: str, run_id: Any, parent_run_id: Any) -> None:
+        self._stages[run_id] = stage
+        # nested runs of the same stage (e.g. the LLMChain of the answer chain) are not timed twice
+        if self._stages.get(parent_run_id) != stage:
+            self._starts[run_id] = time.perf_counter()
+
+    def _end(self, run_id: Any) -> None:
+        stage = self._stages.pop(run_id, None)
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            telemetry.record_span(f"ask.{stage}", time.perf_counter() - start)
+
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, **kwargs
+    ):
+        for tag in (ANSWER_TAG, CONDENSE_TAG):
+            if tag in (tags or []):
+                self._start(tag, run_id, parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_start(
+        self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs
+    ):
+        self._start("llm", run_id, parent_run_id)
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id, parent_run_id=None, **kwargs
+    ):
+        self._start("llm", run_id, parent_run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
 
 
 class QA:
@@ -97,16 +803,22 @@ class QA:
     Class to represent a question and answer pair.
     """
 
-    def __init__(self, question: str, answer: Optional[str] = None) -> None:
+    def __init__(
+        self, question: str, answer: Optional[str] = None, error: Optional[str] = None
+    ) -> None:
         """
         Initialize a QA instance.
 
         Args:
             question (str): The user's question.
             answer (Optional[str]): The model's answer. Defaults to None.
+            error (Optional[str]): Why no answer could be produced. Defaults to None.
         """
         self.question = question
         self.answer = answer
+        self.error = error
+        # tokens used by the LLM calls of the question, None when answered from the cache
+        self.token_usage: Optional[Dict[str, int]] = None
 
     def set_answer(self, answer: str) -> None:
         """
@@ -133,7 +845,11 @@ class Chat:
     """
 
     def __init__(
-        self, store_folder_path: str, db_path: str, chat_template: str
+        self,
+        store_folder_path: str,
+        db_path: str,
+        chat_template: str,
+        session_id: Optional[str] = None,
     ) -> None:
         """
         Initialize the Chat instance.
@@ -142,14 +858,186 @@ class Chat:
             store_folder_path (str): Path to the folder containing FAISS index files.
             db_path (str): Path to the folder containing database data.
             chat_template (str): Template string for the chat prompts.
+            session_id (Optional[str]): Identifier of the conversation, under which the
+                interactions are logged. Defaults to a new unique ID.
         """
-        embeddings = models.get_embeddings()
-        llm = models.get_llm()
-        retriever = setup_retriever(
-            store_folder_path=store_folder_path, embeddings=embeddings
+        self.session_id = session_id or utils.get_unique_id()
+        telemetry.setup()
+        embeddings = registry.get_embeddings()
+        llm = registry.get_llm()
+        self._embeddings = embeddings
+        self._store_folder_path = store_folder_path
+        # read before loading: a version activated meanwhile is switched to by refresh
+        sharded = (
+            bool(list_shards(store_folder_path))
+            and mf.load_manifest(store_folder_path)["index_name"] is None
+        )
+        self._versions = get_active_versions(store_folder_path, sharded)
+        compressor = None
+        if config.context_max_tokens:
+            compressor = registry.get_context_compressor(embeddings)
+        self._retriever = retriever = setup_retriever(
+            store_folder_path=store_folder_path,
+            embeddings=embeddings,
+            compressor=compressor,
+        )
+        self._index_id = (
+            retriever.index_id
+            if isinstance(retriever, ShardedRetriever)
+            else get_index_name(store_folder_path)
+        )
+        # versions of the index in use, released when the Chat switches or is collected
+        self._leases: List[Tuple[str, str]] = []
+        weakref.finalize(self, snapshots.release_all, self._leases)
+        self._hold(self._versions)
+        self._refresh_lock = threading.Lock()
+        self._refresh_checked = time.monotonic()
+        self._scope = None
+        self._semantic_cache = None
+        self._update_semantic_cache()
+        self._qa_chain = setup_chain(
+            retriever,
+            llm,
+            chat_template,
+            max_history_tokens=config.memory_max_tokens,
+            condense_mode=config.condense_mode,
+            embeddings=embeddings,
+            speculation_threshold=config.condense_speculation_threshold,
+        )
+        # batched questions are answered independently of the conversation
+        self._batch_chain = setup_chain(retriever, llm, chat_template, use_memory=False)
+        self._db_handler = db.DatabaseHandler(
+            db_path=db_path, background_writes=config.db_background_writes
         )
-        self._qa_chain = setup_chain(retriever, llm, chat_template)
-        self._db_handler = db.DatabaseHandler(db_path=db_path)
+        # last row seen by sync_history, and interactions logged here since
+        self._history_last_id: Optional[int] = None
+        self._logged: deque = deque()
+
+    def set_sources(self, sources: Optional[List[str]]) -> None:
+        """
+        Restrict the following questions to some of the indexed documents, without rebuilding the index.
+
+        Answers are cached separately for each selection of documents.
+
+        Args:
+            sources (Optional[List[str]]): Paths of the documents to search, as indexed by
+                vectorstore.run, or None to search every document.
+        """
+        self._scope = None if sources is None else tuple(sorted(sources))
+        self._retriever.sources = None if sources is None else list(sources)
+        self._update_semantic_cache()
+
+    def load_shard(self, name: str, store_folder_path: str) -> None:
+        """
+        Search a shard, or its new version once rebuilt, along with the loaded ones.
+
+        Only applies to a Chat over a folder of shards, see setup_retriever.
+
+        Args:
+            name (str): Name of the shard.
+            store_folder_path (str): Path to the folder containing the index files of the shard.
+        """
+        self._retriever.load_shard(name, store_folder_path)
+        self._index_id = self._retriever.index_id
+        self._update_semantic_cache()
+
+    def unload_shard(self, name: str) -> None:
+        """
+        Stop searching a shard.
+
+        Args:
+            name (str): Name of the shard.
+        """
+        self._retriever.unload_shard(name)
+        self._index_id = self._retriever.index_id
+        self._update_semantic_cache()
+
+    def refresh(self) -> bool:
+        """
+        Switch to the active version of the index, if it changed since it was loaded.
+
+        The new version is loaded while questions are still answered from the current
+        one, which is then released, and removed once no session uses it and it is not
+        kept for rollback, see snapshots.collect_garbage. Questions call it in the
+        background every config.index_refresh_interval seconds.
+
+        Returns:
+            bool: True if the Chat switched to another version.
+        """
+        with self._refresh_lock:
+            sharded = isinstance(self._retriever, ShardedRetriever)
+            versions = get_active_versions(self._store_folder_path, sharded)
+
+            if versions == self._versions or not (sharded or versions):
+                return False
+
+            if sharded:
+                for folder_path in self._versions.keys() - versions.keys():
+                    self._retriever.unload_shard(os.path.basename(folder_path))
+                for folder_path, vector_id in versions.items():
+                    if self._versions.get(folder_path) != vector_id:
+                        self._retriever.load_shard(
+                            os.path.basename(folder_path), folder_path
+                        )
+                self._index_id = self._retriever.index_id
+            else:
+                index_name = f"{versions[self._store_folder_path]}.bin"
+                # searches in progress keep the vector store they started with
+                self._retriever.vectorstore = load_index(
+                    self._store_folder_path, index_name, self._embeddings
+                )
+                self._index_id = index_name
+
+            self._update_semantic_cache()
+            previous, self._versions = self._versions, versions
+            self._hold(versions)
+            self._release(previous)
+
+            return True
+
+    def _hold(self, versions: Dict[str, str]) -> None:
+        for folder_path, vector_id in versions.items():
+            snapshots.acquire(folder_path, vector_id)
+            self._leases.append((folder_path, vector_id))
+
+    def _release(self, versions: Dict[str, str]) -> None:
+        for folder_path, vector_id in versions.items():
+            self._leases.remove((folder_path, vector_id))
+
+            # the last session of the process using the version frees its memory
+            if snapshots.release(folder_path, vector_id):
+                registry.invalidate(f"{vector_id}.bin")
+                snapshots.collect_garbage(folder_path)
+
+    def _check_index(self) -> None:
+        # questions never wait for a new version: it is looked for and loaded in the background
+        interval = config.index_refresh_interval
+        now = time.monotonic()
+
+        if (
+            not interval
+            or now - self._refresh_checked < interval
+            or self._refresh_lock.locked()
+        ):
+            return
+
+        self._refresh_checked = now
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def _refresh_in_background(self) -> None:
+        try:
+            if self.refresh():
+                telemetry.count("index.switches")
+        except Exception as e:
+            # the current version keeps being served, and the switch is retried later
+            print(f"Index refresh failed: {e!r}")
+
+    def _update_semantic_cache(self) -> None:
+        # answers are cached per set of searched indexes and documents
+        if config.semantic_cache_enabled:
+            self._semantic_cache = registry.get_semantic_cache(
+                self._index_id, self._embeddings, scope=self._scope
+            )
 
     def ask(self, question: str) -> QA:
         """
@@ -162,9 +1050,235 @@ class Chat:
             QA: A QA object with the question and model's answer.
         """
         qa = QA(question=question)
-        qa.set_answer(self._qa_chain.run({"question": question}))
+        self._check_index()
+
+        if self._answer_from_cache(qa):
+            return qa
+
+        start = time.perf_counter()
+        standalone = self._is_standalone()
+        usage, callbacks = self._callbacks()
+        qa.set_answer(self._qa_chain.run({"question": question}, callbacks=callbacks))
+        self._finish(qa, usage, start)
+        self._cache_answer(qa, standalone)
+        return qa
+
+    def _callbacks(self) -> Tuple[TokenUsage, List[BaseCallbackHandler]]:
+        usage = TokenUsage()
+        # the stages are only timed when a telemetry sink is installed
+        return usage, ([usage, StageTimer()] if telemetry.enabled() else [usage])
+
+    def _finish(self, qa: QA, usage: TokenUsage, start: float) -> None:
+        qa.token_usage = usage.usage
+        telemetry.record_span("ask.total", time.perf_counter() - start)
+        telemetry.observe("ask.input_tokens", usage.usage["input_tokens"])
+        telemetry.observe("ask.output_tokens", usage.usage["output_tokens"])
+
+    def _is_standalone(self) -> bool:
+        # without chat history (or its summary), the question does not depend on earlier turns
+        return not self._qa_chain.memory.buffer
+
+    def _answer_from_cache(self, qa: QA) -> bool:
+        if self._semantic_cache is None or not self._is_standalone():
+            return False
+
+        answer = self._semantic_cache.lookup(qa.question)
+
+        if answer is None:
+            return False
+
+        qa.set_answer(answer)
+        self._qa_chain.memory.save_context(
+            {"question": qa.question}, {"answer": answer}
+        )
+        return True
+
+    def _cache_answer(self, qa: QA, standalone: bool) -> None:
+        if self._semantic_cache is not None and standalone and qa.answer:
+            self._semantic_cache.add(qa.question, qa.answer)
+
+    async def aask(self, question: str) -> QA:
+        """
+        Async version of ask.
+
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            QA: A QA object with the question and model's answer.
+        """
+        qa = QA(question=question)
+        self._check_index()
+
+        if await asyncio.to_thread(self._answer_from_cache, qa):
+            return qa
+
+        start = time.perf_counter()
+        standalone = self._is_standalone()
+        usage, callbacks = self._callbacks()
+        output = await self._qa_chain.ainvoke(
+            {"question": question}, config={"callbacks": callbacks}
+        )
+        qa.set_answer(output["answer"])
+        self._finish(qa, usage, start)
+        await asyncio.to_thread(self._cache_answer, qa, standalone)
         return qa
 
+    async def abatch_ask(
+        self,
+        questions: List[str],
+        concurrency: int = 8,
+        timeout: Optional[float] = None,
+        rate_limit: Optional[float] = None,
+    ) -> List[QA]:
+        """
+        Answer many independent questions concurrently.
+
+        Questions do not see each other nor the conversation held by ask. Retrieval and
+        LLM calls of up to `concurrency` questions overlap, and new questions are started
+        at no more than `rate_limit` per second. A question that fails or exceeds the
+        timeout gets no answer and the reason in its error attribute.
+
+        Args:
+            questions (List[str]): The questions to answer.
+            concurrency (int): Maximum number of questions in flight. Defaults to 8.
+            timeout (Optional[float]): Maximum number of seconds per question. Defaults to
+                config.llm_request_timeout.
+            rate_limit (Optional[float]): Maximum number of questions started per second.
+                Defaults to config.llm_rate_limit.
+
+        Returns:
+            List[QA]: One QA object per question, in the same order.
+        """
+        self._check_index()
+        timeout = timeout or config.llm_request_timeout
+        limiter = utils.RateLimiter(rate_limit or config.llm_rate_limit)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def ask_one(question: str) -> QA:
+            qa = QA(question=question)
+
+            try:
+                # the cache embeds the question synchronously, keep it off the event loop
+                if self._semantic_cache is not None:
+                    answer = await asyncio.to_thread(
+                        self._semantic_cache.lookup, question
+                    )
+                    if answer is not None:
+                        qa.set_answer(answer)
+                        return qa
+
+                async with semaphore:
+                    await limiter.acquire()
+                    start = time.perf_counter()
+                    usage, callbacks = self._callbacks()
+                    output = await asyncio.wait_for(
+                        self._batch_chain.ainvoke(
+                            {"question": question, "chat_history": []},
+                            config={"callbacks": callbacks},
+                        ),
+                        timeout,
+                    )
+                    qa.set_answer(output["answer"])
+                    self._finish(qa, usage, start)
+
+                await asyncio.to_thread(self._cache_answer, qa, True)
+            except asyncio.TimeoutError:
+                qa.error = f"timed out after {timeout}s"
+            except Exception as e:
+                qa.error = repr(e)
+
+            return qa
+
+        return await asyncio.gather(*(ask_one(q) for q in questions))
+
+    def batch_ask(
+        self,
+        questions: List[str],
+        concurrency: int = 8,
+        timeout: Optional[float] = None,
+        rate_limit: Optional[float] = None,
+    ) -> List[QA]:
+        """
+        Answer many independent questions concurrently, see abatch_ask.
+
+        Args:
+            questions (List[str]): The questions to answer.
+            concurrency (int): Maximum number of questions in flight. Defaults to 8.
+            timeout (Optional[float]): Maximum number of seconds per question. Defaults to
+                config.llm_request_timeout.
+            rate_limit (Optional[float]): Maximum number of questions started per second.
+                Defaults to config.llm_rate_limit.
+
+        Returns:
+            List[QA]: One QA object per question, in the same order.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.abatch_ask(questions, concurrency, timeout, rate_limit),
+            registry.get_event_loop(),
+        ).result()
+
+    def ask_stream(self, question: str) -> Tuple[QA, Iterator[str]]:
+        """
+        Process a user's question through the QA chain, streaming the answer as it is generated.
+
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            Tuple[QA, Iterator[str]]: The QA object, whose answer is set once the iterator is
+                exhausted, and an iterator over the answer tokens.
+        """
+        qa, tokens = self.aask_stream(question)
+        return qa, utils.iter_sync(tokens, registry.get_event_loop())
+
+    def aask_stream(self, question: str) -> Tuple[QA, AsyncIterator[str]]:
+        """
+        Async version of ask_stream.
+
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            Tuple[QA, AsyncIterator[str]]: The QA object, whose answer is set once the iterator is
+                exhausted, and an async iterator over the answer tokens.
+        """
+        qa = QA(question=question)
+        return qa, self._astream_answer(qa)
+
+    async def _astream_answer(self, qa: QA) -> AsyncIterator[str]:
+        self._check_index()
+
+        if await asyncio.to_thread(self._answer_from_cache, qa):
+            yield qa.answer
+            return
+
+        start = time.perf_counter()
+        standalone = self._is_standalone()
+        answer_run_ids = set()
+        usage, callbacks = self._callbacks()
+
+        async for event in self._qa_chain.astream_events(
+            {"question": qa.question}, config={"callbacks": callbacks}, version="v2"
+        ):
+            kind = event["event"]
+
+            if kind == "on_chain_start" and ANSWER_TAG in event.get("tags", []):
+                answer_run_ids.add(event["run_id"])
+            elif kind in ("on_chat_model_stream", "on_llm_stream"):
+                # skip the tokens of the question-condensing call
+                if answer_run_ids.isdisjoint(event["parent_ids"]):
+                    continue
+                chunk = event["data"]["chunk"]
+                token = chunk.content if hasattr(chunk, "content") else chunk.text
+                if token:
+                    yield token
+            elif kind == "on_chain_end" and not event["parent_ids"]:
+                qa.set_answer(event["data"]["output"]["answer"])
+
+        self._finish(qa, usage, start)
+        await asyncio.to_thread(self._cache_answer, qa, standalone)
+
     def log(self, qa: QA) -> QA:
         """
         Log the interaction in the database.
@@ -175,14 +1289,64 @@ class Chat:
         Returns:
             QA: The logged QA instance.
         """
-        self._db_handler.log_interaction(qa.question, qa.answer)
+        self._db_handler.log_interaction(qa.question, qa.answer, self.session_id)
+
+        if self._history_last_id is not None:
+            self._logged.append((qa.question, qa.answer))
+
         return qa
 
-    def get_history(self) -> List[db.sqlite3.Row]:
+    def sync_history(self) -> int:
         """
-        Retrieve the chat history from the database.
+        Add the interactions of the session logged by other Chat instances to the conversation memory.
+
+        Processes of the API server may each answer questions of the same session: each
+        one remembers what the others answered before answering the next question. The
+        first call loads the latest page of the history (config.history_page_size).
 
         Returns:
-            List[sqlite3.Row]: A list of rows representing the interaction history.
+            int: The number of interactions added.
         """
-        return self._db_handler.fetch_all_interactions()
+        if self._history_last_id is None:
+            rows = self.get_history(limit=config.history_page_size)
+            self._history_last_id = 0
+        else:
+            rows = self.get_history(after_id=self._history_last_id)
+
+        added = 0
+        for row in rows:
+            self._history_last_id = row[0]
+
+            if self._logged and self._logged[0] == (row[1], row[2]):
+                self._logged.popleft()
+                continue
+
+            self._qa_chain.memory.save_context({"question": row[1]}, {"answer": row[2]})
+            added += 1
+
+        return added
+
+    def get_history(
+        self,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> List[db.sqlite3.Row]:
+        """
+        Retrieve a page of the conversation history from the database.
+
+        Pass the ID of the last row already shown as after_id to only fetch new
+        interactions, or a limit alone to fetch the latest ones, see
+        DatabaseHandler.fetch_interactions.
+
+        Args:
+            after_id (Optional[int]): Only return rows logged after this one. Defaults to None.
+            before_id (Optional[int]): Only return rows logged before this one. Defaults to None.
+            limit (Optional[int]): Maximum number of rows. Defaults to None (no limit).
+
+        Returns:
+            List[sqlite3.Row]: A list of rows representing the interaction history, oldest first.
+        """
+        return self._db_handler.fetch_interactions(
+            self.session_id, after_id=after_id, before_id=before_id, limit=limit
+        )
@@ -0,0 +1,184 @@
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Sequence
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain_core.documents import Document
+
+import telemetry
+
+# sentence ends: punctuation followed by whitespace, or line breaks (titles, list items)
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+|\s*\n\s*")
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split a text into sentences.
+
+    Args:
+        text (str): The text, e.g. a chunk extracted from a PDF.
+
+    Returns:
+        List[str]: The non-empty sentences, in order.
+    """
+    return [s for s in (s.strip() for s in _SENTENCE_END.split(text)) if s]
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text, without calling the model.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The approximate number of tokens, at 4 characters per token.
+    """
+    return math.ceil(len(text) / 4)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class ContextCompressor:
+    """
+    Pack the chunks retrieved for a question into a token budget before they reach the prompt.
+
+    The chunks are split into sentences, which are scored by cosine similarity with the
+    query embedding. The most similar sentences are selected until the budget is full,
+    skipping those below min_similarity (except the best one) and those nearly identical
+    to a selected one. The selected sentences are put back in their chunks, in their
+    original order, and chunks left without sentences are dropped.
+
+    Sentence embeddings are kept in a bounded in-memory LRU cache, as the same chunks are
+    often retrieved again; they are not written to the on-disk embedding cache, which
+    holds the chunks of the index.
+
+    Attributes:
+        stats (Dict[str, int]): Retrieved chunks, and tokens before and after compression, since creation.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_tokens: int = 600,
+        min_similarity: float = 0.2,
+        redundancy_threshold: float = 0.9,
+        cache_size: int = 10000,
+    ) -> None:
+        """
+        Initialize the compressor.
+
+        Args:
+            embeddings (Embeddings): The model that embedded the query, without the on-disk
+                cache of CachedEmbeddings. Sentences are embedded with embed_documents.
+            max_tokens (int): Token budget of the context. Defaults to 600.
+            min_similarity (float): Minimum cosine similarity of a sentence with the query.
+                Defaults to 0.2.
+            redundancy_threshold (float): Cosine similarity with a selected sentence above which
+                a sentence is redundant. Defaults to 0.9.
+            cache_size (int): Number of sentence embeddings kept in memory. Defaults to 10000.
+        """
+        self.embeddings = embeddings
+        self.max_tokens = max_tokens
+        self.min_similarity = min_similarity
+        self.redundancy_threshold = redundancy_threshold
+        self.cache_size = cache_size
+        self.stats = {"chunks": 0, "tokens_in": 0, "tokens_out": 0}
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _embed(self, sentences: List[str]) -> np.ndarray:
+        with self._lock:
+            cached = {s: self._cache[s] for s in sentences if s in self._cache}
+            for s in cached:
+                self._cache.move_to_end(s)
+
+        missing = list(dict.fromkeys(s for s in sentences if s not in cached))
+        if missing:
+            # embedded outside the lock, in a single batch
+            computed = _normalize(
+                np.array(self.embeddings.embed_documents(missing), dtype=np.float32)
+            )
+            cached.update(zip(missing, computed))
+
+            with self._lock:
+                self._cache.update(zip(missing, computed))
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return np.array([cached[s] for s in sentences])
+
+    def compress(
+        self, query_embedding: Sequence[float], docs: List[Document]
+    ) -> List[Document]:
+        """
+        Compress retrieved chunks to the token budget.
+
+        Args:
+            query_embedding (Sequence[float]): The embedding the chunks were retrieved with.
+            docs (List[Document]): The chunks, most relevant first.
+
+        Returns:
+            List[Document]: The chunks keeping a part of their text, in the same order and
+                with the same metadata.
+        """
+        sentences = [
+            (i, s)
+            for i, doc in enumerate(docs)
+            for s in split_sentences(doc.page_content)
+        ]
+        tokens_in = sum(count_tokens(doc.page_content) for doc in docs)
+
+        if not sentences:
+            return docs
+
+        vectors = self._embed([s for _, s in sentences])
+        scores = vectors @ _normalize(np.array(query_embedding, dtype=np.float32))
+
+        selected: List[int] = []
+        budget = self.max_tokens
+
+        order = np.argsort(-scores, kind="stable")
+
+        for j in order:
+            # the most similar sentence is kept even below min_similarity
+            if scores[j] < self.min_similarity and j != order[0]:
+                break
+
+            tokens = count_tokens(sentences[j][1])
+            if tokens > budget:
+                continue
+
+            if (
+                selected
+                and (vectors[selected] @ vectors[j]).max() > self.redundancy_threshold
+            ):
+                continue
+
+            selected.append(j)
+            budget -= tokens
+
+        kept: Dict[int, List[str]] = {}
+        for j in sorted(selected):
+            kept.setdefault(sentences[j][0], []).append(sentences[j][1])
+
+        compressed = [
+            Document(page_content=" ".join(kept[i]), metadata=doc.metadata, id=doc.id)
+            for i, doc in enumerate(docs)
+            if i in kept
+        ]
+        tokens_out = sum(count_tokens(doc.page_content) for doc in compressed)
+
+        self.stats["chunks"] += len(docs)
+        self.stats["tokens_in"] += tokens_in
+        self.stats["tokens_out"] += tokens_out
+        telemetry.observe("context.tokens", tokens_out)
+        telemetry.count("context.tokens_saved", tokens_in - tokens_out)
+
+        return compressed
@@ -4,6 +4,142 @@ output_folder_path = "./data/output"
 
 db_path = "./data/database/chatbot_history.db"
 
+# commit logged interactions in batches from a background thread
+db_background_writes = True
+
+# number of past interactions shown when a conversation is opened
+history_page_size = 50
+
+# ingestion jobs, run by a worker process (see jobs.py): queue database, seconds between
+# two polls of the queue by the worker and of a job by the UI, and seconds an idle
+# worker waits for a new job before exiting
+jobs_db_path = "./data/database/jobs.db"
+jobs_poll_interval = 1.0
+jobs_worker_idle_timeout = 300
+
+# HTTP API (server.py): address, number of worker processes, requests answered at a
+# time per worker, requests waiting for a thread per worker beyond which new ones get
+# 429, seconds a request may wait before getting 503, seconds given to running requests
+# on shutdown, and conversations kept in memory per worker
+server_host = "127.0.0.1"
+server_port = 8000
+server_workers = 2
+server_threads = 8
+server_queue_size = 64
+server_queue_timeout = 30
+server_shutdown_timeout = 30
+server_max_sessions = 1000
+
+# load the embedding model, LLM client and index in the background once the UI is served
+warmup_enabled = True
+
+# file written when warm-up is over, for a container readiness probe (None disables it)
+warmup_ready_file = None
+
+# telemetry of the request and ingestion stages: a JSON-lines file and/or a local
+# Prometheus endpoint (http://127.0.0.1:<port>/metrics); both None disables it
+telemetry_jsonl_path = None
+telemetry_prometheus_port = None
+
+# token budget of the conversation memory: older turns are folded into a summary
+# written by the LLM (None keeps every turn verbatim)
+memory_max_tokens = 2000
+
+# how follow-up questions are rewritten with the chat history before retrieval (see
+# chat.CondensingRetrievalChain): "always" (an LLM call before retrieving), "never"
+# (retrieve the question as asked) or "speculative" (retrieve the question as asked while
+# it is rewritten, and keep those chunks if the rewritten question has at least this
+# cosine similarity with the original one); the other modes than "always" may change
+# the chunks retrieved, and so the answers
+condense_mode = "always"
+condense_speculation_threshold = 0.9
+
+# token budget of the retrieved context: the sentences of the retrieved chunks most
+# similar to the question are kept, dropping those below context_min_similarity and those
+# repeating a kept one (cosine similarity above context_redundancy_threshold); None, the
+# default, puts the chunks in the prompt whole. context_cache_size sentence embeddings
+# are kept in memory
+context_max_tokens = None
+context_min_similarity = 0.2
+context_redundancy_threshold = 0.9
+context_cache_size = 10000
+
+# embedding backend: "torch" (sentence-transformers) or "onnx" (the int8-quantized ONNX
+# export in onnx_model_folder_path, see onnx_embeddings.py); changing it rebuilds the index
+embedding_backend = "torch"
+onnx_model_folder_path = "./data/models/all-mpnet-base-v2-onnx-int8"
+
+# number of threads of one ONNX inference (None uses every CPU core)
+onnx_num_threads = None
+
+# on-disk cache of chunk embeddings (None disables it)
+embedding_cache_folder_path = "./data/cache/embeddings"
+
+# maximum size of the embedding cache, per model
+embedding_cache_max_mb = 512
+
+# number of processes used to parse PDFs (None uses every CPU core)
+ingest_max_workers = None
+
+# maximum number of seconds spent parsing a single PDF
+ingest_file_timeout = 300
+
+# number of chunks embedded and appended to the index at a time
+embedding_batch_size = 64
+
+# number of embedded batches between two saves of a partially built index
+index_checkpoint_batches = 20
+
+# embed and store repeated chunks (e.g. general conditions shared by several products)
+# once: chunks whose word 5-grams have at least this estimated Jaccard similarity with
+# an indexed chunk are recorded as references to it
+dedup_enabled = True
+dedup_threshold = 0.85
+
+# seconds between two checks by a Chat for a new active version of its index, loaded in
+# the background (None never switches), and number of most recent versions kept for
+# rollback besides those in use (see snapshots.py)
+index_refresh_interval = 5
+index_keep_versions = 2
+
+# FAISS index type: "flat" (exact search), "ivf_flat", "ivf_pq" or "hnsw"
+index_type = "flat"
+
+# nlist/nprobe: IVF lists and lists searched per query; pq_m/pq_nbits: PQ code size;
+# m/ef_construction/ef_search: HNSW graph degree and build/search beam width
+index_params = {
+    "nlist": 1024,
+    "nprobe": 16,
+    "pq_m": 64,
+    "pq_nbits": 8,
+    "m": 32,
+    "ef_construction": 200,
+    "ef_search": 64,
+}
+
+# number of threads searching the shards of an index in parallel (None for the default
+# of ThreadPoolExecutor)
+search_max_workers = None
+
+# maximum number of LLM requests started per second by batch questions (None for no limit)
+llm_rate_limit = 4
+
+# maximum number of seconds to answer one batch question
+llm_request_timeout = 60
+
+# answer repeated questions from a cache, matching them by embedding similarity; off by
+# default, as a close paraphrase of a question gets its answer
+semantic_cache_enabled = False
+
+# minimum cosine similarity between two questions to reuse an answer
+semantic_cache_threshold = 0.95
+
+# number of seconds a cached answer stays valid (None for no expiry)
+semantic_cache_ttl = 24 * 60 * 60
+
+# maximum number of cached answers per index
+semantic_cache_max_entries = 1000
+
 chat_template = """
 Com base nos dados fornecidos: chat history(delimitado por <hs></hs>)
 e context (delimitado por <ctx></ctx>).
@@ -1,5 +1,227 @@
-from typing import List
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import atexit
+import queue
 import sqlite3
+import threading
+
+# applied to every connection: WAL lets readers run alongside the writer, and
+# synchronous=NORMAL only fsyncs at checkpoints, which is safe in WAL mode
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+
+_lock = threading.Lock()
+_pools: Dict[str, "ConnectionPool"] = {}
+_writers: Dict[str, "BackgroundWriter"] = {}
+
+# reads wait at most this many seconds for the session's own queued writes
+READ_FLUSH_TIMEOUT = 1.0
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of SQLite connections to a single database.
+    """
+
+    def __init__(self, db_path: str, size: int = 4) -> None:
+        """
+        Initialize an empty pool; connections are opened on demand.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+            size (int): Maximum number of idle connections kept open. Defaults to 4.
+        """
+        self.db_path = db_path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection from the pool, returning it when the block exits.
+
+        Yields:
+            sqlite3.Connection: An open connection.
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self) -> None:
+        """
+        Close every idle connection.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class BackgroundWriter:
+    """
+    A thread that executes queued writes, committing them in batches.
+
+    Grouping many inserts in one transaction replaces a commit (and fsync) per
+    interaction with one per batch, and takes database writes off the request path.
+    """
+
+    def __init__(self, pool: ConnectionPool, batch_size: int = 100) -> None:
+        """
+        Initialize and start the writer thread.
+
+        Args:
+            pool (ConnectionPool): Pool providing the connection used for writing.
+            batch_size (int): Maximum number of writes committed together. Defaults to 100.
+        """
+        self.pool = pool
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._done = threading.Condition()
+        self._submitted = 0
+        self._written = 0
+        self._thread = threading.Thread(
+            target=self._run, name="sqlite-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, query: str, params: Tuple[Any, ...]) -> int:
+        """
+        Queue a write.
+
+        Args:
+            query (str): The SQL statement.
+            params (Tuple[Any, ...]): The statement parameters.
+
+        Returns:
+            int: Sequence number of the write, to be passed to flush.
+        """
+        with self._done:
+            self._submitted += 1
+            self._queue.put((query, params))
+            return self._submitted
+
+    def flush(
+        self, until: Optional[int] = None, timeout: Optional[float] = None
+    ) -> bool:
+        """
+        Wait until the queued writes have been processed.
+
+        Args:
+            until (Optional[int]): Sequence number of the last write to wait for. Defaults to None (every write queued so far).
+            timeout (Optional[float]): Maximum number of seconds to wait. Defaults to None (no limit).
+
+        Returns:
+            bool: False if the timeout expired first.
+        """
+        with self._done:
+            until = self._submitted if until is None else until
+            return self._done.wait_for(lambda: self._written >= until, timeout)
+
+    def close(self) -> None:
+        """
+        Commit the queued writes and stop the writer thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write(self, writes: List[Tuple[str, Tuple[Any, ...]]]) -> None:
+        try:
+            with self.pool.connection() as conn:
+                with conn:
+                    for query, params in writes:
+                        conn.execute(query, params)
+            return
+        except Exception as e:
+            if len(writes) == 1:
+                print(f"Failed to write interaction: {e!r}")
+                return
+
+        # a single bad row should not lose the rest of the batch
+        for write in writes:
+            self._write([write])
+
+    def _run(self) -> None:
+        running = True
+
+        while running:
+            batch = [self._queue.get()]
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            running = None not in batch
+            writes = [w for w in batch if w is not None]
+
+            try:
+                if writes:
+                    self._write(writes)
+            finally:
+                with self._done:
+                    self._written += len(writes)
+                    self._done.notify_all()
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """
+    Get the process-wide connection pool of a database.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+
+    Returns:
+        ConnectionPool: The shared pool.
+    """
+    with _lock:
+        if db_path not in _pools:
+            _pools[db_path] = ConnectionPool(db_path)
+        return _pools[db_path]
+
+
+def get_writer(db_path: str) -> BackgroundWriter:
+    """
+    Get the process-wide background writer of a database, flushed at interpreter exit.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+
+    Returns:
+        BackgroundWriter: The shared writer.
+    """
+    pool = get_pool(db_path)
+
+    with _lock:
+        if db_path not in _writers:
+            _writers[db_path] = BackgroundWriter(pool)
+            atexit.register(_writers[db_path].close)
+        return _writers[db_path]
 
 
 class DatabaseHandler:
@@ -7,52 +229,97 @@ class DatabaseHandler:
     A class to manage interactions with the SQLite database for chatbot history.
 
     Attributes:
-        conn: SQLite connection object.
+        pool: Pool of SQLite connections to the database.
+        writer: Background writer batching the inserts, or None to write synchronously.
     """
 
-    def __init__(self, db_path: str) -> None:
+    def __init__(self, db_path: str, background_writes: bool = True) -> None:
         """
         Initialize the DatabaseHandler with the database path and create the interactions table if it doesn't exist.
 
         Args:
             db_path (str): Path to the SQLite database file. Defaults to 'chatbot_history.db'.
+            background_writes (bool): Whether inserts are committed in batches by a background
+                thread instead of one by one. Defaults to True.
         """
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
+        self.pool = get_pool(db_path)
+        self.writer: Optional[BackgroundWriter] = (
+            get_writer(db_path) if background_writes else None
+        )
+        self._last_write = 0
         self.create_table()
 
     def create_table(self) -> None:
         """
         Create the interactions table in the database if it doesn't already exist.
+
+        Tables created before conversations were tracked gain the session_id column.
         """
         query = """
         CREATE TABLE IF NOT EXISTS interactions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             question TEXT,
             answer TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            session_id TEXT
         )
         """
-        self.conn.execute(query)
-        self.conn.commit()
-        self.conn.close()
+        with self.pool.connection() as conn:
+            conn.execute(query)
+
+            columns = [
+                row[1] for row in conn.execute("PRAGMA table_info(interactions)")
+            ]
+            if "session_id" not in columns:
+                conn.execute("ALTER TABLE interactions ADD COLUMN session_id TEXT")
 
-    def log_interaction(self, question: str, answer: str) -> None:
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS interactions_session_id "
+                "ON interactions (session_id, id)"
+            )
+            conn.commit()
+
+    def log_interaction(
+        self, question: str, answer: str, session_id: Optional[str] = None
+    ) -> None:
         """
         Log a new interaction into the database.
 
         Args:
             question (str): The user's question.
             answer (str): The chatbot's answer.
+            session_id (Optional[str]): Identifier of the conversation. Defaults to None.
         """
         query = """
-        INSERT INTO interactions (question, answer)
-        VALUES (?, ?)
+        INSERT INTO interactions (question, answer, session_id)
+        VALUES (?, ?, ?)
         """
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.execute(query, (question, answer))
-        self.conn.commit()
-        self.conn.close()
+        params = (question, answer, session_id)
+
+        if self.writer is not None:
+            seq = self.writer.submit(query, params)
+            self._last_write = max(self._last_write, seq)
+            return
+
+        with self.pool.connection() as conn:
+            conn.execute(query, params)
+            conn.commit()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the interactions logged through this handler are written to the database.
+
+        Args:
+            timeout (Optional[float]): Maximum number of seconds to wait. Defaults to None (no limit).
+
+        Returns:
+            bool: False if the timeout expired first.
+        """
+        if self.writer is None:
+            return True
+
+        return self.writer.flush(self._last_write, timeout)
 
     def fetch_all_interactions(self) -> List[sqlite3.Row]:
         """
@@ -62,8 +329,55 @@ class DatabaseHandler:
             List[sqlite3.Row]: A list of all rows in the interactions table.
         """
         query = "SELECT * FROM interactions ORDER BY timestamp"
-        self.conn = sqlite3.connect(self.db_path)
-        result = self.conn.execute(query).fetchall()
-        self.conn.close()
+        self.flush(timeout=READ_FLUSH_TIMEOUT)
+
+        with self.pool.connection() as conn:
+            return conn.execute(query).fetchall()
+
+    def fetch_interactions(
+        self,
+        session_id: Optional[str],
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> List[sqlite3.Row]:
+        """
+        Fetch a page of the interactions of a conversation, using the row IDs as keys.
+
+        With after_id, the rows logged since that row are returned, oldest first, which
+        lets callers fetch only what is new. Otherwise the latest rows (before before_id,
+        if given) are returned, still oldest first, which lets callers page backwards.
+        Both walk the (session_id, id) index, without scanning skipped rows.
+
+        Args:
+            session_id (Optional[str]): Identifier of the conversation.
+            after_id (Optional[int]): Only return rows with a greater ID. Defaults to None.
+            before_id (Optional[int]): Only return rows with a smaller ID. Defaults to None.
+            limit (Optional[int]): Maximum number of rows. Defaults to None (no limit).
+
+        Returns:
+            List[sqlite3.Row]: The rows of the page, in ID order.
+        """
+        conditions = ["session_id IS ?"]
+        params = [session_id]
+
+        if after_id is not None:
+            conditions.append("id > ?")
+            params.append(after_id)
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+
+        order = "ASC" if after_id is not None else "DESC"
+        query = (
+            f"SELECT * FROM interactions WHERE {' AND '.join(conditions)} "
+            f"ORDER BY id {order} LIMIT ?"
+        )
+        params.append(-1 if limit is None else limit)
+
+        self.flush(timeout=READ_FLUSH_TIMEOUT)
+
+        with self.pool.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
 
-        return result
+        return rows if after_id is not None else rows[::-1]
@@ -0,0 +1,220 @@
+import os
+import re
+import zlib
+from typing import Container, Dict, List, Optional
+
+import numpy as np
+
+import utils
+
+# MinHash values are computed modulo this prime, so that they fit in 32 bits
+_PRIME = (1 << 31) - 1
+
+
+def normalize(text: str) -> str:
+    """
+    Normalize a text before comparing it: lowercase, with runs of whitespace collapsed.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The normalized text.
+    """
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class ChunkDeduplicator:
+    """
+    Detect exact and near-duplicate chunks with MinHash signatures and locality-sensitive hashing.
+
+    Chunks are compared as sets of word n-grams (shingles). Each chunk gets a signature
+    of num_perm MinHash values, split into bands of consecutive values: chunks sharing a
+    band are candidates, and a candidate is a duplicate if the fraction of equal values,
+    an estimate of the Jaccard similarity of the shingles, reaches the threshold.
+    Identical chunks (after normalization) are matched by hash, without signatures.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 5,
+        seed: int = 0,
+    ) -> None:
+        """
+        Initialize an empty deduplicator.
+
+        Args:
+            threshold (float): Minimum estimated Jaccard similarity of two near-duplicates. Defaults to 0.85.
+            num_perm (int): Number of MinHash values per signature. Defaults to 64.
+            bands (int): Number of bands the signature is split into; more bands find more
+                candidates below the threshold. Defaults to 16.
+            shingle_size (int): Number of words per shingle. Defaults to 5.
+            seed (int): Seed of the hash functions. Defaults to 0.
+        """
+        if num_perm % bands:
+            raise ValueError(
+                f"num_perm ({num_perm}) must be a multiple of bands ({bands})"
+            )
+
+        rng = np.random.default_rng(seed)
+        self._params = np.array([num_perm, shingle_size, seed])
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+        self.threshold = threshold
+        self.bands = bands
+        self.shingle_size = shingle_size
+
+        self._exact: Dict[str, str] = {}
+        # the first chunk of each band value, as an index into _ids and _signatures
+        self._buckets: List[Dict[int, int]] = [{} for _ in range(bands)]
+        self._ids: List[str] = []
+        self._hashes: List[str] = []
+        self._signatures = np.empty((1024, num_perm), dtype=np.uint32)
+        self.stats = {"chunks": 0, "exact": 0, "near": 0, "chars": 0}
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Compute the MinHash signature of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            np.ndarray: num_perm 32-bit values.
+        """
+        words = normalize(text).split()
+        n = self.shingle_size
+        shingles = set()
+        for i in range(max(len(words) - n + 1, 1)):
+            end = i + n
+            shingles.add(" ".join(words[i:end]))
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+
+        return (
+            ((self._a[:, None] * hashes + self._b[:, None]) % _PRIME)
+            .min(axis=1)
+            .astype(np.uint32)
+        )
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        return [hash(band.tobytes()) for band in np.split(signature, self.bands)]
+
+    def _find(self, text_hash: str, signature: np.ndarray) -> Optional[str]:
+        if text_hash in self._exact:
+            return self._exact[text_hash]
+
+        candidates = {
+            bucket[key]
+            for bucket, key in zip(self._buckets, self._band_keys(signature))
+            if key in bucket
+        }
+        for i in sorted(candidates):
+            if np.mean(self._signatures[i] == signature) >= self.threshold:
+                return self._ids[i]
+
+        return None
+
+    def add(self, chunk_id: str, text: str) -> None:
+        """
+        Record a chunk as unique, e.g. a chunk already in the index.
+
+        Args:
+            chunk_id (str): The ID of the chunk.
+            text (str): The text of the chunk.
+        """
+        self._add(chunk_id, utils.get_text_hash(normalize(text)), self.signature(text))
+
+    def _add(self, chunk_id: str, text_hash: str, signature: np.ndarray) -> None:
+        self._exact.setdefault(text_hash, chunk_id)
+        i = len(self._ids)
+
+        if i == len(self._signatures):
+            self._signatures = np.concatenate(
+                [self._signatures, np.empty_like(self._signatures)]
+            )
+
+        self._ids.append(chunk_id)
+        self._hashes.append(text_hash)
+        self._signatures[i] = signature
+
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(key, i)
+
+    def save(self, path: str) -> None:
+        """
+        Save the recorded chunks and their signatures, e.g. next to the index they are in.
+
+        Args:
+            path (str): Path to the file, written atomically.
+        """
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez(
+                f,
+                params=self._params,
+                ids=np.array(self._ids, dtype=str),
+                hashes=np.array(self._hashes, dtype=str),
+                signatures=self._signatures[: len(self._ids)],
+            )
+
+        os.replace(f"{path}.tmp", path)
+
+    def load(self, path: str, chunk_ids: Container[str]) -> List[str]:
+        """
+        Record the chunks saved by save, without computing their signatures again.
+
+        Args:
+            path (str): Path to the file.
+            chunk_ids (Container[str]): IDs of the chunks to record, e.g. those still in
+                the index; the others are skipped.
+
+        Returns:
+            List[str]: The IDs of the recorded chunks, none if the file does not exist or
+                was saved with other parameters.
+        """
+        if not os.path.exists(path):
+            return []
+
+        with np.load(path) as saved:
+            if not np.array_equal(saved["params"], self._params):
+                return []
+
+            loaded = []
+            for chunk_id, text_hash, signature in zip(
+                saved["ids"].tolist(), saved["hashes"].tolist(), saved["signatures"]
+            ):
+                if chunk_id in chunk_ids:
+                    self._add(chunk_id, text_hash, signature)
+                    loaded.append(chunk_id)
+
+        return loaded
+
+    def deduplicate(self, chunk_id: str, text: str) -> Optional[str]:
+        """
+        Find an earlier chunk the text duplicates, or record the chunk as unique.
+
+        Args:
+            chunk_id (str): The ID of the chunk.
+            text (str): The text of the chunk.
+
+        Returns:
+            Optional[str]: The ID of the earlier chunk, or None if the chunk is unique.
+        """
+        text_hash = utils.get_text_hash(normalize(text))
+        signature = self.signature(text)
+        duplicate_of = self._find(text_hash, signature)
+        self.stats["chunks"] += 1
+
+        if duplicate_of is None:
+            self._add(chunk_id, text_hash, signature)
+        else:
+            self.stats["exact" if text_hash in self._exact else "near"] += 1
+            self.stats["chars"] += len(text)
+
+        return duplicate_of
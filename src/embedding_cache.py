@@ -0,0 +1,352 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+import telemetry
+import utils
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of embeddings for a single model.
+
+    Vectors are stored in a memory-mapped float32 matrix, one row per entry. A SQLite
+    index maps the hash of each text to its row and to the time it was last used. When
+    the matrix is full, the least recently used entries are evicted.
+
+    Several processes can share a cache folder: lookups, row allocation and writes run
+    inside SQLite write transactions, so a row is never handed out twice, nor read while
+    another process overwrites it.
+
+    Attributes:
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups not found in the cache.
+    """
+
+    def __init__(
+        self, folder_path: str, model_name: str, max_size_mb: int = 512
+    ) -> None:
+        """
+        Initialize the cache, opening the files of a previous run if they exist.
+
+        Args:
+            folder_path (str): Path to the folder where the caches of all models are kept.
+            model_name (str): Name of the embedding model whose vectors are cached.
+            max_size_mb (int): Maximum size of the vector matrix, in megabytes. Defaults to 512.
+        """
+        self.model_name = model_name
+        self.max_size_mb = max_size_mb
+        self.folder_path = os.path.join(
+            folder_path, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        )
+        os.makedirs(self.folder_path, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._matrix = None
+
+        # autocommit: the transactions are opened explicitly, see _transaction
+        self.conn = sqlite3.connect(
+            os.path.join(self.folder_path, "index.sqlite"),
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=60,
+        )
+
+        with self._transaction():
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, row INTEGER, last_used REAL)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)"
+            )
+            # rows released by evictions, below the 'next_row' high-water mark
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)"
+            )
+            self._sync_matrix()
+
+    def _key(self, text: str) -> str:
+        return utils.get_text_hash(f"{self.model_name}\0{text}")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # BEGIN IMMEDIATE takes the database write lock, which other processes wait for
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _get_meta(self, name: str) -> Optional[int]:
+        value = self.conn.execute(
+            "SELECT value FROM meta WHERE name = ?", (name,)
+        ).fetchone()
+        return None if value is None else value[0]
+
+    def _set_meta(self, **values: int) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+            list(values.items()),
+        )
+
+    def _sync_matrix(self) -> None:
+        # open the matrix created, or reset, by another instance since the last access
+        dim = self._get_meta("dim")
+        capacity = self._get_meta("capacity")
+        path = os.path.join(self.folder_path, "vectors.f32")
+
+        if dim is None or not os.path.exists(path):
+            self._matrix = None
+        elif self._matrix is None or self._matrix.shape != (capacity, dim):
+            self._matrix = np.memmap(
+                path, dtype=np.float32, mode="r+", shape=(capacity, dim)
+            )
+
+        if self._matrix is not None and self._get_meta("next_row") is None:
+            # cache written before free rows were tracked
+            used = {row for row, in self.conn.execute("SELECT row FROM entries")}
+            next_row = max(used) + 1 if used else 0
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO free_rows (row) VALUES (?)",
+                [(r,) for r in range(next_row) if r not in used],
+            )
+            self._set_meta(next_row=next_row)
+
+    def _open_matrix(self, dim: int) -> None:
+        path = os.path.join(self.folder_path, "vectors.f32")
+        capacity = max(1, self.max_size_mb * 1024 * 1024 // (dim * 4))
+
+        if (
+            self._get_meta("dim") == dim
+            and self._get_meta("capacity") == capacity
+            and os.path.exists(path)
+        ):
+            self._sync_matrix()
+            return
+
+        # new cache, or a different size limit: start over
+        self.conn.execute("DELETE FROM entries")
+        self.conn.execute("DELETE FROM free_rows")
+        self._matrix = np.memmap(
+            path, dtype=np.float32, mode="w+", shape=(capacity, dim)
+        )
+        self._set_meta(dim=dim, capacity=capacity, next_row=0)
+
+    def _allocate(self, count: int, keep: Set[str]) -> List[int]:
+        rows = [
+            row
+            for row, in self.conn.execute(
+                "SELECT row FROM free_rows ORDER BY row LIMIT ?", (count,)
+            )
+        ]
+        self.conn.executemany(
+            "DELETE FROM free_rows WHERE row = ?", [(r,) for r in rows]
+        )
+
+        capacity = self._matrix.shape[0]
+        next_row = self._get_meta("next_row")
+        fresh = min(count - len(rows), capacity - next_row)
+        rows.extend(range(next_row, next_row + fresh))
+        self._set_meta(next_row=next_row + fresh)
+
+        missing = count - len(rows)
+        if missing > 0:
+            # evict a tenth of the cache at once to amortize evictions
+            evicted = self._evict(max(missing, capacity // 10), keep)
+            rows.extend(evicted[:missing])
+            self.conn.executemany(
+                "INSERT INTO free_rows (row) VALUES (?)",
+                [(r,) for r in evicted[missing:]],
+            )
+
+        return rows
+
+    def _evict(self, count: int, keep: Set[str]) -> List[int]:
+        rows = []
+        for key, row in self.conn.execute(
+            "SELECT key, row FROM entries ORDER BY last_used"
+        ):
+            # the entries being written must keep their rows
+            if key not in keep:
+                rows.append((key, row))
+                if len(rows) == count:
+                    break
+
+        self.conn.executemany(
+            "DELETE FROM entries WHERE key = ?", [(k,) for k, _ in rows]
+        )
+        return [row for _, row in rows]
+
+    def _lookup(self, keys: List[str]) -> Dict[str, int]:
+        rows = {}
+        for batch in utils.iter_batches(list(set(keys)), 500):
+            placeholders = ",".join("?" * len(batch))
+            rows.update(
+                self.conn.execute(
+                    f"SELECT key, row FROM entries WHERE key IN ({placeholders})",
+                    batch,
+                )
+            )
+        return rows
+
+    def get(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Look up the cached embeddings of a list of texts.
+
+        Args:
+            texts (List[str]): The texts to look up.
+
+        Returns:
+            List[Optional[List[float]]]: The embedding of each text, or None where it is not cached.
+        """
+        keys = [self._key(t) for t in texts]
+
+        with self._lock, self._transaction():
+            self._sync_matrix()
+
+            if self._matrix is None:
+                rows = {}
+            else:
+                rows = self._lookup(keys)
+
+            if rows:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in rows],
+                )
+
+            # read inside the transaction, before another process can reuse the rows
+            vectors = [
+                self._matrix[rows[k]].tolist() if k in rows else None for k in keys
+            ]
+
+            found = sum(v is not None for v in vectors)
+            self.hits += found
+            self.misses += len(vectors) - found
+            telemetry.count("embedding_cache.hits", found)
+            telemetry.count("embedding_cache.misses", len(vectors) - found)
+
+        return vectors
+
+    def put(self, texts: List[str], vectors: List[List[float]]) -> None:
+        """
+        Store the embeddings of a list of texts, evicting old entries if the cache is full.
+
+        Args:
+            texts (List[str]): The embedded texts.
+            vectors (List[List[float]]): The embedding of each text.
+        """
+        if not texts:
+            return
+
+        entries = dict(zip((self._key(t) for t in texts), vectors))
+
+        with self._lock, self._transaction():
+            self._open_matrix(len(vectors[0]))
+
+            capacity = self._matrix.shape[0]
+            entries = dict(list(entries.items())[:capacity])
+
+            existing = self._lookup(list(entries))
+            new_rows = iter(
+                self._allocate(len(entries) - len(existing), keep=set(existing))
+            )
+
+            now = time.time()
+            records = []
+            for key, vector in entries.items():
+                row = existing[key] if key in existing else next(new_rows)
+                self._matrix[row] = vector
+                records.append((key, row, now))
+
+            # the vectors reach the file before the rows are visible to other processes
+            self._matrix.flush()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, row, last_used) VALUES (?, ?, ?)",
+                records,
+            )
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Report the cache usage counters.
+
+        Returns:
+            Dict[str, float]: Hits, misses, hit rate and number of stored entries.
+        """
+        with self._lock:
+            size = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": size,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only computes the vectors missing from an EmbeddingCache.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache) -> None:
+        """
+        Initialize the wrapper.
+
+        Args:
+            embeddings (Embeddings): The embedding model used on cache misses.
+            cache (EmbeddingCache): The cache of previously computed vectors.
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents, reusing cached vectors.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: The embedding of each text.
+        """
+        vectors = self.cache.get(texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            self.cache.put(missing, [computed[t] for t in missing])
+            vectors = [
+                v if v is not None else computed[t] for t, v in zip(texts, vectors)
+            ]
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query text. Queries are not cached, as they are rarely repeated verbatim.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            List[float]: The embedding of the text.
+        """
+        return self.embeddings.embed_query(text)
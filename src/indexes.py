@@ -0,0 +1,387 @@
+import argparse
+import json
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+import config
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# faiss recommends at least 39 training points per IVF centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def requires_training(index_type: str) -> bool:
+    """
+    Tell whether an index type must be trained before vectors are added to it.
+
+    Args:
+        index_type (str): One of INDEX_TYPES.
+
+    Returns:
+        bool: True for the IVF index types.
+    """
+    return index_type.startswith("ivf")
+
+
+def training_size(index_type: str, index_params: Dict[str, int]) -> int:
+    """
+    Number of vectors to collect before training an index.
+
+    Args:
+        index_type (str): One of INDEX_TYPES.
+        index_params (Dict[str, int]): Index parameters, see config.index_params.
+
+    Returns:
+        int: The number of training vectors, 0 if the index does not need training.
+    """
+    if not requires_training(index_type):
+        return 0
+
+    return index_params["nlist"] * MIN_POINTS_PER_CENTROID
+
+
+def fitted_params(
+    index_type: str, num_vectors: int, index_params: Dict[str, int]
+) -> Dict[str, int]:
+    """
+    Training parameters of an index type, reduced to what a number of training vectors can fit.
+
+    Args:
+        index_type (str): One of INDEX_TYPES.
+        num_vectors (int): Number of training vectors.
+        index_params (Dict[str, int]): Index parameters, see config.index_params.
+
+    Returns:
+        Dict[str, int]: The number of IVF lists (nlist) and, for IVF-PQ, the bits per
+            PQ code (pq_nbits). Empty if the index does not need training.
+    """
+    if not requires_training(index_type):
+        return {}
+
+    fitted = {
+        "nlist": max(
+            1, min(index_params["nlist"], num_vectors // MIN_POINTS_PER_CENTROID)
+        )
+    }
+
+    if index_type == "ivf_pq":
+        # each PQ codebook has 2^nbits centroids to train
+        fitted["pq_nbits"] = min(
+            index_params["pq_nbits"],
+            max(1, int(np.log2(max(num_vectors, 1) / MIN_POINTS_PER_CENTROID))),
+        )
+
+    return fitted
+
+
+def trained_params(index: faiss.Index) -> Dict[str, int]:
+    """
+    Training parameters an index was actually created with, see fitted_params.
+
+    Args:
+        index (faiss.Index): The index.
+
+    Returns:
+        Dict[str, int]: nlist and pq_nbits, where they apply to the index type.
+    """
+    params = {}
+
+    if isinstance(index, faiss.IndexIVF):
+        params["nlist"] = index.nlist
+    if isinstance(index, faiss.IndexIVFPQ):
+        params["pq_nbits"] = index.pq.nbits
+
+    return params
+
+
+def is_outgrown(
+    index_type: str,
+    trained: Dict[str, int],
+    num_vectors: int,
+    index_params: Optional[Dict[str, int]] = None,
+) -> bool:
+    """
+    Tell whether an index trained on a small corpus should be trained again now that it grew.
+
+    An IVF index trained on few vectors gets fewer lists than configured; as vectors
+    are added, the lists grow and searches slow down. The index is outgrown once there
+    are enough vectors to train twice as many lists, or more bits per PQ code.
+
+    Args:
+        index_type (str): One of INDEX_TYPES.
+        trained (Dict[str, int]): Parameters the index was trained with, see trained_params.
+        num_vectors (int): Number of vectors now in the index.
+        index_params (Optional[Dict[str, int]]): Index parameters. Defaults to config.index_params.
+
+    Returns:
+        bool: True if the index should be rebuilt.
+    """
+    index_params = {**config.index_params, **(index_params or {})}
+    fitted = fitted_params(index_type, num_vectors, index_params)
+
+    if "nlist" in trained and fitted.get("nlist", 0) >= 2 * trained["nlist"]:
+        return True
+
+    return "pq_nbits" in trained and fitted.get("pq_nbits", 0) > trained["pq_nbits"]
+
+
+def create_index(
+    vectors: np.ndarray,
+    index_type: str = "flat",
+    index_params: Optional[Dict[str, int]] = None,
+) -> faiss.Index:
+    """
+    Create an empty FAISS index, training it on the given vectors if its type requires it.
+
+    The number of IVF lists is reduced when there are too few training vectors for
+    the configured nlist, so that small corpora can still use an IVF index (see
+    fitted_params and is_outgrown).
+
+    Args:
+        vectors (np.ndarray): Float32 matrix of sample vectors, used for the dimension and training.
+        index_type (str): One of INDEX_TYPES. Defaults to 'flat'.
+        index_params (Optional[Dict[str, int]]): Index parameters. Defaults to config.index_params.
+
+    Returns:
+        faiss.Index: The empty, trained index, configured with the search parameters.
+    """
+    index_params = {**config.index_params, **(index_params or {})}
+    dim = vectors.shape[1]
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, index_params["m"])
+        index.hnsw.efConstruction = index_params["ef_construction"]
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        fitted = fitted_params(index_type, len(vectors), index_params)
+        quantizer = faiss.IndexFlatL2(dim)
+
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, fitted["nlist"])
+        else:
+            index = faiss.IndexIVFPQ(
+                quantizer,
+                dim,
+                fitted["nlist"],
+                index_params["pq_m"],
+                fitted["pq_nbits"],
+            )
+    else:
+        raise Exception(
+            f"unknown index type {index_type}, expected one of " + ",".join(INDEX_TYPES)
+        )
+
+    if not index.is_trained:
+        index.train(vectors)
+
+    set_search_params(index, index_params)
+
+    return index
+
+
+def set_search_params(index: faiss.Index, index_params: Dict[str, int]) -> None:
+    """
+    Apply the search-time parameters (nprobe, efSearch) to an index, if they apply to its type.
+
+    Args:
+        index (faiss.Index): The index to configure.
+        index_params (Dict[str, int]): Index parameters, see config.index_params.
+    """
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = index_params.get("nprobe", index.nprobe)
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = index_params.get("ef_search", index.hnsw.efSearch)
+
+
+def supports_removal(index: faiss.Index) -> bool:
+    """
+    Tell whether vectors can be removed from an index.
+
+    Args:
+        index (faiss.Index): The index.
+
+    Returns:
+        bool: False for HNSW graphs, which cannot remove vectors.
+    """
+    return not isinstance(index, faiss.IndexHNSW)
+
+
+def remove_positions(index: faiss.Index, positions: Sequence[int]) -> None:
+    """
+    Remove vectors by position, the remaining ones keeping consecutive positions in insertion order.
+
+    Flat indexes compact their vectors on removal, which FAISS.delete relies on to
+    renumber its index_to_docstore_id, but IVF indexes keep the labels the remaining
+    vectors were added with: they are renumbered here to match.
+
+    Args:
+        index (faiss.Index): The index, whose vectors are labelled by position.
+        positions (Sequence[int]): Positions of the vectors to remove.
+    """
+    removed = np.unique(np.asarray(positions, dtype=np.int64))
+    index.remove_ids(removed)
+
+    if not isinstance(index, faiss.IndexIVF):
+        return
+
+    invlists = index.invlists
+    for list_no in range(index.nlist):
+        size = invlists.list_size(list_no)
+        if not size:
+            continue
+
+        ids = faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy()
+        codes = faiss.rev_swig_ptr(
+            invlists.get_codes(list_no), size * invlists.code_size
+        ).copy()
+        # shift each label by the number of removed positions before it
+        ids -= np.searchsorted(removed, ids)
+        invlists.update_entries(
+            list_no, 0, size, faiss.swig_ptr(ids), faiss.swig_ptr(codes)
+        )
+
+
+def search_ranges(
+    index: faiss.Index, vectors: np.ndarray, k: int, ranges: List[Tuple[int, int]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search only the vectors whose position falls in one of the given ranges.
+
+    The ranges are applied as a FAISS ID selector during the search, so the k
+    results are the nearest selected vectors, without over-fetching. Approximate
+    indexes may return fewer than k results when few selected vectors are in the
+    probed IVF lists or HNSW neighbourhoods.
+
+    Args:
+        index (faiss.Index): The index, whose vectors are labelled by position.
+        vectors (np.ndarray): Float32 matrix of query vectors.
+        k (int): Number of neighbours retrieved per query.
+        ranges (List[Tuple[int, int]]): Start (inclusive) and stop (exclusive) positions.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Distances and positions, -1 for missing results.
+    """
+    if len(ranges) == 1:
+        selector = faiss.IDSelectorRange(*ranges[0])
+    else:
+        mask = np.zeros(index.ntotal, dtype=bool)
+        for start, stop in ranges:
+            mask[start:stop] = True
+        # the selector reads the bitmap in place: it must outlive the search
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(index.ntotal, faiss.swig_ptr(bitmap))
+
+    # search parameters replace those of the index, e.g. nprobe
+    if isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+
+    return index.search(vectors, k, params=params)
+
+
+def get_index_size(index: faiss.Index) -> int:
+    """
+    Size of an index once serialized, a close estimate of its memory footprint.
+
+    Args:
+        index (faiss.Index): The index.
+
+    Returns:
+        int: The size in bytes.
+    """
+    return faiss.serialize_index(index).nbytes
+
+
+def benchmark(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    index_types: List[str] = INDEX_TYPES,
+    index_params: Optional[Dict[str, int]] = None,
+    k: int = 5,
+) -> List[Dict[str, float]]:
+    """
+    Compare index types against exhaustive flat search.
+
+    For each index type, report recall@k against the flat index results, the p50 and
+    p99 latency of single-query searches, the build time and the index size.
+
+    Args:
+        vectors (np.ndarray): Float32 matrix of the indexed vectors.
+        queries (np.ndarray): Float32 matrix of query vectors.
+        index_types (List[str]): Index types to benchmark. Defaults to all of INDEX_TYPES.
+        index_params (Optional[Dict[str, int]]): Index parameters. Defaults to config.index_params.
+        k (int): Number of neighbours retrieved per query. Defaults to 5.
+
+    Returns:
+        List[Dict[str, float]]: One report per index type.
+    """
+    baseline = faiss.IndexFlatL2(vectors.shape[1])
+    baseline.add(vectors)
+    _, expected = baseline.search(queries, k)
+
+    reports = []
+
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = create_index(vectors, index_type, index_params)
+        index.add(vectors)
+        build_time = time.perf_counter() - start
+
+        latencies = []
+        found = []
+        for query in queries:
+            start = time.perf_counter()
+            _, labels = index.search(query[None, :], k)
+            latencies.append(time.perf_counter() - start)
+            found.append(labels[0])
+
+        hits = sum(
+            len(set(labels) & set(truth)) for labels, truth in zip(found, expected)
+        )
+
+        reports.append(
+            {
+                "index_type": index_type,
+                f"recall@{k}": hits / expected.size,
+                "p50_ms": float(np.percentile(latencies, 50) * 1000),
+                "p99_ms": float(np.percentile(latencies, 99) * 1000),
+                "build_s": build_time,
+                "size_mb": get_index_size(index) / 1024 / 1024,
+            }
+        )
+
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the FAISS index types on the vectors of a saved index."
+    )
+    parser.add_argument("index_path", help="path to a .faiss file")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES))
+    args = parser.parse_args()
+
+    source = faiss.read_index(args.index_path)
+    if isinstance(source, faiss.IndexIVF):
+        source.make_direct_map()
+    vectors = source.reconstruct_n(0, source.ntotal)
+
+    # query with slightly perturbed copies of indexed vectors
+    rng = np.random.default_rng(0)
+    sample = vectors[
+        rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    ]
+    queries = (sample + rng.normal(0, 0.01, sample.shape)).astype(np.float32)
+
+    for report in benchmark(vectors, queries, args.types, k=args.k):
+        print(json.dumps(report))
@@ -0,0 +1,464 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import config
+import database
+import utils
+
+# states of a job: queued -> running -> done, failed or cancelled
+ACTIVE_STATES = ("queued", "running")
+
+# a running job records a heartbeat this often; a job whose worker stopped recording
+# them (e.g. a killed process) is queued again, and resumes from its last checkpoint
+HEARTBEAT_INTERVAL = 5
+STALE_AFTER = 60
+
+_lock = threading.Lock()
+_queues: Dict[str, "JobQueue"] = {}
+_worker: Optional[subprocess.Popen] = None
+
+
+class JobCancelled(Exception):
+    """
+    Raised in a running job once its cancellation was requested.
+    """
+
+
+def get_job_key(
+    file_paths: List[str], output_folder_path: str, incremental: bool
+) -> str:
+    """
+    Identify the work of an ingestion job, to merge identical requests.
+
+    Args:
+        file_paths (List[str]): File path for each PDF to index.
+        output_folder_path (str): Path to the folder where the vector store is saved.
+        incremental (bool): Whether the existing index is updated.
+
+    Returns:
+        str: A hash of the folder, the mode and the path, size and modification time of each file.
+    """
+
+    def stat(file_path: str) -> list:
+        try:
+            st = os.stat(file_path)
+            return [os.path.abspath(file_path), st.st_size, st.st_mtime_ns]
+        except OSError:
+            return [os.path.abspath(file_path), None, None]
+
+    return utils.get_text_hash(
+        json.dumps(
+            [
+                os.path.abspath(output_folder_path),
+                incremental,
+                sorted(map(stat, file_paths)),
+            ]
+        )
+    )
+
+
+class JobQueue:
+    """
+    Queue of ingestion jobs persisted in an SQLite database, shared by the app and the workers.
+
+    A job records its state, its progress and the ID of the vector store it built. The
+    jobs of a folder run one at a time, in submission order, possibly in several worker
+    processes.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """
+        Initialize the queue and create the jobs table if it doesn't exist.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+        """
+        self.pool = database.get_pool(db_path)
+        self.create_table()
+
+    def create_table(self) -> None:
+        """
+        Create the jobs table in the database if it doesn't already exist.
+        """
+        query = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            output_folder_path TEXT NOT NULL,
+            file_paths TEXT NOT NULL,
+            incremental INTEGER NOT NULL,
+            files_total INTEGER,
+            files_done INTEGER NOT NULL DEFAULT 0,
+            chunks_done INTEGER NOT NULL DEFAULT 0,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            heartbeat_at REAL
+        )
+        """
+        with self.pool.connection() as conn:
+            conn.execute(query)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)"
+            )
+            conn.commit()
+
+    @staticmethod
+    def _to_dict(cursor, row: Optional[tuple]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+
+        job = dict(zip([c[0] for c in cursor.description], row))
+        job["file_paths"] = json.loads(job["file_paths"])
+        job["incremental"] = bool(job["incremental"])
+        job["cancel_requested"] = bool(job["cancel_requested"])
+
+        return job
+
+    def submit(
+        self, file_paths: List[str], output_folder_path: str, incremental: bool = True
+    ) -> str:
+        """
+        Queue an ingestion job, unless an identical one is already queued or running.
+
+        Args:
+            file_paths (List[str]): File path for each PDF to index.
+            output_folder_path (str): Path to the folder where the vector store is saved.
+            incremental (bool): Whether to update the existing index. Defaults to True.
+
+        Returns:
+            str: The ID of the new job, or of the identical one.
+        """
+        key = get_job_key(file_paths, output_folder_path, incremental)
+
+        with self.pool.connection() as conn:
+            # the lookup and the insert form one write transaction
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE key = ? AND state IN ('queued', 'running') "
+                "AND NOT cancel_requested",
+                (key,),
+            ).fetchone()
+
+            if row is not None:
+                conn.commit()
+                return row[0]
+
+            job_id = utils.get_unique_id()
+            conn.execute(
+                "INSERT INTO jobs (id, key, state, output_folder_path, file_paths, "
+                "incremental, created_at) VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (
+                    job_id,
+                    key,
+                    output_folder_path,
+                    json.dumps(file_paths),
+                    int(incremental),
+                    time.time(),
+                ),
+            )
+            conn.commit()
+
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a job.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            Optional[Dict[str, Any]]: The columns of the job, or None if it does not exist.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            return self._to_dict(cursor, cursor.fetchone())
+
+    def latest(self, output_folder_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the last queued or running job of a folder, e.g. to follow it after a page refresh.
+
+        Args:
+            output_folder_path (str): Path to the folder where the vector store is saved.
+
+        Returns:
+            Optional[Dict[str, Any]]: The columns of the job, or None if there is none.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.execute(
+                "SELECT * FROM jobs WHERE output_folder_path = ? "
+                "AND state IN ('queued', 'running') "
+                "ORDER BY created_at DESC, rowid DESC LIMIT 1",
+                (output_folder_path,),
+            )
+            return self._to_dict(cursor, cursor.fetchone())
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a job: a queued job is cancelled at once, a running one at its next progress report.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            bool: False if the job is already over.
+        """
+        with self.pool.connection() as conn:
+            cancelled = conn.execute(
+                "UPDATE jobs SET state = 'cancelled', finished_at = ? "
+                "WHERE id = ? AND state = 'queued'",
+                (time.time(), job_id),
+            ).rowcount
+            if not cancelled:
+                cancelled = conn.execute(
+                    "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND state = 'running'",
+                    (job_id,),
+                ).rowcount
+            conn.commit()
+
+        return bool(cancelled)
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Take the oldest queued job whose folder has no running job, and mark it running.
+
+        Jobs whose worker stopped recording heartbeats are queued again first, or
+        cancelled if their cancellation was requested.
+
+        Returns:
+            Optional[Dict[str, Any]]: The columns of the job, or None if there is none to run.
+        """
+        now = time.time()
+
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET "
+                "state = CASE WHEN cancel_requested THEN 'cancelled' ELSE 'queued' END, "
+                "finished_at = CASE WHEN cancel_requested THEN ? END "
+                "WHERE state = 'running' AND heartbeat_at < ?",
+                (now, now - STALE_AFTER),
+            )
+            cursor = conn.execute(
+                "SELECT * FROM jobs WHERE state = 'queued' AND output_folder_path NOT IN "
+                "(SELECT output_folder_path FROM jobs WHERE state = 'running') "
+                "ORDER BY created_at, rowid LIMIT 1"
+            )
+            job = self._to_dict(cursor, cursor.fetchone())
+
+            if job is not None:
+                conn.execute(
+                    "UPDATE jobs SET state = 'running', started_at = ?, heartbeat_at = ? "
+                    "WHERE id = ?",
+                    (now, now, job["id"]),
+                )
+                job["state"] = "running"
+            conn.commit()
+
+        return job
+
+    def heartbeat(self, job_id: str, progress: Optional[Dict[str, int]] = None) -> bool:
+        """
+        Record that a running job is alive, and its progress if given.
+
+        Args:
+            job_id (str): The ID of the job.
+            progress (Optional[Dict[str, int]]): The 'files_total', 'files_done' and
+                'chunks_done' reported by vectorstore.run. Defaults to None.
+
+        Returns:
+            bool: True if the cancellation of the job was requested.
+        """
+        with self.pool.connection() as conn:
+            if progress is None:
+                conn.execute(
+                    "UPDATE jobs SET heartbeat_at = ? WHERE id = ?",
+                    (time.time(), job_id),
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET heartbeat_at = ?, files_total = ?, files_done = ?, "
+                    "chunks_done = ? WHERE id = ?",
+                    (
+                        time.time(),
+                        progress["files_total"],
+                        progress["files_done"],
+                        progress["chunks_done"],
+                        job_id,
+                    ),
+                )
+            row = conn.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            conn.commit()
+
+        return bool(row and row[0])
+
+    def finish(
+        self,
+        job_id: str,
+        state: str,
+        result: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """
+        Record the end of a job.
+
+        Args:
+            job_id (str): The ID of the job.
+            state (str): 'done', 'failed' or 'cancelled'.
+            result (Optional[str]): The ID of the vector store built. Defaults to None.
+            error (Optional[str]): The reason of the failure. Defaults to None.
+        """
+        with self.pool.connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, error = ?, finished_at = ? "
+                "WHERE id = ?",
+                (state, result, error, time.time(), job_id),
+            )
+            conn.commit()
+
+
+def get_queue(db_path: str = config.jobs_db_path) -> JobQueue:
+    """
+    Get the process-wide job queue of a database.
+
+    Args:
+        db_path (str): Path to the SQLite database file. Defaults to config.jobs_db_path.
+
+    Returns:
+        JobQueue: The shared queue.
+    """
+    with _lock:
+        if db_path not in _queues:
+            _queues[db_path] = JobQueue(db_path)
+        return _queues[db_path]
+
+
+def run_job(queue: JobQueue, job: Dict[str, Any]) -> None:
+    """
+    Run a claimed ingestion job and record its outcome.
+
+    Args:
+        queue (JobQueue): The queue the job was claimed from.
+        job (Dict[str, Any]): The job, as returned by JobQueue.claim.
+    """
+    # imported on first use: the app imports this module to submit jobs
+    import vectorstore
+
+    stop = threading.Event()
+
+    def beat() -> None:
+        # parsing a large PDF reports no progress for a while
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            queue.heartbeat(job["id"])
+
+    def on_progress(progress: Dict[str, int]) -> None:
+        if queue.heartbeat(job["id"], progress):
+            raise JobCancelled(job["id"])
+
+    heartbeat = threading.Thread(target=beat, name=f"job-{job['id']}", daemon=True)
+    heartbeat.start()
+
+    try:
+        result = vectorstore.run(
+            job["file_paths"],
+            job["output_folder_path"],
+            incremental=job["incremental"],
+            on_progress=on_progress,
+        )
+    except JobCancelled:
+        queue.finish(job["id"], "cancelled")
+    except Exception as e:
+        print(f"Job {job['id']} failed: {e!r}")
+        queue.finish(job["id"], "failed", error=str(e) or repr(e))
+    else:
+        queue.finish(job["id"], "done", result=result)
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def work(
+    db_path: str = config.jobs_db_path,
+    poll_interval: float = config.jobs_poll_interval,
+    idle_timeout: Optional[float] = config.jobs_worker_idle_timeout,
+) -> int:
+    """
+    Run queued jobs one after the other, until the queue stays empty for idle_timeout seconds.
+
+    Args:
+        db_path (str): Path to the SQLite database file. Defaults to config.jobs_db_path.
+        poll_interval (float): Seconds between two polls of an empty queue.
+            Defaults to config.jobs_poll_interval.
+        idle_timeout (Optional[float]): Seconds without jobs before returning. Defaults to
+            config.jobs_worker_idle_timeout (None to run forever).
+
+    Returns:
+        int: The number of jobs run.
+    """
+    queue = get_queue(db_path)
+    idle_since = time.monotonic()
+    count = 0
+
+    while True:
+        job = queue.claim()
+
+        if job is not None:
+            run_job(queue, job)
+            count += 1
+            idle_since = time.monotonic()
+        elif idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+            return count
+        else:
+            time.sleep(poll_interval)
+
+
+def start_worker(db_path: str = config.jobs_db_path) -> None:
+    """
+    Start a worker process, unless the one this process started is still running.
+
+    The worker exits once idle for config.jobs_worker_idle_timeout seconds; call this
+    after submitting a job.
+
+    Args:
+        db_path (str): Path to the SQLite database file. Defaults to config.jobs_db_path.
+    """
+    global _worker
+
+    with _lock:
+        if _worker is not None and _worker.poll() is None:
+            return
+
+        _worker = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--db", db_path]
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run queued ingestion jobs.")
+    parser.add_argument("--db", default=config.jobs_db_path)
+    parser.add_argument(
+        "--forever",
+        action="store_true",
+        help="keep polling instead of exiting when idle",
+    )
+    args = parser.parse_args()
+
+    # the metrics endpoint is served by the app process, on the configured port
+    config.telemetry_prometheus_port = None
+
+    work(
+        args.db, idle_timeout=None if args.forever else config.jobs_worker_idle_timeout
+    )
@@ -0,0 +1,83 @@
+import json
+import os
+from typing import Dict, List, Tuple
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+def empty_manifest() -> dict:
+    """
+    Build an empty index manifest.
+
+    Returns:
+        dict: A manifest with no index and no indexed files.
+    """
+    return {"index_name": None, "files": {}, "pending": {}, "next_doc_id": 0}
+
+
+def load_manifest(folder_path: str) -> dict:
+    """
+    Load the index manifest stored in a vector store folder.
+
+    The manifest records the name of the index kept in the folder and, for each
+    indexed PDF, its content hash, the IDs of the chunks it produced and its document
+    ID, a compact integer also stored in the metadata of its chunks. The state of
+    a build in progress, saved at each checkpoint, is kept under "pending_index" in the
+    same format, with the PDFs whose embedding is not complete yet under "pending".
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+
+    Returns:
+        dict: The manifest, or an empty manifest if none has been written yet.
+    """
+    path = os.path.join(folder_path, MANIFEST_FILE_NAME)
+
+    if not os.path.exists(path):
+        return empty_manifest()
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, folder_path: str) -> None:
+    """
+    Atomically write the index manifest to a vector store folder.
+
+    Args:
+        manifest (dict): The manifest to persist.
+        folder_path (str): Path to the folder containing the vector store files.
+    """
+    path = os.path.join(folder_path, MANIFEST_FILE_NAME)
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    os.replace(tmp_path, path)
+
+
+def diff_files(
+    manifest: dict, file_hashes: Dict[str, str]
+) -> Tuple[List[str], List[str]]:
+    """
+    Compare the indexed files with the current content hashes of the input files.
+
+    Args:
+        manifest (dict): The current index manifest.
+        file_hashes (Dict[str, str]): Content hash for each input file path.
+
+    Returns:
+        Tuple[List[str], List[str]]: The files whose chunks must be removed from the index
+            (deleted or changed) and the files that must be embedded (new or changed).
+    """
+    indexed = manifest["files"]
+
+    removed = [f for f, entry in indexed.items() if file_hashes.get(f) != entry["hash"]]
+    added = [
+        f
+        for f, file_hash in file_hashes.items()
+        if f not in indexed or indexed[f]["hash"] != file_hash
+    ]
+
+    return removed, added
@@ -0,0 +1,71 @@
+from typing import List
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import BaseMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+
+def count_tokens(messages: List[BaseMessage]) -> int:
+    """
+    Estimate the number of tokens of a list of messages, without calling the model.
+
+    Args:
+        messages (List[BaseMessage]): The messages.
+
+    Returns:
+        int: The approximate number of tokens.
+    """
+    return count_tokens_approximately(messages)
+
+
+class TokenBudgetMemory(ConversationSummaryBufferMemory):
+    """
+    Conversation memory whose history never exceeds a token budget.
+
+    The most recent turns are kept verbatim. When the history outgrows max_token_limit,
+    the oldest turns are folded into a rolling summary, written by the LLM and kept in
+    front of the history, so that the prompts of long conversations stop growing.
+
+    Unlike ConversationSummaryBufferMemory, tokens are estimated locally instead of
+    being counted by the model, which for hosted models costs an API call, and the
+    summary counts towards the budget.
+    """
+
+    def _pop_overflow(self) -> List[BaseMessage]:
+        messages = self.chat_memory.messages
+        budget = self.max_token_limit
+
+        if self.moving_summary_buffer:
+            budget -= count_tokens(
+                [self.summary_message_cls(content=self.moving_summary_buffer)]
+            )
+
+        pruned = []
+        while messages and count_tokens(messages) > budget:
+            # drop whole turns: a question and its answer
+            pruned.extend(messages[:2])
+            del messages[:2]
+
+        return pruned
+
+    def prune(self) -> None:
+        """
+        Fold the oldest turns into the summary while the history exceeds the token budget.
+        """
+        pruned = self._pop_overflow()
+
+        if pruned:
+            self.moving_summary_buffer = self.predict_new_summary(
+                pruned, self.moving_summary_buffer
+            )
+
+    async def aprune(self) -> None:
+        """
+        Async version of prune.
+        """
+        pruned = self._pop_overflow()
+
+        if pruned:
+            self.moving_summary_buffer = await self.apredict_new_summary(
+                pruned, self.moving_summary_buffer
+            )
@@ -1,23 +1,65 @@
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
+from typing import Optional
+
+from langchain.embeddings.base import Embeddings
+from langchain_core.language_models import BaseChatModel
+
+import config
+from embedding_cache import CachedEmbeddings, EmbeddingCache
 
 
 def get_embeddings(
     model_name: str = "sentence-transformers/all-mpnet-base-v2",
-) -> HuggingFaceEmbeddings:
+    cache_folder_path: Optional[str] = config.embedding_cache_folder_path,
+    backend: Optional[str] = None,
+) -> Embeddings:
     """
-    Initialize and return a HuggingFaceEmbeddings object.
+    Initialize and return the embedding model, backed by an on-disk embedding cache.
 
     Args:
         model_name (str): The name of the embedding model to use. Defaults to 'sentence-transformers/all-mpnet-base-v2'.
+        cache_folder_path (Optional[str]): Path to the embedding cache folder, or None to disable the cache.
+            Defaults to config.embedding_cache_folder_path.
+        backend (Optional[str]): 'torch' for HuggingFaceEmbeddings, or 'onnx' for the quantized
+            ONNX export of the model in config.onnx_model_folder_path. Defaults to config.embedding_backend.
 
     Returns:
-        HuggingFaceEmbeddings: An instance of the HuggingFaceEmbeddings class.
+        Embeddings: An instance of HuggingFaceEmbeddings or OnnxEmbeddings, wrapped in CachedEmbeddings if caching is enabled.
     """
-    return HuggingFaceEmbeddings(model_name=model_name)
+    backend = backend or config.embedding_backend
+
+    if backend == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+
+        embeddings = OnnxEmbeddings(
+            config.onnx_model_folder_path, num_threads=config.onnx_num_threads
+        )
+        if embeddings.model_config["model_name"] != model_name:
+            raise ValueError(
+                f"{config.onnx_model_folder_path} holds an export of "
+                f"{embeddings.model_config['model_name']}, not {model_name}"
+            )
+        # the vectors differ slightly from those of the PyTorch model
+        cache_name = f"{model_name}@onnx"
+    elif backend == "torch":
+        # imported on first use: it loads sentence-transformers and torch
+        from langchain.embeddings import HuggingFaceEmbeddings
+
+        embeddings = HuggingFaceEmbeddings(model_name=model_name)
+        cache_name = model_name
+    else:
+        raise ValueError(f"Unknown embedding backend: {backend}")
 
+    if cache_folder_path is None:
+        return embeddings
 
-def get_llm(model: str = "gemini-1.5-flash") -> ChatGoogleGenerativeAI:
+    cache = EmbeddingCache(
+        cache_folder_path, cache_name, max_size_mb=config.embedding_cache_max_mb
+    )
+
+    return CachedEmbeddings(embeddings, cache)
+
+
+def get_llm(model: str = "gemini-1.5-flash") -> BaseChatModel:
     """
     Initialize and return a ChatGoogleGenerativeAI model instance.
 
@@ -25,6 +67,9 @@ def get_llm(model: str = "gemini-1.5-flash") -> ChatGoogleGenerativeAI:
         model (str): The name of the language model to use. Defaults to 'gemini-1.5-flash'.
 
     Returns:
-        ChatGoogleGenerativeAI: An instance of the ChatGoogleGenerativeAI class.
+        BaseChatModel: An instance of the ChatGoogleGenerativeAI class.
     """
+    # imported on first use: the Google GenAI client takes seconds to import
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
     return ChatGoogleGenerativeAI(model=model)
@@ -0,0 +1,312 @@
+import argparse
+import json
+import os
+import random
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+import config
+
+# written next to the model by export_model
+CONFIG_FILE_NAME = "embedding_config.json"
+MODEL_FILE_NAME = "model.onnx"
+
+
+def mean_pool(token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """
+    Average the token embeddings of each text, ignoring padding, and L2-normalize the result.
+
+    This is the pooling of the sentence-transformers models such as all-mpnet-base-v2.
+
+    Args:
+        token_embeddings (np.ndarray): Output of the model, of shape (batch, tokens, dim).
+        attention_mask (np.ndarray): Mask of the real tokens, of shape (batch, tokens).
+
+    Returns:
+        np.ndarray: The text embeddings, of shape (batch, dim).
+    """
+    mask = attention_mask[:, :, None].astype(np.float32)
+    pooled = (token_embeddings * mask).sum(axis=1) / np.clip(
+        mask.sum(axis=1), 1e-9, None
+    )
+
+    return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Embedding model running an ONNX export of a sentence-transformers model with ONNX Runtime.
+
+    Exported with export_model, the model weights are quantized to int8, which makes
+    inference on CPU several times faster and smaller in memory than the PyTorch model,
+    for embeddings that stay close to the original ones (see fidelity_report).
+    """
+
+    def __init__(
+        self,
+        model_folder_path: str,
+        num_threads: Optional[int] = None,
+        batch_size: int = 32,
+    ) -> None:
+        """
+        Load the model and its tokenizer.
+
+        Args:
+            model_folder_path (str): Folder written by export_model.
+            num_threads (Optional[int]): Number of threads of a single inference. Defaults to
+                None (one per CPU core).
+            batch_size (int): Number of texts embedded at a time. Defaults to 32.
+        """
+        # imported on first use: optional dependencies of this backend only
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(
+            os.path.join(model_folder_path, CONFIG_FILE_NAME), encoding="utf-8"
+        ) as f:
+            self.model_config = json.load(f)
+
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(
+            os.path.join(model_folder_path, "tokenizer.json")
+        )
+        self.tokenizer.enable_truncation(max_length=self.model_config["max_length"])
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or 0
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.session = ort.InferenceSession(
+            os.path.join(model_folder_path, MODEL_FILE_NAME),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+
+        if "token_type_ids" in self._input_names:
+            inputs["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_embeddings = self.session.run(None, inputs)[0]
+
+        return mean_pool(token_embeddings, attention_mask)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts, batching texts of similar length together to limit padding.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in the same order.
+        """
+        if not texts:
+            return []
+
+        order = np.argsort([len(t) for t in texts])
+        embeddings = np.empty((len(texts), 0), dtype=np.float32)
+
+        for start in range(0, len(texts), self.batch_size):
+            end = start + self.batch_size
+            batch = order[start:end]
+            vectors = self._embed([texts[i] for i in batch])
+            if not embeddings.shape[1]:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[batch] = vectors
+
+        return embeddings.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query text.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            List[float]: The embedding of the text.
+        """
+        return self._embed([text])[0].tolist()
+
+
+def export_model(
+    model_name: str,
+    model_folder_path: str,
+    quantize: bool = True,
+    max_length: int = 384,
+) -> None:
+    """
+    Export a sentence-transformers model to ONNX, with weights dynamically quantized to int8.
+
+    Requires torch and transformers (installed with sentence-transformers), and onnx and
+    onnxruntime for the quantization.
+
+    Args:
+        model_name (str): Name of the Hugging Face model, e.g. 'sentence-transformers/all-mpnet-base-v2'.
+        model_folder_path (str): Folder where the model, its tokenizer and its configuration are written.
+        quantize (bool): Whether to quantize the weights to int8. Defaults to True.
+        max_length (int): Maximum number of tokens per text, beyond which texts are truncated.
+            Defaults to 384, the limit all-mpnet-base-v2 was trained with.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(model_folder_path, exist_ok=True)
+    model_path = os.path.join(model_folder_path, MODEL_FILE_NAME)
+    fp32_path = model_path + ".fp32" if quantize else model_path
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(model_folder_path)
+    model = AutoModel.from_pretrained(model_name).eval()
+    sample = tokenizer(["sample text"], return_tensors="pt")
+    axes = {0: "batch", 1: "tokens"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": axes,
+                "attention_mask": axes,
+                "last_hidden_state": axes,
+            },
+            opset_version=14,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+
+    with open(
+        os.path.join(model_folder_path, CONFIG_FILE_NAME), "w", encoding="utf-8"
+    ) as f:
+        json.dump(
+            {"model_name": model_name, "max_length": max_length, "quantized": quantize},
+            f,
+            indent=2,
+        )
+
+
+def fidelity_report(
+    reference: Embeddings,
+    candidate: Embeddings,
+    texts: List[str],
+    queries: List[str],
+    k: int = 5,
+) -> Dict[str, float]:
+    """
+    Compare the embeddings of a candidate model with those of a reference model.
+
+    Args:
+        reference (Embeddings): The reference model, e.g. the PyTorch one.
+        candidate (Embeddings): The model to evaluate, e.g. OnnxEmbeddings.
+        texts (List[str]): Texts to embed with both models, e.g. chunks of the corpus.
+        queries (List[str]): Queries searched among the texts with both models.
+        k (int): Number of texts retrieved per query. Defaults to 5.
+
+    Returns:
+        Dict[str, float]: The mean and minimum cosine similarity between the two
+            embeddings of each text, and the recall@k of the candidate searches against
+            the reference searches.
+    """
+
+    def embed(model: Embeddings, items: List[str], query: bool) -> np.ndarray:
+        vectors = np.array(
+            (
+                [model.embed_query(q) for q in items]
+                if query
+                else model.embed_documents(items)
+            ),
+            dtype=np.float32,
+        )
+        return vectors / np.clip(
+            np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None
+        )
+
+    reference_texts = embed(reference, texts, query=False)
+    candidate_texts = embed(candidate, texts, query=False)
+    cosines = (reference_texts * candidate_texts).sum(axis=1)
+
+    def top_k(query_vectors: np.ndarray, text_vectors: np.ndarray) -> np.ndarray:
+        return np.argsort(-query_vectors @ text_vectors.T, axis=1)[:, :k]
+
+    expected = top_k(embed(reference, queries, query=True), reference_texts)
+    found = top_k(embed(candidate, queries, query=True), candidate_texts)
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+
+    return {
+        "texts": len(texts),
+        "queries": len(queries),
+        "cosine_mean": float(cosines.mean()),
+        "cosine_min": float(cosines.min()),
+        f"recall@{k}": hits / expected.size,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the embedding model to quantized ONNX, or check its fidelity."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument(
+        "--model", default="sentence-transformers/all-mpnet-base-v2"
+    )
+    export_parser.add_argument("--output", default=config.onnx_model_folder_path)
+    export_parser.add_argument("--no-quantize", action="store_true")
+
+    check_parser = subparsers.add_parser(
+        "check", help="compare with the PyTorch model on chunks of the input PDFs"
+    )
+    check_parser.add_argument("--model-folder", default=config.onnx_model_folder_path)
+    check_parser.add_argument("--input-folder", default=config.input_folder_path)
+    check_parser.add_argument("--texts", type=int, default=1000)
+    check_parser.add_argument("--queries", type=int, default=100)
+    check_parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_model(args.model, args.output, quantize=not args.no_quantize)
+    else:
+        import models
+        import vectorstore
+
+        candidate = OnnxEmbeddings(args.model_folder)
+        reference = models.get_embeddings(
+            candidate.model_config["model_name"],
+            cache_folder_path=None,
+            backend="torch",
+        )
+
+        chunks = vectorstore.split_text(vectorstore.load_documents(args.input_folder))
+        rng = random.Random(0)
+        texts = [
+            c.page_content for c in rng.sample(chunks, min(args.texts, len(chunks)))
+        ]
+        # the first words of some chunks stand for questions about them
+        queries = [
+            " ".join(t.split()[:12])
+            for t in rng.sample(texts, min(args.queries, len(texts)))
+        ]
+
+        print(
+            json.dumps(
+                fidelity_report(reference, candidate, texts, queries, args.k), indent=2
+            )
+        )
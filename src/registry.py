@@ -0,0 +1,225 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, Union
+
+from langchain.embeddings.base import Embeddings
+from langchain_core.language_models import BaseChatModel
+
+import config
+import models
+import storage
+from compression import ContextCompressor
+from embedding_cache import CachedEmbeddings
+from semantic_cache import SemanticCache
+
+_lock = threading.Lock()
+_resources: Dict[Hashable, Any] = {}
+_loading: Dict[Hashable, threading.Lock] = {}
+
+
+def get_resource(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """
+    Return the process-wide instance of a resource, creating it on first use.
+
+    Concurrent callers asking for the same key wait for a single load, while
+    resources with other keys can be loaded at the same time.
+
+    Args:
+        key (Hashable): Identifier of the resource.
+        factory (Callable[[], Any]): Function creating the resource.
+
+    Returns:
+        Any: The shared resource.
+    """
+    with _lock:
+        if key in _resources:
+            return _resources[key]
+        key_lock = _loading.setdefault(key, threading.Lock())
+
+    with key_lock:
+        with _lock:
+            if key in _resources:
+                return _resources[key]
+
+        resource = factory()
+
+        with _lock:
+            _resources[key] = resource
+            _loading.pop(key, None)
+
+    return resource
+
+
+def get_embeddings(
+    model_name: str = "sentence-transformers/all-mpnet-base-v2",
+) -> Embeddings:
+    """
+    Return the shared embedding model, loading it on first use.
+
+    Args:
+        model_name (str): The name of the embedding model to use. Defaults to 'sentence-transformers/all-mpnet-base-v2'.
+
+    Returns:
+        Embeddings: The shared instance of models.get_embeddings(model_name).
+    """
+    return get_resource(
+        ("embeddings", model_name, config.embedding_backend),
+        lambda: models.get_embeddings(model_name),
+    )
+
+
+def get_llm(model: str = "gemini-1.5-flash") -> BaseChatModel:
+    """
+    Return the shared language model client, creating it on first use.
+
+    Args:
+        model (str): The name of the language model to use. Defaults to 'gemini-1.5-flash'.
+
+    Returns:
+        BaseChatModel: The shared instance of models.get_llm(model).
+    """
+    return get_resource(("llm", model), lambda: models.get_llm(model))
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the shared event loop, started in a background thread on first use.
+
+    Async chains are driven from synchronous code on this loop, so that async
+    clients bound to a loop (e.g. the LLM client) are always used from the same one.
+
+    Returns:
+        asyncio.AbstractEventLoop: The running event loop.
+    """
+
+    def start() -> asyncio.AbstractEventLoop:
+        loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=loop.run_forever, name="event-loop", daemon=True
+        ).start()
+        return loop
+
+    return get_resource(("event_loop",), start)
+
+
+def get_search_pool() -> ThreadPoolExecutor:
+    """
+    Return the shared thread pool searching index shards, created on first use.
+
+    FAISS releases the GIL while searching, so the shards of a query are searched in
+    parallel.
+
+    Returns:
+        ThreadPoolExecutor: The thread pool, of config.search_max_workers threads.
+    """
+    return get_resource(
+        ("search_pool",),
+        lambda: ThreadPoolExecutor(
+            max_workers=config.search_max_workers, thread_name_prefix="search"
+        ),
+    )
+
+
+def get_context_compressor(embeddings: Embeddings) -> ContextCompressor:
+    """
+    Return the shared compressor of retrieved chunks, creating it on first use.
+
+    Sentences are embedded by the model itself: the on-disk cache of CachedEmbeddings,
+    shared with ingestion, only holds chunks.
+
+    Args:
+        embeddings (Embeddings): Embedding model the chunks were retrieved with.
+
+    Returns:
+        ContextCompressor: The compressor, with the budget and thresholds of config.
+    """
+    if isinstance(embeddings, CachedEmbeddings):
+        embeddings = embeddings.embeddings
+
+    return get_resource(
+        ("context_compressor",),
+        lambda: ContextCompressor(
+            embeddings,
+            max_tokens=config.context_max_tokens,
+            min_similarity=config.context_min_similarity,
+            redundancy_threshold=config.context_redundancy_threshold,
+            cache_size=config.context_cache_size,
+        ),
+    )
+
+
+def get_index(index_id: str, factory: Callable[[], Any]) -> Any:
+    """
+    Return the shared vector store of an index, loading it on first use.
+
+    Args:
+        index_id (str): Identifier of the index.
+        factory (Callable[[], Any]): Function loading the vector store.
+
+    Returns:
+        Any: The shared vector store.
+    """
+    return get_resource(("index", index_id), factory)
+
+
+def get_semantic_cache(
+    index_id: Union[str, Tuple[str, ...]],
+    embeddings: Embeddings,
+    scope: Hashable = None,
+) -> SemanticCache:
+    """
+    Return the shared semantic answer cache of an index, creating it on first use.
+
+    The cache is dropped and cleared together with its index by invalidate, so that
+    answers computed from outdated documents are not served, even to live sessions.
+
+    Args:
+        index_id (Union[str, Tuple[str, ...]]): Identifier of the index the answers were
+            computed from, or identifiers of the shards searched together.
+        embeddings (Embeddings): Embedding model used to embed the questions.
+        scope (Hashable): Part of the index the answers were computed from, e.g. the
+            documents searched, each with its own cache. Defaults to None (the whole index).
+
+    Returns:
+        SemanticCache: The shared cache.
+    """
+    return get_resource(
+        ("index", index_id, "semantic_cache", scope),
+        lambda: SemanticCache(
+            embeddings,
+            threshold=config.semantic_cache_threshold,
+            ttl=config.semantic_cache_ttl,
+            max_entries=config.semantic_cache_max_entries,
+        ),
+    )
+
+
+def invalidate(index_id: Optional[str] = None) -> None:
+    """
+    Drop a shared index, and the resources derived from it, so that it is loaded again on next use.
+
+    Semantic caches of the index, and of the groups of shards it belongs to, are also
+    cleared, as sessions may still hold them, and the docstore connections of the
+    index are closed.
+
+    Args:
+        index_id (Optional[str]): Identifier of the index. Defaults to None (drop every index).
+    """
+    with _lock:
+        dropped = [
+            _resources.pop(key)
+            for key in list(_resources)
+            if key[0] == "index"
+            and (
+                index_id in (None, key[1])
+                or (isinstance(key[1], tuple) and index_id in key[1])
+            )
+        ]
+
+    # sessions created earlier keep a reference to their semantic cache
+    for resource in dropped:
+        if isinstance(resource, SemanticCache):
+            resource.clear()
+        elif isinstance(getattr(resource, "docstore", None), storage.SQLiteDocstore):
+            resource.docstore.close()
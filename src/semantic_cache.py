@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+import telemetry
+
+
+class SemanticCache:
+    """
+    In-memory cache of answers, looked up by the similarity of the questions.
+
+    Questions are embedded and kept in a small FAISS inner-product index over
+    normalized vectors, so that a question whose cosine similarity with a cached one
+    reaches the threshold is served the cached answer. Entries expire after a TTL, and
+    the least recently used entry is evicted when the cache is full.
+
+    Attributes:
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups not found in the cache.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = 0.95,
+        ttl: Optional[float] = None,
+        max_entries: int = 1000,
+    ) -> None:
+        """
+        Initialize an empty cache.
+
+        Args:
+            embeddings (Embeddings): Embedding model used to embed the questions.
+            threshold (float): Minimum cosine similarity for a cache hit. Defaults to 0.95.
+            ttl (Optional[float]): Number of seconds an answer stays valid. Defaults to None (forever).
+            max_entries (int): Maximum number of cached answers. Defaults to 1000.
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = None
+        self._entries = OrderedDict()
+        self._next_id = 0
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.array([self.embeddings.embed_query(question)], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _remove(self, entry_ids) -> None:
+        for entry_id in entry_ids:
+            del self._entries[entry_id]
+        self._index.remove_ids(np.array(entry_ids, dtype=np.int64))
+
+    def lookup(self, question: str) -> Optional[str]:
+        """
+        Find the answer of a cached question similar enough to the given one.
+
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            Optional[str]: The cached answer, or None on a cache miss.
+        """
+        vector = self._embed(question)
+
+        with self._lock:
+            if self._index is not None and self._index.ntotal:
+                now = time.time()
+                expired = [
+                    i
+                    for i, (_, _, created) in self._entries.items()
+                    if self.ttl is not None and now - created > self.ttl
+                ]
+                if expired:
+                    self._remove(expired)
+
+            if self._index is None or not self._index.ntotal:
+                self.misses += 1
+                telemetry.count("semantic_cache.misses")
+                return None
+
+            scores, ids = self._index.search(vector, 1)
+
+            if scores[0][0] < self.threshold:
+                self.misses += 1
+                telemetry.count("semantic_cache.misses")
+                return None
+
+            entry_id = int(ids[0][0])
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            telemetry.count("semantic_cache.hits")
+
+            return self._entries[entry_id][1]
+
+    def add(self, question: str, answer: str) -> None:
+        """
+        Cache the answer of a question, evicting the least recently used entry if the cache is full.
+
+        Args:
+            question (str): The user's question.
+            answer (str): The model's answer.
+        """
+        vector = self._embed(question)
+
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+
+            if len(self._entries) >= self.max_entries:
+                self._remove([next(iter(self._entries))])
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = (question, answer, time.time())
+
+    def clear(self) -> None:
+        """
+        Drop every cached answer, e.g. after the documents were indexed again.
+        """
+        with self._lock:
+            self._index = None
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Report the cache usage counters.
+
+        Returns:
+            Dict[str, float]: Hits, misses, hit rate and number of cached answers.
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,630 @@
+import argparse
+import json
+import os
+import queue
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import config
+import telemetry
+import utils
+import warmup
+
+# chat is imported by the worker processes on first use, after the fork: the parent
+# process only holds the listening socket
+
+# largest accepted request body, in bytes
+MAX_BODY_SIZE = 1 << 20
+
+# seconds a rejected connection is kept open for its client to finish sending, so that
+# closing it does not reset the connection before the client reads the error
+LINGER_TIMEOUT = 1
+
+STATUS_MESSAGES = {
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    """
+    Raised by request handlers to answer with an error status.
+    """
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def new_chat(session_id: str) -> Any:
+    """
+    Create the Chat of a session, remembering the interactions already logged for it.
+
+    Args:
+        session_id (str): Identifier of the conversation.
+
+    Returns:
+        chat.Chat: The Chat instance.
+    """
+    import chat
+
+    chat_ins = chat.Chat(
+        store_folder_path=config.output_folder_path,
+        db_path=config.db_path,
+        chat_template=config.chat_template,
+        session_id=session_id,
+    )
+    chat_ins.sync_history()
+
+    return chat_ins
+
+
+class SessionPool:
+    """
+    Chat instances of the recent sessions of a server process, least recently used evicted first.
+
+    Each session has a lock: the questions of a conversation are answered one at a
+    time, as each depends on the memory of the previous ones. Chat instances switch to
+    a new version of the index by themselves, see Chat.refresh.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], Any] = new_chat,
+        max_sessions: int = config.server_max_sessions,
+    ) -> None:
+        """
+        Initialize an empty pool.
+
+        Args:
+            factory (Callable[[str], Any]): Creates the Chat of a session ID. Defaults to new_chat.
+            max_sessions (int): Maximum number of Chat instances kept. Defaults to config.server_max_sessions.
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()
+
+    def get(self, session_id: str) -> Tuple[threading.Lock, Callable[[], Any]]:
+        """
+        Get the lock of a session, and a function returning its Chat, to call while holding the lock.
+
+        Args:
+            session_id (str): Identifier of the conversation.
+
+        Returns:
+            Tuple[threading.Lock, Callable[[], Any]]: The lock and the Chat getter.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                # lock, Chat
+                session = self._sessions[session_id] = [threading.Lock(), None]
+            self._sessions.move_to_end(session_id)
+
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+        def get_chat() -> Any:
+            if session[1] is None:
+                session[1] = self.factory(session_id)
+            return session[1]
+
+        return session[0], get_chat
+
+
+class BoundedHTTPServer(HTTPServer):
+    """
+    HTTP server answering requests in a fixed pool of threads, fed by a bounded queue.
+
+    When the queue is full, connections are answered 429 at once, without reading
+    them; requests that waited in the queue longer than queue_timeout are answered 503,
+    as their client has likely given up. shutdown_gracefully stops accepting requests
+    and lets the queued and running ones finish.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        handler: type,
+        sessions: SessionPool,
+        threads: int = config.server_threads,
+        queue_size: int = config.server_queue_size,
+        queue_timeout: float = config.server_queue_timeout,
+    ) -> None:
+        """
+        Initialize the server on a listening socket and start its threads.
+
+        Args:
+            sock (socket.socket): A bound, listening socket.
+            handler (type): The request handler class.
+            sessions (SessionPool): The Chat instances of the sessions.
+            threads (int): Number of requests answered at a time. Defaults to config.server_threads.
+            queue_size (int): Number of requests waiting for a thread. Defaults to config.server_queue_size.
+            queue_timeout (float): Seconds a request may wait for a thread. Defaults to config.server_queue_timeout.
+        """
+        super().__init__(sock.getsockname()[:2], handler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.server_address = sock.getsockname()
+        self.server_name, self.server_port = self.server_address[:2]
+
+        self.sessions = sessions
+        self.queue_timeout = queue_timeout
+        self.stopping = False
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        # rejected connections, closed by a single thread once their client is done
+        self._lingering: queue.Queue = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"http-{i}", daemon=True)
+            for i in range(threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+        threading.Thread(
+            target=self._close_lingering, name="http-linger", daemon=True
+        ).start()
+
+    def queue_size(self) -> int:
+        """
+        Number of requests waiting for a thread.
+
+        Returns:
+            int: The size of the queue.
+        """
+        return self._queue.qsize()
+
+    def process_request(self, request: socket.socket, client_address: Any) -> None:
+        if self.stopping:
+            self.reject(request, 503, "shutting down")
+            return
+
+        try:
+            self._queue.put_nowait((request, client_address, time.monotonic()))
+        except queue.Full:
+            telemetry.count("server.rejected", status="429")
+            self.reject(request, 429, "too many requests")
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            request, client_address, queued_at = item
+            waited = time.monotonic() - queued_at
+            telemetry.record_span("server.queue", waited)
+
+            if waited > self.queue_timeout:
+                telemetry.count("server.rejected", status="503")
+                self.reject(request, 503, "request timed out in the queue")
+                continue
+
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def reject(self, request: socket.socket, status: int, message: str) -> None:
+        """
+        Answer a connection with an error status, without reading its request, and close it.
+
+        The connection is closed in the background once the client is done sending.
+
+        Args:
+            request (socket.socket): The connection.
+            status (int): The HTTP status.
+            message (str): The error message.
+        """
+        body = json.dumps({"error": message}).encode("utf-8")
+        head = (
+            f"HTTP/1.0 {status} {STATUS_MESSAGES[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Retry-After: 1\r\n"
+            "Connection: close\r\n\r\n"
+        )
+
+        try:
+            # the response fits in the send buffer: this never waits on the client
+            request.sendall(head.encode("ascii") + body)
+            request.shutdown(socket.SHUT_WR)
+        except OSError:
+            self.close_request(request)
+            return
+
+        # closed by another thread: this one accepts connections
+        self._lingering.put(request)
+
+    def _close_lingering(self) -> None:
+        # read and discard what rejected clients still send, and close their connection
+        # once they close theirs or after LINGER_TIMEOUT seconds
+        selector = selectors.DefaultSelector()
+        deadlines: Dict[socket.socket, float] = {}
+
+        while True:
+            try:
+                # wait for a connection when there is none to watch
+                request = self._lingering.get(block=not deadlines)
+                while True:
+                    request.setblocking(False)
+                    selector.register(request, selectors.EVENT_READ)
+                    deadlines[request] = time.monotonic() + LINGER_TIMEOUT
+                    request = self._lingering.get_nowait()
+            except queue.Empty:
+                pass
+
+            for key, _ in selector.select(timeout=0.05):
+                try:
+                    done = not key.fileobj.recv(65536)
+                except OSError:
+                    done = True
+                if done:
+                    deadlines[key.fileobj] = 0
+
+            now = time.monotonic()
+            for request in [r for r, deadline in deadlines.items() if deadline <= now]:
+                del deadlines[request]
+                selector.unregister(request)
+                self.close_request(request)
+
+    def shutdown_gracefully(
+        self, timeout: float = config.server_shutdown_timeout
+    ) -> bool:
+        """
+        Stop accepting requests, then wait for the queued and running ones to finish.
+
+        Must be called from another thread than the one running serve_forever.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait. Defaults to config.server_shutdown_timeout.
+
+        Returns:
+            bool: False if requests were still running after the timeout.
+        """
+        self.stopping = True
+        self.shutdown()
+        deadline = time.monotonic() + timeout
+
+        # queued requests are answered before the threads get their stop marker
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=max(deadline - time.monotonic(), 0))
+            except queue.Full:
+                break
+
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+
+        return not any(t.is_alive() for t in self._threads)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Endpoints of the API:
+
+    - POST /ask {"question", "session_id"?, "sources"?}: answer a question, as JSON.
+    - POST /ask/stream: same, streaming the answer as server-sent events: one "data"
+      event per token (a JSON string), then a "done" event with the JSON response of /ask.
+    - GET /history?session_id=...&after_id=...&limit=...: the logged interactions.
+    - GET /health: the state of the process, 503 until it is ready.
+    """
+
+    server: BoundedHTTPServer
+    # one request per connection: keep-alive would hold a thread per idle client
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, payload: Any) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status in (429, 503):
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_SIZE:
+            raise HTTPError(413, "request body too large")
+
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise HTTPError(400, "invalid JSON")
+
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "expected a JSON object")
+
+        return payload
+
+    def load_chat(self, get_chat: Callable[[], Any]) -> Any:
+        try:
+            return get_chat()
+        except Exception as e:
+            # e.g. before the first ingestion
+            raise HTTPError(503, f"no index to answer from: {e}")
+
+    def check_ready(self) -> None:
+        if self.server.stopping:
+            raise HTTPError(503, "shutting down")
+        if config.warmup_enabled and not warmup.is_ready():
+            raise HTTPError(503, "loading models")
+
+    def dispatch(self, method: str) -> None:
+        url = urlparse(self.path)
+        start = time.perf_counter()
+        status = 200
+
+        try:
+            route = {
+                ("GET", "/health"): self.health,
+                ("GET", "/history"): self.history,
+                ("POST", "/ask"): self.ask,
+                ("POST", "/ask/stream"): self.ask_stream,
+            }.get((method, url.path))
+            if route is None:
+                raise HTTPError(404, f"no such endpoint: {method} {url.path}")
+
+            route({k: v[-1] for k, v in parse_qs(url.query).items()})
+        except HTTPError as e:
+            status = e.status
+            self.send_json(e.status, {"error": str(e)})
+        except (BrokenPipeError, ConnectionResetError):
+            # the client left, e.g. during a stream
+            status = 499
+        except Exception as e:
+            status = 500
+            print(f"{method} {url.path} failed: {e!r}")
+            self.send_json(500, {"error": repr(e)})
+        finally:
+            telemetry.record_span(
+                "server.request",
+                time.perf_counter() - start,
+                endpoint=url.path,
+                status=str(status),
+            )
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def health(self, params: Dict[str, str]) -> None:
+        state = warmup.status()["state"] if config.warmup_enabled else "ready"
+        ready = state in ("ready", "failed") and not self.server.stopping
+
+        self.send_json(
+            200 if ready else 503,
+            {
+                "status": "stopping" if self.server.stopping else state,
+                "pid": os.getpid(),
+                "queued": self.server.queue_size(),
+            },
+        )
+
+    def history(self, params: Dict[str, str]) -> None:
+        if not params.get("session_id"):
+            raise HTTPError(400, "session_id is required")
+
+        try:
+            after_id = int(params["after_id"]) if "after_id" in params else None
+            limit = int(params.get("limit", config.history_page_size))
+        except ValueError:
+            raise HTTPError(400, "after_id and limit must be integers")
+
+        self.check_ready()
+        lock, get_chat = self.server.sessions.get(params["session_id"])
+
+        with lock:
+            rows = self.load_chat(get_chat).get_history(after_id=after_id, limit=limit)
+
+        self.send_json(
+            200,
+            {
+                "session_id": params["session_id"],
+                "interactions": [
+                    {"id": r[0], "question": r[1], "answer": r[2], "timestamp": r[3]}
+                    for r in rows
+                ],
+            },
+        )
+
+    def _prepare(self) -> Tuple[str, str, Optional[List[str]]]:
+        payload = self.read_json()
+        question = payload.get("question")
+        sources = payload.get("sources")
+
+        if not isinstance(question, str) or not question.strip():
+            raise HTTPError(400, "question is required")
+        if sources is not None and not (
+            isinstance(sources, list) and all(isinstance(s, str) for s in sources)
+        ):
+            raise HTTPError(400, "sources must be a list of paths")
+
+        self.check_ready()
+
+        return payload.get("session_id") or utils.get_unique_id(), question, sources
+
+    def ask(self, params: Dict[str, str]) -> None:
+        session_id, question, sources = self._prepare()
+        lock, get_chat = self.server.sessions.get(session_id)
+
+        with lock:
+            chat_ins = self.load_chat(get_chat)
+            chat_ins.sync_history()
+            chat_ins.set_sources(sources)
+            qa = chat_ins.log(chat_ins.ask(question))
+
+        self.send_json(200, {"session_id": session_id, "answer": qa.answer})
+
+    def ask_stream(self, params: Dict[str, str]) -> None:
+        session_id, question, sources = self._prepare()
+        lock, get_chat = self.server.sessions.get(session_id)
+
+        def send_event(data: Any, event: Optional[str] = None) -> None:
+            line = "data: " + json.dumps(data, ensure_ascii=False) + "\n\n"
+            self.wfile.write(
+                ((f"event: {event}\n" if event else "") + line).encode("utf-8")
+            )
+            self.wfile.flush()
+
+        with lock:
+            chat_ins = self.load_chat(get_chat)
+            chat_ins.sync_history()
+            chat_ins.set_sources(sources)
+            qa, tokens = chat_ins.ask_stream(question)
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+
+            try:
+                for token in tokens:
+                    send_event(token)
+            except (BrokenPipeError, ConnectionResetError):
+                raise
+            except Exception as e:
+                # the status is sent already: the error ends the stream instead
+                print(f"POST /ask/stream failed: {e!r}")
+                send_event({"error": repr(e)}, event="error")
+                return
+
+            chat_ins.log(qa)
+
+        send_event({"session_id": session_id, "answer": qa.answer}, event="done")
+
+
+def run_worker(sock: socket.socket, index: int = 0) -> None:
+    """
+    Serve requests on a listening socket until SIGTERM or SIGINT, then shut down gracefully.
+
+    Args:
+        sock (socket.socket): The listening socket, shared with the other workers.
+        index (int): Number of the worker, e.g. to give each its own metrics port.
+    """
+    if config.telemetry_prometheus_port:
+        config.telemetry_prometheus_port += index
+    telemetry.setup()
+
+    server = BoundedHTTPServer(sock, RequestHandler, SessionPool())
+
+    def stop(signum, frame):
+        server.stopping = True
+        # serve_forever runs in this thread: it must be stopped from another one
+        threading.Thread(target=server.shutdown, name="shutdown").start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    if config.warmup_enabled:
+        warmup.start(config.output_folder_path)
+
+    print(f"Worker {os.getpid()} serving on {server.server_name}:{server.server_port}")
+    server.serve_forever(poll_interval=0.5)
+
+    # serve_forever returned: let the queued and running requests finish
+    if not server.shutdown_gracefully():
+        print(f"Worker {os.getpid()} stopped with requests still running")
+
+
+def serve(
+    host: str = config.server_host,
+    port: int = config.server_port,
+    workers: int = config.server_workers,
+) -> None:
+    """
+    Serve the API with pre-forked worker processes sharing one listening socket.
+
+    The kernel hands each connection to one of the workers. Each worker loads the
+    models and opens the index itself; indexes are memory-mapped where FAISS supports
+    it (see storage.open_vector_store), so their pages are shared by the workers
+    through the OS page cache. A worker that dies is replaced. On SIGTERM or SIGINT,
+    the workers finish their requests and exit, then the parent exits.
+
+    Without os.fork (Windows), a single worker runs in this process.
+
+    Args:
+        host (str): Address to listen on. Defaults to config.server_host.
+        port (int): Port to listen on. Defaults to config.server_port.
+        workers (int): Number of worker processes. Defaults to config.server_workers.
+    """
+    sock = socket.create_server(
+        (host, port), backlog=config.server_queue_size * workers
+    )
+
+    if workers <= 1 or not hasattr(os, "fork"):
+        run_worker(sock)
+        return
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # the child serves until stopped, then exits with its atexit handlers
+            # (e.g. flushing the database writes)
+            run_worker(sock, index)
+            sys.exit(0)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for index in range(workers):
+        spawn(index)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"Worker {pid} exited with status {status}, restarting it")
+            spawn(index)
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the chat API over HTTP.")
+    parser.add_argument("--host", default=config.server_host)
+    parser.add_argument("--port", type=int, default=config.server_port)
+    parser.add_argument("--workers", type=int, default=config.server_workers)
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers)
@@ -0,0 +1,361 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import config
+import manifest as mf
+import storage
+
+# each version of an index is described by the manifest it was built with, saved next
+# to its files as <vector_id>.manifest.json; the folder manifest is a copy of the active one
+VERSION_SUFFIX = ".manifest.json"
+
+# leases of the versions in use: one file per process, under leases/<vector_id>/
+LEASE_FOLDER_NAME = "leases"
+
+# seconds between two renewals of the leases of a process, and seconds after which a
+# lease that was not renewed is stale (its process died)
+LEASE_INTERVAL = 30
+LEASE_TTL = 120
+
+_lock = threading.Lock()
+# number of holders of each (folder path, vector ID) in this process
+_held: Dict[Tuple[str, str], int] = {}
+# process ID of the thread renewing the leases, which does not survive a fork
+_renewer_pid: Optional[int] = None
+
+
+def get_version_path(folder_path: str, vector_id: str) -> str:
+    """
+    Get the path of the manifest of a version of an index.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        vector_id (str): The unique identifier of the version.
+
+    Returns:
+        str: The path of the version manifest.
+    """
+    return os.path.join(folder_path, f"{vector_id}{VERSION_SUFFIX}")
+
+
+def _write_json(data: dict, path: str) -> None:
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+    os.replace(f"{path}.tmp", path)
+
+
+def save_version(folder_path: str, state: dict) -> None:
+    """
+    Record a complete build of an index as a version that can be activated.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        state (dict): The manifest of the build, with its vector ID under 'index_name' and
+            its build metadata under 'build'.
+    """
+    state = {k: v for k, v in state.items() if k != "pending_index"}
+    _write_json(state, get_version_path(folder_path, state["index_name"]))
+
+
+def load_version(folder_path: str, vector_id: str) -> dict:
+    """
+    Load the manifest of a version of an index.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        vector_id (str): The unique identifier of the version.
+
+    Returns:
+        dict: The version manifest.
+
+    Raises:
+        ValueError: If the version does not exist, or its files were removed.
+    """
+    path = get_version_path(folder_path, vector_id)
+
+    if not os.path.exists(path) or not storage.exists(folder_path, f"{vector_id}.bin"):
+        raise ValueError(f"No version {vector_id} in {folder_path}")
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def activate(folder_path: str, vector_id: str) -> None:
+    """
+    Atomically make a version the index served from a folder, e.g. to roll back a build.
+
+    Running Chat instances switch to it in the background, see Chat.refresh. A build in
+    progress is resumed as usual, and becomes the active version once complete.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        vector_id (str): The unique identifier of the version.
+    """
+    version = load_version(folder_path, vector_id)
+    manifest = mf.load_manifest(folder_path)
+
+    if "pending_index" in manifest:
+        version["pending_index"] = manifest["pending_index"]
+
+    mf.save_manifest(version, folder_path)
+
+
+def remove_version(folder_path: str, vector_id: str) -> None:
+    """
+    Remove the files, manifest and leases of a version of an index.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        vector_id (str): The unique identifier of the version.
+    """
+    storage.remove_vector_store(folder_path, f"{vector_id}.bin")
+    shutil.rmtree(
+        os.path.join(folder_path, LEASE_FOLDER_NAME, vector_id), ignore_errors=True
+    )
+
+    if os.path.exists(get_version_path(folder_path, vector_id)):
+        os.remove(get_version_path(folder_path, vector_id))
+
+
+def list_versions(folder_path: str) -> List[dict]:
+    """
+    List the versions of the index of a folder.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+
+    Returns:
+        List[dict]: For each version, oldest first: its vector ID ('index_name'), its build
+            metadata, whether it is active and whether a process is using it ('leased').
+    """
+    if not os.path.isdir(folder_path):
+        return []
+
+    active = mf.load_manifest(folder_path)["index_name"]
+    versions = []
+
+    for file_name in os.listdir(folder_path):
+        if not file_name.endswith(VERSION_SUFFIX):
+            continue
+
+        vector_id = file_name[: -len(VERSION_SUFFIX)]
+        with open(os.path.join(folder_path, file_name), "r", encoding="utf-8") as f:
+            build = json.load(f).get("build", {})
+
+        versions.append(
+            {
+                "index_name": vector_id,
+                **build,
+                "active": vector_id == active,
+                "leased": is_leased(folder_path, vector_id),
+            }
+        )
+
+    return sorted(versions, key=lambda v: v.get("created_at", 0))
+
+
+def _get_lease_path(folder_path: str, vector_id: str) -> str:
+    return os.path.join(
+        folder_path,
+        LEASE_FOLDER_NAME,
+        vector_id,
+        f"{socket.gethostname()}-{os.getpid()}",
+    )
+
+
+def _touch(path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8"):
+        pass
+    os.utime(path)
+
+
+def _renew() -> None:
+    pid = os.getpid()
+
+    while _renewer_pid == pid:
+        time.sleep(LEASE_INTERVAL)
+        with _lock:
+            held = list(_held)
+
+        for folder_path, vector_id in held:
+            try:
+                _touch(_get_lease_path(folder_path, vector_id))
+            except OSError:
+                # the folder was removed: the lease is renewed once it exists again
+                continue
+
+
+def acquire(folder_path: str, vector_id: str) -> None:
+    """
+    Record that this process uses a version of an index, so that it is not garbage-collected.
+
+    The lease is renewed in the background until every holder released it.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        vector_id (str): The unique identifier of the version.
+    """
+    global _renewer_pid
+
+    key = (os.path.abspath(folder_path), vector_id)
+
+    with _lock:
+        _held[key] = _held.get(key, 0) + 1
+        if _held[key] == 1:
+            _touch(_get_lease_path(*key))
+
+        if _renewer_pid != os.getpid():
+            _renewer_pid = os.getpid()
+            threading.Thread(target=_renew, daemon=True).start()
+
+
+def release(folder_path: str, vector_id: str) -> bool:
+    """
+    Release a version of an index acquired by acquire.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        vector_id (str): The unique identifier of the version.
+
+    Returns:
+        bool: True if this process no longer uses the version.
+    """
+    key = (os.path.abspath(folder_path), vector_id)
+
+    with _lock:
+        if key not in _held:
+            return True
+
+        _held[key] -= 1
+        if _held[key] > 0:
+            return False
+
+        del _held[key]
+        try:
+            os.remove(_get_lease_path(*key))
+        except OSError:
+            pass
+
+    return True
+
+
+def release_all(leases: Iterable[Tuple[str, str]]) -> None:
+    """
+    Release versions of indexes, e.g. those of a Chat being garbage-collected.
+
+    Args:
+        leases (Iterable[Tuple[str, str]]): The folder path and vector ID of each version.
+    """
+    for folder_path, vector_id in list(leases):
+        release(folder_path, vector_id)
+
+
+def is_leased(folder_path: str, vector_id: str) -> bool:
+    """
+    Tell whether a process is using a version of an index.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        vector_id (str): The unique identifier of the version.
+
+    Returns:
+        bool: True if a lease of the version was renewed within LEASE_TTL seconds.
+    """
+    lease_folder_path = os.path.join(folder_path, LEASE_FOLDER_NAME, vector_id)
+
+    if not os.path.isdir(lease_folder_path):
+        return False
+
+    now = time.time()
+    for file_name in os.listdir(lease_folder_path):
+        try:
+            if (
+                now - os.path.getmtime(os.path.join(lease_folder_path, file_name))
+                < LEASE_TTL
+            ):
+                return True
+        except OSError:
+            continue
+
+    return False
+
+
+def collect_garbage(folder_path: str, keep: Optional[int] = None) -> List[str]:
+    """
+    Remove the versions of an index that are neither kept for rollback nor in use.
+
+    The active version, a build in progress and the `keep` most recent versions are
+    kept, as well as any version a process holds a lease on.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        keep (Optional[int]): Number of most recent versions kept. Defaults to
+            config.index_keep_versions.
+
+    Returns:
+        List[str]: The vector IDs of the removed versions.
+    """
+    keep = config.index_keep_versions if keep is None else keep
+    manifest = mf.load_manifest(folder_path)
+    protected = {
+        manifest["index_name"],
+        manifest.get("pending_index", {}).get("index_name"),
+    }
+    versions = list_versions(folder_path)
+    recent = versions[-keep:] if keep > 0 else []
+    protected.update(v["index_name"] for v in recent)
+    removed = []
+
+    for version in versions:
+        vector_id = version["index_name"]
+        if vector_id in protected or version["leased"]:
+            continue
+
+        remove_version(folder_path, vector_id)
+        removed.append(vector_id)
+
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the versions of an index.")
+    parser.add_argument(
+        "--folder", default=config.output_folder_path, help="index folder"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="list the versions, oldest first")
+    activate_parser = subparsers.add_parser(
+        "activate", help="serve a version, e.g. to roll back"
+    )
+    activate_parser.add_argument("vector_id")
+    gc_parser = subparsers.add_parser("gc", help="remove the versions no longer needed")
+    gc_parser.add_argument(
+        "--keep", type=int, default=None, help="recent versions kept"
+    )
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for v in list_versions(args.folder):
+            flags = " ".join(f for f in ("active", "leased") if v[f])
+            created = time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(v.get("created_at", 0))
+            )
+            print(
+                f"{v['index_name']}  {created}  {v.get('vectors', '?')} vectors  {flags}"
+            )
+    elif args.command == "activate":
+        activate(args.folder, args.vector_id)
+        print(f"Active version: {args.vector_id}")
+    else:
+        print(
+            "Removed versions: "
+            + (", ".join(collect_garbage(args.folder, args.keep)) or "none")
+        )
@@ -0,0 +1,406 @@
+import json
+import os
+import sqlite3
+import threading
+import weakref
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Tuple, Union
+
+import faiss
+from langchain.embeddings.base import Embeddings
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+# a saved vector store is made of two files next to each other: the FAISS index
+# (<index_name>.faiss) and the chunks, in an SQLite database (<index_name>.db); the
+# MinHash signatures of its chunks (<index_name>.minhash.npz, see
+# dedup.ChunkDeduplicator.save) may be saved with it
+INDEX_EXTENSION = "faiss"
+DOCSTORE_EXTENSION = "db"
+SIGNATURES_EXTENSION = "minhash.npz"
+
+
+class SQLiteDocstore(Docstore):
+    """
+    Read-only docstore reading chunks from an SQLite database on demand, by ID.
+
+    Only the chunks returned by a search are read, so that opening the store does not
+    depend on the size of the corpus, and processes serving the same store share the
+    pages of the database through the OS page cache.
+
+    Each thread reading chunks opens its own connection, until close is called, e.g.
+    once the version of the index is no longer served.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Initialize the docstore. The database is opened lazily, once per thread.
+
+        Args:
+            path (str): Path to the database written by write_docstore.
+        """
+        if not os.path.exists(path):
+            # e.g. a store saved with FAISS.save_local, whose docstore is pickled
+            raise FileNotFoundError(
+                f"docstore not found, rebuild the vector store: {path}"
+            )
+
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # connections of every thread, and number of times they were closed
+        self._connections: List[sqlite3.Connection] = []
+        self._generation = 0
+        # threads of a pool outlive the docstore: their connections must not
+        weakref.finalize(self, _close_connections, self._connections)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None or self._local.generation != self._generation:
+            # saved stores are never modified: a new build is written to new files
+            conn = sqlite3.connect(
+                f"file:{self.path}?mode=ro&immutable=1",
+                uri=True,
+                check_same_thread=False,
+            )
+            with self._lock:
+                self._connections.append(conn)
+                self._local.conn = conn
+                self._local.generation = self._generation
+
+        return conn
+
+    def close(self) -> None:
+        """
+        Close the connections of every thread, releasing the database file.
+
+        A search still running on the docstore opens a new connection, also closed by
+        a later call or when the docstore is garbage-collected.
+        """
+        with self._lock:
+            self._generation += 1
+            _close_connections(self._connections)
+
+    def search(self, search: str) -> Union[str, Document]:
+        """
+        Read a chunk by ID.
+
+        Args:
+            search (str): The ID of the chunk.
+
+        Returns:
+            Union[str, Document]: The chunk, or a message if it is not found.
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT page_content, metadata FROM chunks WHERE id = ?", (search,)
+            )
+            .fetchone()
+        )
+
+        if row is None:
+            return f"ID {search} not found."
+
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def get_ranges(self, sources: List[str]) -> List[Tuple[int, int]]:
+        """
+        Get the positions, in the FAISS index, of the chunks of some documents.
+
+        Args:
+            sources (List[str]): Paths of the source documents.
+
+        Returns:
+            List[Tuple[int, int]]: Start (inclusive) and stop (exclusive) positions, in order.
+                Documents that are not in the store have none.
+        """
+        conn = self._connection()
+        ranges = []
+
+        # one query per document keeps the parameters below SQLite's limit
+        for source in sources:
+            ranges.extend(
+                conn.execute(
+                    "SELECT start, stop FROM document_ranges WHERE source = ?",
+                    (source,),
+                ).fetchall()
+            )
+
+        return sorted(ranges)
+
+    def index_to_id(self) -> "IndexToIdMapping":
+        """
+        Return the mapping from positions in the FAISS index to chunk IDs, read on demand.
+
+        Returns:
+            IndexToIdMapping: The mapping, to be used as FAISS.index_to_docstore_id.
+        """
+        return IndexToIdMapping(self)
+
+
+def _close_connections(connections: List[sqlite3.Connection]) -> None:
+    while connections:
+        connections.pop().close()
+
+
+class IndexToIdMapping(Mapping):
+    """
+    Read-only mapping from positions in the FAISS index to chunk IDs, backed by an SQLiteDocstore.
+    """
+
+    def __init__(self, docstore: SQLiteDocstore) -> None:
+        self._docstore = docstore
+
+    def __getitem__(self, position: int) -> str:
+        # FAISS returns numpy integers, which sqlite3 cannot bind
+        row = (
+            self._docstore._connection()
+            .execute("SELECT id FROM chunks WHERE position = ?", (int(position),))
+            .fetchone()
+        )
+
+        if row is None:
+            raise KeyError(position)
+
+        return row[0]
+
+    def __iter__(self) -> Iterator[int]:
+        cursor = self._docstore._connection().execute(
+            "SELECT position FROM chunks ORDER BY position"
+        )
+        return (position for position, in cursor)
+
+    def __len__(self) -> int:
+        return (
+            self._docstore._connection()
+            .execute("SELECT COUNT(*) FROM chunks")
+            .fetchone()[0]
+        )
+
+
+def write_docstore(
+    path: str, docstore: Docstore, index_to_docstore_id: Dict[int, str]
+) -> None:
+    """
+    Write the chunks of a vector store to an SQLite database, replacing it atomically.
+
+    The positions of the chunks of each document, identified by the 'source' and
+    'doc_id' metadata, are also written as ranges of consecutive positions (one per
+    document, unless a resumed build interleaved it with others), see get_ranges.
+    Chunks shared by several documents as duplicates are in the ranges of each.
+
+    Args:
+        path (str): Path to the database.
+        docstore (Docstore): The docstore holding the chunks.
+        index_to_docstore_id (Dict[int, str]): Mapping from positions in the FAISS index to chunk IDs.
+    """
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    ranges = []
+    # last range of each document known as a duplicate, see vectorstore.add_reference
+    duplicate_ranges = {}
+
+    def rows() -> Iterator[Tuple[int, str, str, str]]:
+        for position, chunk_id in sorted(index_to_docstore_id.items()):
+            doc = docstore.search(chunk_id)
+            document = [doc.metadata.get("doc_id"), doc.metadata.get("source")]
+
+            if ranges and ranges[-1][:2] == document and ranges[-1][3] == position:
+                ranges[-1][3] += 1
+            else:
+                ranges.append([*document, position, position + 1])
+
+            for duplicate in doc.metadata.get("duplicates", ()):
+                key = (duplicate.get("doc_id"), duplicate.get("source"))
+                last = duplicate_ranges.get(key)
+                if last is not None and last[3] == position:
+                    last[3] += 1
+                elif key != tuple(document):
+                    duplicate_ranges[key] = [*key, position, position + 1]
+                    ranges.append(duplicate_ranges[key])
+
+            # PDF metadata may hold dates and other values JSON cannot represent
+            yield position, chunk_id, doc.page_content, json.dumps(
+                doc.metadata, default=str
+            )
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(
+            "CREATE TABLE chunks ("
+            "position INTEGER PRIMARY KEY, "
+            "id TEXT NOT NULL UNIQUE, "
+            "page_content TEXT NOT NULL, "
+            "metadata TEXT NOT NULL)"
+        )
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows())
+        conn.execute(
+            "CREATE TABLE document_ranges ("
+            "doc_id INTEGER, source TEXT, start INTEGER NOT NULL, stop INTEGER NOT NULL)"
+        )
+        conn.executemany("INSERT INTO document_ranges VALUES (?, ?, ?, ?)", ranges)
+        conn.execute("CREATE INDEX document_ranges_source ON document_ranges (source)")
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, path)
+
+
+def read_docstore(path: str) -> Tuple[InMemoryDocstore, Dict[int, str]]:
+    """
+    Read every chunk of an SQLite database, e.g. to update the vector store.
+
+    Args:
+        path (str): Path to the database written by write_docstore.
+
+    Returns:
+        Tuple[InMemoryDocstore, Dict[int, str]]: The docstore and the mapping from
+            positions in the FAISS index to chunk IDs.
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT position, id, page_content, metadata FROM chunks ORDER BY position"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    return (
+        InMemoryDocstore(
+            {
+                chunk_id: Document(
+                    id=chunk_id, page_content=text, metadata=json.loads(metadata)
+                )
+                for _, chunk_id, text, metadata in rows
+            }
+        ),
+        {position: chunk_id for position, chunk_id, _, _ in rows},
+    )
+
+
+def get_paths(folder_path: str, index_name: str) -> Tuple[str, str]:
+    """
+    Get the paths of the files of a saved vector store.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        index_name (str): Name of the vector store, e.g. '<vector_id>.bin'.
+
+    Returns:
+        Tuple[str, str]: The paths of the FAISS index and of the docstore.
+    """
+    base_path = os.path.join(folder_path, index_name)
+
+    return f"{base_path}.{INDEX_EXTENSION}", f"{base_path}.{DOCSTORE_EXTENSION}"
+
+
+def exists(folder_path: str, index_name: str) -> bool:
+    """
+    Tell whether a vector store was saved in this format.
+
+    Stores saved with FAISS.save_local (a pickled docstore) are not, and must be rebuilt.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        index_name (str): Name of the vector store.
+
+    Returns:
+        bool: True if both files exist.
+    """
+    return all(os.path.exists(p) for p in get_paths(folder_path, index_name))
+
+
+def save_vector_store(vectorstore: FAISS, folder_path: str, index_name: str) -> None:
+    """
+    Save a vector store: the FAISS index and the chunks in an SQLite database.
+
+    Args:
+        vectorstore (FAISS): The vector store.
+        folder_path (str): Path to the folder where the files are written.
+        index_name (str): Name of the vector store.
+    """
+    index_path, docstore_path = get_paths(folder_path, index_name)
+
+    # written aside and renamed, as processes may have the previous file mapped
+    faiss.write_index(vectorstore.index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+    write_docstore(
+        docstore_path, vectorstore.docstore, vectorstore.index_to_docstore_id
+    )
+
+
+def load_vector_store(
+    folder_path: str, index_name: str, embeddings: Embeddings
+) -> FAISS:
+    """
+    Load a vector store entirely in memory, to update it.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        index_name (str): Name of the vector store.
+        embeddings (Embeddings): Embedding model to use for vectorization.
+
+    Returns:
+        FAISS: The vector store.
+    """
+    index_path, docstore_path = get_paths(folder_path, index_name)
+    docstore, index_to_docstore_id = read_docstore(docstore_path)
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=faiss.read_index(index_path),
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+
+def open_vector_store(
+    folder_path: str, index_name: str, embeddings: Embeddings
+) -> FAISS:
+    """
+    Open a vector store read-only, to search it.
+
+    The FAISS index is memory-mapped where FAISS supports it (the inverted lists of IVF
+    indexes; other index types are read in memory) and chunks are only read from the
+    docstore when returned by a search.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        index_name (str): Name of the vector store.
+        embeddings (Embeddings): Embedding model to use for vectorization.
+
+    Returns:
+        FAISS: The vector store. It cannot be modified.
+    """
+    index_path, docstore_path = get_paths(folder_path, index_name)
+    docstore = SQLiteDocstore(docstore_path)
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=faiss.read_index(
+            index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        ),
+        docstore=docstore,
+        index_to_docstore_id=docstore.index_to_id(),
+    )
+
+
+def remove_vector_store(folder_path: str, index_name: str) -> None:
+    """
+    Remove the files of a saved vector store, including those of the legacy pickle format.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        index_name (str): Name of the vector store.
+    """
+    for extension in (INDEX_EXTENSION, DOCSTORE_EXTENSION, SIGNATURES_EXTENSION, "pkl"):
+        file_path = os.path.join(folder_path, f"{index_name}.{extension}")
+        if os.path.exists(file_path):
+            os.remove(file_path)
@@ -0,0 +1,322 @@
+import bisect
+import contextlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ContextManager, Dict, List, Optional, Tuple
+
+import config
+
+# upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_sinks: List["Sink"] = []
+_configured = False
+_NOOP = contextlib.nullcontext()
+
+
+class Sink:
+    """
+    Destination of the telemetry events. Subclasses implement record.
+    """
+
+    def record(
+        self, kind: str, name: str, value: float, labels: Dict[str, str]
+    ) -> None:
+        """
+        Record an event.
+
+        Args:
+            kind (str): 'span' (a duration in seconds), 'value' (an observation) or 'count' (an increment).
+            name (str): Dotted name of the metric, e.g. 'ask.llm'.
+            value (float): The duration, observed value or increment.
+            labels (Dict[str, str]): Dimensions of the event.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Release the resources of the sink.
+        """
+
+
+class JsonLinesSink(Sink):
+    """
+    Sink appending one JSON object per event to a file.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Open the file in append mode.
+
+        Args:
+            path (str): Path to the JSON-lines file.
+        """
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def record(
+        self, kind: str, name: str, value: float, labels: Dict[str, str]
+    ) -> None:
+        line = json.dumps(
+            {"ts": time.time(), "kind": kind, "name": name, "value": value, **labels}
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusSink(Sink):
+    """
+    Sink aggregating the events in memory and serving them in the Prometheus text format.
+
+    Spans are exported as histograms (<name>_seconds), values as summaries without
+    quantiles (<name>_sum and <name>_count) and counts as counters (<name>_total), with
+    dots in the names replaced by underscores and the 'rag_' prefix.
+    """
+
+    def __init__(self, port: Optional[int] = None, host: str = "127.0.0.1") -> None:
+        """
+        Initialize the sink, serving GET /metrics on the given port if any.
+
+        Args:
+            port (Optional[int]): Port of the metrics endpoint. Defaults to None (no endpoint).
+            host (str): Address the endpoint listens on. Defaults to '127.0.0.1'.
+        """
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, tuple], List[float]] = {}
+        self._summaries: Dict[Tuple[str, tuple], List[float]] = {}
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+        self._server = None
+
+        if port is not None:
+            sink = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = sink.exposition().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(
+                target=self._server.serve_forever, name="metrics", daemon=True
+            ).start()
+
+    def record(
+        self, kind: str, name: str, value: float, labels: Dict[str, str]
+    ) -> None:
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            if kind == "span":
+                # bucket counts, the last one above every bound, then sum and count
+                histogram = self._histograms.setdefault(
+                    key, [0] * (len(LATENCY_BUCKETS) + 3)
+                )
+                histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+                histogram[-2] += value
+                histogram[-1] += 1
+            elif kind == "value":
+                summary = self._summaries.setdefault(key, [0.0, 0])
+                summary[0] += value
+                summary[1] += 1
+            else:
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def exposition(self) -> str:
+        """
+        Render the aggregated metrics.
+
+        Returns:
+            str: The metrics in the Prometheus text exposition format.
+        """
+
+        def metric_name(name: str) -> str:
+            return "rag_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+        def label_string(labels: tuple, extra: str = "") -> str:
+            items = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+            return "{" + ",".join(items) + "}" if items else ""
+
+        lines = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                metric = metric_name(name) + "_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                bounds = [str(b) for b in LATENCY_BUCKETS] + ["+Inf"]
+                for bound, count in zip(bounds, histogram):
+                    cumulative += count
+                    bucket_labels = label_string(labels, 'le="%s"' % bound)
+                    lines.append(f"{metric}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{metric}_sum{label_string(labels)} {histogram[-2]}")
+                lines.append(f"{metric}_count{label_string(labels)} {histogram[-1]}")
+
+            for (name, labels), (total, count) in sorted(self._summaries.items()):
+                metric = metric_name(name)
+                lines.append(f"# TYPE {metric} summary")
+                lines.append(f"{metric}_sum{label_string(labels)} {total}")
+                lines.append(f"{metric}_count{label_string(labels)} {count}")
+
+            for (name, labels), total in sorted(self._counters.items()):
+                metric = metric_name(name) + "_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric}{label_string(labels)} {total}")
+
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class _Span:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, labels: Dict[str, str]) -> None:
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _emit("span", self.name, time.perf_counter() - self.start, self.labels)
+
+
+def _emit(kind: str, name: str, value: float, labels: Dict[str, str]) -> None:
+    for sink in _sinks:
+        try:
+            sink.record(kind, name, value, labels)
+        except Exception as e:
+            print(f"Failed to record {name} in {type(sink).__name__}: {e!r}")
+
+
+def enabled() -> bool:
+    """
+    Tell whether any sink is installed, e.g. to skip computing costly attributes.
+
+    Returns:
+        bool: True if events are recorded.
+    """
+    return bool(_sinks)
+
+
+def span(name: str, **labels: str) -> ContextManager:
+    """
+    Time a block of code.
+
+    Without sinks, a shared no-op context manager is returned, so that instrumented
+    code runs at practically full speed when telemetry is disabled.
+
+    Args:
+        name (str): Dotted name of the stage, e.g. 'ingest.embed'.
+        **labels (str): Dimensions of the span.
+
+    Returns:
+        ContextManager: The span, to be used in a with statement.
+    """
+    if not _sinks:
+        return _NOOP
+
+    return _Span(name, labels)
+
+
+def record_span(name: str, seconds: float, **labels: str) -> None:
+    """
+    Record the duration of a stage timed by the caller.
+
+    Args:
+        name (str): Dotted name of the stage.
+        seconds (float): The duration.
+        **labels (str): Dimensions of the span.
+    """
+    if _sinks:
+        _emit("span", name, seconds, labels)
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    """
+    Record an observed value, e.g. a retrieval score or a token count.
+
+    Args:
+        name (str): Dotted name of the metric.
+        value (float): The observed value.
+        **labels (str): Dimensions of the observation.
+    """
+    if _sinks:
+        _emit("value", name, value, labels)
+
+
+def count(name: str, amount: float = 1, **labels: str) -> None:
+    """
+    Increment a counter, e.g. the cache hits.
+
+    Args:
+        name (str): Dotted name of the counter.
+        amount (float): The increment. Defaults to 1.
+        **labels (str): Dimensions of the counter.
+    """
+    if _sinks and amount:
+        _emit("count", name, amount, labels)
+
+
+def add_sink(sink: Sink) -> None:
+    """
+    Install a sink, in addition to the configured ones.
+
+    Args:
+        sink (Sink): The sink.
+    """
+    with _lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink: Sink) -> None:
+    """
+    Uninstall and close a sink.
+
+    Args:
+        sink (Sink): The sink.
+    """
+    with _lock:
+        _sinks.remove(sink)
+    sink.close()
+
+
+def setup() -> None:
+    """
+    Install the sinks enabled in config, once per process.
+
+    config.telemetry_jsonl_path enables the JSON-lines sink and
+    config.telemetry_prometheus_port the Prometheus endpoint.
+    """
+    global _configured
+
+    with _lock:
+        if _configured:
+            return
+        _configured = True
+
+        if config.telemetry_jsonl_path:
+            _sinks.append(JsonLinesSink(config.telemetry_jsonl_path))
+        if config.telemetry_prometheus_port:
+            _sinks.append(PrometheusSink(config.telemetry_prometheus_port))
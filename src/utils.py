@@ -1,6 +1,11 @@
+import asyncio
+import hashlib
 import os
 import uuid
-from typing import List
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
 
 
 def get_unique_id() -> str:
@@ -13,6 +18,39 @@ def get_unique_id() -> str:
     return str(uuid.uuid4())
 
 
+def get_file_hash(file_path: str, block_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 hash of a file's content.
+
+    Args:
+        file_path (str): Path to the file.
+        block_size (int): Number of bytes read at a time. Defaults to 1 MiB.
+
+    Returns:
+        str: The hexadecimal digest of the file content.
+    """
+    digest = hashlib.sha256()
+
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def get_text_hash(text: str) -> str:
+    """
+    Compute the SHA-1 hash of a text.
+
+    Args:
+        text (str): The text to hash.
+
+    Returns:
+        str: The hexadecimal digest of the UTF-8 encoded text.
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
 def list_files_by_datetime(folder_path: str) -> List[str]:
     """
     List files in a directory, ordered by modification date.
@@ -52,3 +90,76 @@ def list_pdfs(folder_path: str) -> List[str]:
         for file in os.listdir(folder_path)
         if file.endswith(".pdf")
     ]
+
+
+def iter_batches(iterable: Iterable[T], batch_size: int) -> Iterator[List[T]]:
+    """
+    Group the items of an iterable into lists of at most batch_size items.
+
+    Args:
+        iterable (Iterable[T]): The items to group, possibly a generator.
+        batch_size (int): Maximum number of items per batch.
+
+    Yields:
+        List[T]: The next batch of items.
+    """
+    iterator = iter(iterable)
+
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def iter_sync(
+    iterator: AsyncIterator[T], loop: asyncio.AbstractEventLoop
+) -> Iterator[T]:
+    """
+    Consume an async iterator from synchronous code.
+
+    Args:
+        iterator (AsyncIterator[T]): The async iterator, e.g. an async generator.
+        loop (asyncio.AbstractEventLoop): A running event loop, in another thread, on which to iterate.
+
+    Yields:
+        T: The items of the async iterator.
+    """
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(
+                    iterator.__anext__(), loop
+                ).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        if hasattr(iterator, "aclose"):
+            asyncio.run_coroutine_threadsafe(iterator.aclose(), loop).result()
+
+
+class RateLimiter:
+    """
+    Async rate limiter spacing out calls evenly.
+    """
+
+    def __init__(self, rate: Optional[float]) -> None:
+        """
+        Initialize the rate limiter.
+
+        Args:
+            rate (Optional[float]): Maximum number of calls per second, or None for no limit.
+        """
+        self.interval = 1 / rate if rate else 0.0
+        self._next_time = 0.0
+
+    async def acquire(self) -> None:
+        """
+        Wait until the next call is allowed.
+        """
+        if not self.interval:
+            return
+
+        now = asyncio.get_running_loop().time()
+        wait = self._next_time - now
+        self._next_time = max(now, self._next_time) + self.interval
+
+        if wait > 0:
+            await asyncio.sleep(wait)
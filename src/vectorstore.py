@@ -1,35 +1,180 @@
-from typing import List
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.embeddings.base import Embeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.vectorstores import FAISS
 
 import config
-import models
+import dedup
+import indexes
+import manifest as mf
+import registry
+import snapshots
+import storage
+import telemetry
 import utils
 
 
-def load_documents(folder_path: str) -> List[dict]:
+def load_file(
+    file_path: str,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: int = 200,
+    timeout: Optional[int] = None,
+) -> List[dict]:
     """
-    Load and process all PDF documents from the specified folder.
+    Load a single PDF document and, optionally, split it into chunks.
+
+    This function runs inside the ingestion worker processes. When a timeout is
+    given, parsing is interrupted with a TimeoutError after that many seconds so
+    that a pathological PDF cannot hold a worker forever.
 
     Args:
-        folder_path (str): Path to the folder containing PDF files.
+        file_path (str): Path to the PDF file.
+        chunk_size (Optional[int]): Maximum size of each chunk. Defaults to None (no further splitting).
+        chunk_overlap (int): Overlap size between consecutive chunks. Defaults to 200.
+        timeout (Optional[int]): Maximum number of seconds to spend on the file. Defaults to None.
 
     Returns:
         List[dict]: A list of document objects, each containing content and metadata.
     """
-    pdf_files = utils.list_pdfs(folder_path)
-    documents = []
+    use_alarm = bool(timeout) and hasattr(signal, "SIGALRM")
 
-    for pdf_file in pdf_files:
-        loader = PyPDFLoader(pdf_file)
-        documents.extend(loader.load_and_split())
+    if use_alarm:
+
+        def on_timeout(signum, frame):
+            raise TimeoutError(f"timed out after {timeout}s")
+
+        previous_handler = signal.signal(signal.SIGALRM, on_timeout)
+        signal.alarm(timeout)
+
+    try:
+        documents = PyPDFLoader(file_path).load_and_split()
+
+        if chunk_size is not None:
+            documents = split_text(documents, chunk_size, chunk_overlap)
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous_handler)
 
     return documents
 
 
+def iter_documents(
+    file_paths: List[str],
+    chunk_size: Optional[int] = None,
+    chunk_overlap: int = 200,
+    max_workers: Optional[int] = None,
+    timeout: Optional[int] = None,
+    ordered: bool = False,
+) -> Iterator[Tuple[str, List[dict]]]:
+    """
+    Load (and optionally split) PDF documents in parallel, yielding each file as soon as it is done.
+
+    Files are parsed in a pool of worker processes. A file that fails to parse or
+    exceeds the timeout is reported and skipped without affecting the others.
+
+    Args:
+        file_paths (List[str]): File path for each PDF.
+        chunk_size (Optional[int]): Maximum size of each chunk. Defaults to None (no further splitting).
+        chunk_overlap (int): Overlap size between consecutive chunks. Defaults to 200.
+        max_workers (Optional[int]): Number of worker processes. Defaults to config.ingest_max_workers.
+        timeout (Optional[int]): Maximum number of seconds per file. Defaults to config.ingest_file_timeout.
+        ordered (bool): Yield the files in input order, holding those done before the
+            ones preceding them. Defaults to False (completion order).
+
+    Yields:
+        Tuple[str, List[dict]]: The file path and its document objects.
+    """
+    if not file_paths:
+        return
+
+    max_workers = max_workers or config.ingest_max_workers or os.cpu_count()
+    timeout = timeout or config.ingest_file_timeout
+
+    # spawn rather than fork: the parent may hold threads (e.g. the shared event loop)
+    # and locks that a forked child would inherit in an inconsistent state
+    max_workers = min(max_workers, len(file_paths))
+    remaining = iter(file_paths)
+    in_flight = {}
+    # files done but not yielded yet (None for a failed file), in input order if ordered
+    done_files: Dict[str, Optional[List[dict]]] = {}
+    order = iter(file_paths)
+    next_file = next(order)
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+
+        def submit(count: int) -> None:
+            for f in islice(remaining, count):
+                future = executor.submit(
+                    load_file, f, chunk_size, chunk_overlap, timeout
+                )
+                in_flight[future] = f
+
+        # keep a bounded window of files in flight or held, so that parsed documents do
+        # not pile up in memory faster than the caller consumes them
+        submit(2 * max_workers)
+
+        try:
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+                while done:
+                    future = done.pop()
+                    file_path = in_flight.pop(future)
+
+                    try:
+                        done_files[file_path] = future.result()
+                    except Exception as e:
+                        print(f"Failed to load {file_path}: {e!r}")
+                        telemetry.count("ingest.failed_files")
+                        done_files[file_path] = None
+                    finally:
+                        del future
+
+                    ready = []
+                    if not ordered:
+                        ready.append(file_path)
+                    while ordered and next_file in done_files:
+                        ready.append(next_file)
+                        next_file = next(order, None)
+
+                    for file_path in ready:
+                        documents = done_files.pop(file_path)
+                        submit(1)
+                        if documents is not None:
+                            yield file_path, documents
+        finally:
+            # the caller stopped early (e.g. a cancelled job): skip the files not started
+            for future in in_flight:
+                future.cancel()
+
+
+def load_documents(folder_path: str) -> List[dict]:
+    """
+    Load and process all PDF documents from the specified folder.
+
+    Args:
+        folder_path (str): Path to the folder containing PDF files.
+
+    Returns:
+        List[dict]: A list of document objects, each containing content and metadata.
+    """
+    return load_documents_from_file_paths(utils.list_pdfs(folder_path))
+
+
 def load_documents_from_file_paths(file_paths: List[str]) -> List[dict]:
     """
     Load and process all PDF documents from the specified folder.
@@ -40,13 +185,9 @@ def load_documents_from_file_paths(file_paths: List[str]) -> List[dict]:
     Returns:
         List[dict]: A list of document objects, each containing content and metadata.
     """
-    documents = []
+    loaded = dict(iter_documents(file_paths))
 
-    for pdf_file in file_paths:
-        loader = PyPDFLoader(pdf_file)
-        documents.extend(loader.load_and_split())
-
-    return documents
+    return [d for f in file_paths for d in loaded.get(f, [])]
 
 
 def split_text(
@@ -69,42 +210,636 @@ def split_text(
     return text_splitter.split_documents(documents)
 
 
+def assign_chunk_ids(chunks: List[dict], file_path: str, file_hash: str) -> List[str]:
+    """
+    Build deterministic, content-addressed IDs for the chunks of a file.
+
+    Args:
+        chunks (List[dict]): Chunks produced from the file, in order.
+        file_path (str): Path of the source file.
+        file_hash (str): Content hash of the source file.
+
+    Returns:
+        List[str]: One ID per chunk.
+    """
+    return [
+        utils.get_text_hash(f"{file_path}:{file_hash}:{i}")
+        for i, _ in enumerate(chunks)
+    ]
+
+
+def new_vector_store(
+    embeddings: Embeddings,
+    vectors: np.ndarray,
+    index_type: Optional[str] = None,
+    index_params: Optional[Dict[str, int]] = None,
+) -> FAISS:
+    """
+    Create an empty vector store on top of a FAISS index of the configured type.
+
+    Args:
+        embeddings (Embeddings): Embedding model to use for vectorization.
+        vectors (np.ndarray): Sample vectors, used to train the index if its type requires it.
+        index_type (Optional[str]): One of indexes.INDEX_TYPES. Defaults to config.index_type.
+        index_params (Optional[Dict[str, int]]): Index parameters. Defaults to config.index_params.
+
+    Returns:
+        FAISS: The empty vector store.
+    """
+    index = indexes.create_index(vectors, index_type or config.index_type, index_params)
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+
+
+def embed_in_batches(
+    chunks: Iterable[Tuple[str, dict]],
+    embeddings: Embeddings,
+    vectorstore: Optional[FAISS] = None,
+    batch_size: Optional[int] = None,
+    on_batch: Optional[Callable[[FAISS, List[str]], None]] = None,
+    index_type: Optional[str] = None,
+    index_params: Optional[Dict[str, int]] = None,
+) -> Optional[FAISS]:
+    """
+    Embed a stream of chunks in fixed-size batches, appending each batch to the vector store as it completes.
+
+    Only one batch of texts and vectors is held in memory at a time, except when a new
+    index must be trained (IVF types): batches are then buffered until enough vectors
+    have been collected to train it. Chunks whose ID is already in the vector store are
+    skipped, which lets an interrupted build resume from its last checkpoint.
+
+    Args:
+        chunks (Iterable[Tuple[str, dict]]): Pairs of chunk ID and chunk, e.g. from a generator.
+        embeddings (Embeddings): Embedding model to use for vectorization.
+        vectorstore (Optional[FAISS]): Vector store to append to. Defaults to None (a new one is created).
+        batch_size (Optional[int]): Number of chunks embedded at a time. Defaults to config.embedding_batch_size.
+        on_batch (Optional[Callable[[FAISS, List[str]], None]]): Called with the vector store and the IDs of
+            each batch once it is stored.
+        index_type (Optional[str]): Index type of a new vector store. Defaults to config.index_type.
+        index_params (Optional[Dict[str, int]]): Index parameters of a new vector store. Defaults to
+            config.index_params.
+
+    Returns:
+        Optional[FAISS]: The vector store, or None if no chunk was embedded.
+    """
+    batch_size = batch_size or config.embedding_batch_size
+    index_type = index_type or config.index_type
+    index_params = {**config.index_params, **(index_params or {})}
+    train_size = indexes.training_size(index_type, index_params)
+    existing_ids = (
+        set(vectorstore.index_to_docstore_id.values()) if vectorstore else set()
+    )
+    buffered = []
+
+    def store(embedded: List[tuple]) -> None:
+        nonlocal vectorstore
+
+        if vectorstore is None:
+            vectors = np.array(
+                [v for batch, _ in embedded for _, v, _, _ in batch], dtype=np.float32
+            )
+            vectorstore = new_vector_store(
+                embeddings, vectors, index_type, index_params
+            )
+
+        for batch, batch_ids in embedded:
+            if batch:
+                ids, vectors, texts, metadatas = zip(*batch)
+                with telemetry.span("ingest.add"):
+                    vectorstore.add_embeddings(
+                        list(zip(texts, vectors)),
+                        metadatas=list(metadatas),
+                        ids=list(ids),
+                    )
+            if on_batch is not None:
+                on_batch(vectorstore, batch_ids)
+
+    for batch in utils.iter_batches(chunks, batch_size):
+        new_chunks = [(i, c) for i, c in batch if i not in existing_ids]
+        texts = [c.page_content for _, c in new_chunks]
+        with telemetry.span("ingest.embed"):
+            vectors = embeddings.embed_documents(texts) if texts else []
+        embedded = (
+            [(i, v, t, c.metadata) for (i, c), v, t in zip(new_chunks, vectors, texts)],
+            [i for i, _ in batch],
+        )
+
+        if vectorstore is not None:
+            store([embedded])
+            continue
+
+        # no index yet: buffer batches until there are enough vectors to create it
+        buffered.append(embedded)
+        if sum(len(b) for b, _ in buffered) >= max(train_size, 1):
+            store(buffered)
+            buffered = []
+
+    if any(b for b, _ in buffered):
+        store(buffered)
+
+    return vectorstore
+
+
+def delete_chunks(vectorstore: FAISS, ids: List[str]) -> None:
+    """
+    Delete chunks from a vector store, like FAISS.delete, for every index type.
+
+    FAISS.delete assumes the remaining vectors are renumbered by position, which IVF
+    indexes do not do, see indexes.remove_positions.
+
+    Args:
+        vectorstore (FAISS): The vector store, loaded in memory.
+        ids (List[str]): IDs of the chunks to delete.
+    """
+    reversed_index = {id_: i for i, id_ in vectorstore.index_to_docstore_id.items()}
+    positions = {reversed_index[id_] for id_ in ids}
+
+    indexes.remove_positions(vectorstore.index, list(positions))
+    vectorstore.docstore.delete(ids)
+
+    remaining_ids = [
+        id_
+        for i, id_ in sorted(vectorstore.index_to_docstore_id.items())
+        if i not in positions
+    ]
+    vectorstore.index_to_docstore_id = dict(enumerate(remaining_ids))
+
+
+def add_reference(vectorstore: FAISS, chunk_id: str, reference: Dict[str, Any]) -> None:
+    """
+    Record that a stored chunk also occurs in another document (or page), as a duplicate.
+
+    The references are kept in the 'duplicates' metadata of the chunk, so that citations
+    can point to every copy and searches restricted to a document find its duplicates.
+
+    Args:
+        vectorstore (FAISS): The vector store, with an in-memory docstore.
+        chunk_id (str): The ID of the stored chunk.
+        reference (Dict[str, Any]): The 'source', 'page' and 'doc_id' of the duplicate.
+    """
+    metadata = vectorstore.docstore.search(chunk_id).metadata
+    key = (reference["source"], reference["page"])
+    duplicates = metadata.setdefault("duplicates", [])
+
+    if key != (metadata.get("source"), metadata.get("page")) and key not in {
+        (d["source"], d["page"]) for d in duplicates
+    }:
+        duplicates.append(reference)
+
+
+def release_sources(
+    vectorstore: FAISS, chunk_ids: Iterable[str], sources: Set[str]
+) -> None:
+    """
+    Remove documents from the references of chunks that other documents still share.
+
+    A chunk whose own document is removed takes the place of its first remaining duplicate.
+
+    Args:
+        vectorstore (FAISS): The vector store, with an in-memory docstore.
+        chunk_ids (Iterable[str]): IDs of the shared chunks.
+        sources (Set[str]): Paths of the removed documents.
+    """
+    for chunk_id in chunk_ids:
+        metadata = vectorstore.docstore.search(chunk_id).metadata
+        duplicates = [
+            d for d in metadata.pop("duplicates", []) if d["source"] not in sources
+        ]
+
+        if metadata.get("source") in sources and duplicates:
+            metadata.update(duplicates.pop(0))
+        if duplicates:
+            metadata["duplicates"] = duplicates
+
+
 def create_vector_store(
-    documents: List[dict], embeddings: Embeddings, folder_path
+    documents: Iterable[dict],
+    embeddings: Embeddings,
+    folder_path,
+    ids: Optional[Iterable[str]] = None,
 ) -> str:
     """
     Create a vector store index from documents and save it locally.
 
     Args:
-        documents (List[dict]): List of document chunks to index.
+        documents (Iterable[dict]): List or stream of document chunks to index.
         embeddings (Embeddings): Embedding model to use for vectorization.
+        ids (Optional[Iterable[str]]): IDs of the document chunks. Defaults to random IDs.
 
     Returns:
         str: The unique identifier of the saved vector store.
     """
     request_id = utils.get_unique_id()
 
-    vectorstore = FAISS.from_documents(documents, embeddings)
-    file_name = f"{request_id}.bin"
-    vectorstore.save_local(index_name=file_name, folder_path=folder_path)
+    ids = ids if ids is not None else iter(utils.get_unique_id, None)
+    vectorstore = embed_in_batches(zip(ids, documents), embeddings)
+    storage.save_vector_store(vectorstore, folder_path, f"{request_id}.bin")
 
     return request_id
 
 
-def run(input_file_paths, output_folder_path) -> None:
+def load_vector_store(
+    folder_path: str, vector_id: str, embeddings: Embeddings
+) -> FAISS:
+    """
+    Load a vector store index previously saved by this module entirely in memory, to update it.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        vector_id (str): The unique identifier of the vector store.
+        embeddings (Embeddings): Embedding model to use for vectorization.
+
+    Returns:
+        FAISS: The loaded vector store.
+    """
+    return storage.load_vector_store(folder_path, f"{vector_id}.bin", embeddings)
+
+
+def get_signatures_path(folder_path: str, vector_id: str) -> str:
     """
-    Main function to load documents, process text, and create a vector store index.
+    Get the path of the MinHash signatures of the chunks of a vector store.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        vector_id (str): The unique identifier of the vector store.
+
+    Returns:
+        str: The path of the signatures file, see dedup.ChunkDeduplicator.save.
+    """
+    return os.path.join(folder_path, f"{vector_id}.bin.{storage.SIGNATURES_EXTENSION}")
+
+
+def remove_vector_store(folder_path: str, vector_id: str) -> None:
+    """
+    Remove the files of a saved vector store index.
+
+    Args:
+        folder_path (str): Path to the folder containing the vector store files.
+        vector_id (str): The unique identifier of the vector store.
+    """
+    storage.remove_vector_store(folder_path, f"{vector_id}.bin")
+
+
+def run(
+    input_file_paths: List[str],
+    output_folder_path: str,
+    incremental: bool = True,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+    on_progress: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> str:
+    """
+    Main function to load documents, process text, and create or update a vector store index.
+
+    In incremental mode, the manifest kept in the output folder is compared with the
+    content hashes of the input files: only new or changed PDFs are embedded, and the
+    chunks of removed or changed PDFs are deleted from the existing index. Otherwise,
+    or if the chunking parameters changed, the index is rebuilt from scratch.
+
+    The index type is taken from config.index_type; changing it, removing vectors
+    from an index type that cannot remove them (HNSW), or outgrowing the number of
+    lists an IVF index was trained with, also triggers a full rebuild.
+
+    Chunks are embedded in batches as the PDFs are parsed, and the index is saved
+    every config.index_checkpoint_batches batches. The build is written to a new index,
+    recorded under "pending_index" in the manifest, and the manifest only switches to
+    it once the build is complete. If the build is interrupted, the previous index is
+    still served and the next run resumes from the last checkpoint instead of embedding
+    everything again.
+
+    Each complete build is a version of the index (see snapshots): running Chat
+    instances switch to it in the background, and earlier versions are kept for
+    rollback while in use or among the config.index_keep_versions most recent.
+
+    Args:
+        input_file_paths (List[str]): File path for each PDF to index.
+        output_folder_path (str): Path to the folder where the vector store is saved.
+        incremental (bool): Whether to update the existing index. Defaults to True.
+        chunk_size (int): Maximum size of each chunk. Defaults to 1000.
+        chunk_overlap (int): Overlap size between consecutive chunks. Defaults to 200.
+        on_progress (Optional[Callable[[Dict[str, int]], None]]): Called with the number of files
+            to embed ('files_total'), of files embedded ('files_done') and of chunks embedded
+            ('chunks_done') when the build starts and after each batch. An exception it raises
+            stops the build, which the next run resumes from the last checkpoint.
+
+    Returns:
+        str: The unique identifier of the vector store.
     """
-    files = utils.list_files_by_datetime(config.output_folder_path)
-    files = [f for f in files if f.endswith(".faiss")]
+    telemetry.setup()
+    start = time.perf_counter()
+    manifest = mf.load_manifest(output_folder_path)
+    previous_id = manifest["index_name"]
+    params = {
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "index_type": config.index_type,
+        "embedding_backend": config.embedding_backend,
+    }
 
-    if len(files) > 0:
-        return files[0].split(".")[0]
+    def matches(state: dict) -> bool:
+        return (
+            state.get("chunk_size") == chunk_size
+            and state.get("chunk_overlap") == chunk_overlap
+            and state.get("index_type", config.index_type) == config.index_type
+            # vectors of different backends are close but not interchangeable
+            and state.get("embedding_backend", "torch") == config.embedding_backend
+        )
 
-    documents = load_documents_from_file_paths(input_file_paths)
-    chunks = split_text(documents)
-    embeddings = models.get_embeddings()
-    vector_id = create_vector_store(chunks, embeddings, output_folder_path)
-    print(f"Vector store ID: {vector_id}")
+    # the build is written to a new index, recorded as pending in the manifest at each
+    # checkpoint, while the previous index keeps being served until the build completes
+    pending_index = manifest.get("pending_index")
+    if pending_index is not None and (
+        not incremental
+        or not matches(pending_index)
+        or not storage.exists(output_folder_path, f"{pending_index['index_name']}.bin")
+    ):
+        remove_vector_store(output_folder_path, pending_index["index_name"])
+        pending_index = None
+
+    # an IVF index trained when the corpus was small is rebuilt once it outgrew its lists
+    outgrown = previous_id is not None and indexes.is_outgrown(
+        config.index_type,
+        manifest.get("trained_params", {}),
+        len({i for entry in manifest["files"].values() for i in entry["chunk_ids"]}),
+    )
+    if outgrown:
+        print(
+            f"Rebuilding vector store {previous_id}: the corpus outgrew its index lists"
+        )
+
+    # indexes saved by earlier versions, with a pickled docstore or without document
+    # IDs, cannot be served anymore
+    legacy = previous_id is not None and (
+        not storage.exists(output_folder_path, f"{previous_id}.bin")
+        or any("doc_id" not in entry for entry in manifest["files"].values())
+    )
+    if legacy:
+        print(f"Rebuilding vector store {previous_id}: it was saved in an older format")
+
+    if pending_index is not None:
+        state = pending_index
+    elif (
+        incremental
+        and previous_id is not None
+        and matches(manifest)
+        and not outgrown
+        and not legacy
+    ):
+        state = {**manifest, "files": dict(manifest["files"]), "pending": {}}
+        state.pop("pending_index", None)
+    else:
+        state = mf.empty_manifest()
+
+    with telemetry.span("ingest.hash"):
+        file_hashes = {f: utils.get_file_hash(f) for f in input_file_paths}
+    removed, added = mf.diff_files(state, file_hashes)
+
+    if (
+        pending_index is None
+        and state["index_name"] is not None
+        and not removed
+        and not added
+    ):
+        print(f"Vector store ID: {previous_id} (up to date)")
+        return previous_id
+
+    embeddings = registry.get_embeddings()
+    vector_id = pending_index["index_name"] if pending_index else utils.get_unique_id()
+    vectorstore = None
+
+    released = {f: state["files"].pop(f) for f in removed}
+
+    # files left half-embedded by an interrupted build are resumed if unchanged
+    for f, entry in state.get("pending", {}).items():
+        if f not in added or entry["hash"] != file_hashes[f]:
+            released[f] = entry
+    state["pending"] = {
+        f: entry for f, entry in state.get("pending", {}).items() if f not in released
+    }
+
+    if state["index_name"] is not None:
+        vectorstore = load_vector_store(
+            output_folder_path, state["index_name"], embeddings
+        )
+        known_ids = {
+            chunk_id
+            for entry in list(state["files"].values()) + list(state["pending"].values())
+            for chunk_id in entry["chunk_ids"]
+        }
+        stale_ids = [
+            i for i in vectorstore.index_to_docstore_id.values() if i not in known_ids
+        ]
+        if stale_ids and not indexes.supports_removal(vectorstore.index):
+            print(
+                f"Rebuilding vector store {vector_id}: its index cannot remove vectors"
+            )
+            state = mf.empty_manifest()
+            removed, added = mf.diff_files(state, file_hashes)
+            vectorstore = None
+        elif stale_ids:
+            delete_chunks(vectorstore, stale_ids)
+
+        if vectorstore is not None:
+            # chunks of released files that remaining files share as duplicates
+            shared_ids = known_ids.intersection(
+                i for entry in released.values() for i in entry["chunk_ids"]
+            )
+            release_sources(vectorstore, shared_ids, set(released))
+
+    # the index the build starts from, if any
+    base_id = state["index_name"] if vectorstore is not None else None
+    state.update(params, index_name=vector_id)
+
+    # each chunk is embedded and stored once: a duplicate of a stored chunk (or of an
+    # earlier one) is recorded as a reference on it, and its file lists the chunk's ID
+    stored = set(vectorstore.index_to_docstore_id.values()) if vectorstore else set()
+    deduplicator = None
+    if config.dedup_enabled:
+        deduplicator = dedup.ChunkDeduplicator(config.dedup_threshold)
+        with telemetry.span("ingest.dedup_index"):
+            # signatures are saved with the index: only those of chunks saved without
+            # them (e.g. by an older version) are computed, in index order
+            loaded = set()
+            if base_id is not None:
+                signatures_path = get_signatures_path(output_folder_path, base_id)
+                loaded.update(deduplicator.load(signatures_path, stored))
+                for _, chunk_id in sorted(vectorstore.index_to_docstore_id.items()):
+                    if chunk_id not in loaded:
+                        text = vectorstore.docstore.search(chunk_id).page_content
+                        deduplicator.add(chunk_id, text)
+    current = vectorstore
+    waiting: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+
+    chunk_files = {}
+    remaining = {}
+    batch_count = 0
+    progress = {"files_total": len(added), "files_done": 0, "chunks_done": 0}
+
+    def report_progress() -> None:
+        if on_progress is not None:
+            on_progress(dict(progress))
+
+    def complete(file_path: str) -> None:
+        state["files"][file_path] = state["pending"].pop(file_path)
+        progress["files_done"] += 1
+
+    def stored_chunk(file_path: str) -> None:
+        remaining[file_path] -= 1
+        if remaining[file_path] == 0:
+            complete(file_path)
+
+    def save_signatures() -> None:
+        if deduplicator is not None:
+            deduplicator.save(get_signatures_path(output_folder_path, vector_id))
+
+    def save(vectorstore: FAISS) -> None:
+        with telemetry.span("ingest.checkpoint"):
+            storage.save_vector_store(
+                vectorstore, output_folder_path, f"{vector_id}.bin"
+            )
+            save_signatures()
+            state["trained_params"] = indexes.trained_params(vectorstore.index)
+            manifest["pending_index"] = state
+            mf.save_manifest(manifest, output_folder_path)
+
+    def iter_chunks() -> Iterator[Tuple[str, dict]]:
+        # in input order, so that the copy of a duplicate chunk stored (and its source
+        # and document ID) does not depend on which file was parsed first
+        for file_path, chunks in iter_documents(
+            added, chunk_size, chunk_overlap, ordered=True
+        ):
+            ids = assign_chunk_ids(chunks, file_path, file_hashes[file_path])
+
+            # a resumed file keeps the document ID of its checkpointed chunks
+            doc_id = state["pending"].get(file_path, {}).get("doc_id")
+            if doc_id is None:
+                doc_id = state.get("next_doc_id", 0)
+                state["next_doc_id"] = doc_id + 1
+
+            unique = []
+            duplicates = []
+
+            for n, (chunk_id, chunk) in enumerate(zip(ids, chunks)):
+                chunk.metadata["doc_id"] = doc_id
+                duplicate_of = None
+
+                # a chunk checkpointed by an interrupted build is already unique
+                if deduplicator is not None and chunk_id not in stored:
+                    with telemetry.span("ingest.dedup"):
+                        duplicate_of = deduplicator.deduplicate(
+                            chunk_id, chunk.page_content
+                        )
+
+                if duplicate_of is None:
+                    unique.append((chunk_id, chunk))
+                else:
+                    ids[n] = duplicate_of
+                    reference = {
+                        "source": chunk.metadata.get("source"),
+                        "page": chunk.metadata.get("page"),
+                        "doc_id": doc_id,
+                    }
+                    duplicates.append((duplicate_of, reference))
+
+            state["pending"][file_path] = {
+                "hash": file_hashes[file_path],
+                "chunk_ids": ids,
+                "doc_id": doc_id,
+            }
+            remaining[file_path] = len(ids)
+            chunk_files.update((i, file_path) for i, _ in unique)
+            telemetry.count("ingest.files")
+            telemetry.count("ingest.chunks", len(ids))
+            telemetry.count("ingest.duplicate_chunks", len(duplicates))
+
+            if not ids:
+                complete(file_path)
+
+            for duplicate_of, reference in duplicates:
+                if duplicate_of in stored:
+                    add_reference(current, duplicate_of, reference)
+                    stored_chunk(file_path)
+                else:
+                    waiting.setdefault(duplicate_of, []).append((file_path, reference))
+
+            if file_path in state["files"]:
+                report_progress()
+
+            yield from unique
+
+    def on_batch(vectorstore: FAISS, ids: List[str]) -> None:
+        nonlocal batch_count, current
+
+        current = vectorstore
+        stored.update(ids)
+
+        for i in ids:
+            for file_path, reference in waiting.pop(i, []):
+                add_reference(vectorstore, i, reference)
+                stored_chunk(file_path)
+            stored_chunk(chunk_files.pop(i))
+
+        batch_count += 1
+        if batch_count % config.index_checkpoint_batches == 0:
+            save(vectorstore)
+
+        progress["chunks_done"] += len(ids)
+        report_progress()
+
+    report_progress()
+
+    vectorstore = embed_in_batches(
+        iter_chunks(), embeddings, vectorstore=vectorstore, on_batch=on_batch
+    )
+
+    if vectorstore is None:
+        raise Exception("no text chunks found in input files" + ",".join(added))
+
+    # switch the manifest to the new index only once it is complete
+    with telemetry.span("ingest.save"):
+        storage.save_vector_store(vectorstore, output_folder_path, f"{vector_id}.bin")
+        save_signatures()
+        state["trained_params"] = indexes.trained_params(vectorstore.index)
+        state["build"] = {
+            "created_at": time.time(),
+            "build_seconds": round(time.perf_counter() - start, 3),
+            "previous": previous_id,
+            "files": len(state["files"]),
+            "vectors": vectorstore.index.ntotal,
+        }
+        snapshots.save_version(output_folder_path, state)
+        mf.save_manifest(state, output_folder_path)
+
+    registry.invalidate(f"{vector_id}.bin")
+
+    if previous_id is not None and previous_id != vector_id:
+        if legacy:
+            snapshots.remove_version(output_folder_path, previous_id)
+        elif not os.path.exists(
+            snapshots.get_version_path(output_folder_path, previous_id)
+        ):
+            # an index built before versions were recorded becomes one
+            index_path, _ = storage.get_paths(output_folder_path, f"{previous_id}.bin")
+            build = {"created_at": os.path.getmtime(index_path)}
+            snapshots.save_version(output_folder_path, {**manifest, "build": build})
+        registry.invalidate(f"{previous_id}.bin")
+
+    snapshots.collect_garbage(output_folder_path)
+
+    failed = [f for f in added if f not in state["files"]]
+    stats = deduplicator.stats if deduplicator else {"exact": 0, "near": 0, "chars": 0}
+    print(
+        f"Vector store ID: {vector_id} "
+        f"(+{len(added) - len(failed)} / -{len(removed)} files, "
+        f"{len(failed)} failed, {vectorstore.index.ntotal} vectors, "
+        f"{stats['exact'] + stats['near']} duplicate chunks skipped: "
+        f"{stats['exact']} exact, {stats['near']} near, {stats['chars']} characters)"
+    )
+    telemetry.record_span("ingest.total", time.perf_counter() - start)
 
     return vector_id
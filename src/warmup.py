@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import config
+
+_lock = threading.Lock()
+_ready = threading.Event()
+_thread: Optional[threading.Thread] = None
+_error: Optional[BaseException] = None
+_seconds: Optional[float] = None
+
+
+def warm_up(store_folder_path: str) -> None:
+    """
+    Load the shared embedding model, LLM client and index of a folder, if any.
+
+    Args:
+        store_folder_path (str): Path to the folder containing the FAISS index files.
+    """
+    # the heavy dependencies are only imported here, once the UI is served
+    import chat
+    import registry
+
+    embeddings = registry.get_embeddings()
+    # the first call initializes the model runtime
+    embeddings.embed_query("warm-up")
+    registry.get_llm()
+
+    if not chat.list_shards(store_folder_path):
+        try:
+            chat.get_index_name(store_folder_path)
+        except Exception:
+            # nothing to load before the first ingestion
+            return
+
+    chat.setup_retriever(store_folder_path, embeddings)
+
+
+def _run(store_folder_path: str) -> None:
+    global _error, _seconds
+
+    start = time.perf_counter()
+    try:
+        warm_up(store_folder_path)
+    except Exception as e:
+        # sessions load what is missing on first use, as without warm-up
+        print(f"Warm-up failed: {e!r}")
+        _error = e
+    finally:
+        _seconds = time.perf_counter() - start
+        if config.warmup_ready_file:
+            with open(config.warmup_ready_file, "w") as f:
+                f.write("failed" if _error else "ready")
+        _ready.set()
+
+
+def start(store_folder_path: str = config.output_folder_path) -> None:
+    """
+    Start warming up in a background thread, once per process.
+
+    Args:
+        store_folder_path (str): Path to the folder containing the FAISS index files.
+            Defaults to config.output_folder_path.
+    """
+    global _thread
+
+    with _lock:
+        if _thread is not None:
+            return
+
+        if config.warmup_ready_file and os.path.exists(config.warmup_ready_file):
+            # left by a previous process
+            os.remove(config.warmup_ready_file)
+
+        _thread = threading.Thread(
+            target=_run, args=(store_folder_path,), name="warm-up", daemon=True
+        )
+        _thread.start()
+
+
+def is_ready() -> bool:
+    """
+    Tell whether warm-up has finished, successfully or not.
+
+    Returns:
+        bool: True once warm-up is over.
+    """
+    return _ready.is_set()
+
+
+def wait(timeout: Optional[float] = None) -> bool:
+    """
+    Wait for warm-up to finish.
+
+    Args:
+        timeout (Optional[float]): Maximum number of seconds to wait. Defaults to None (no limit).
+
+    Returns:
+        bool: True if warm-up is over, False on timeout.
+    """
+    return _ready.wait(timeout)
+
+
+def status() -> Dict[str, Any]:
+    """
+    Report the state of warm-up, e.g. for a readiness check.
+
+    Returns:
+        Dict[str, Any]: The state ('idle', 'warming', 'ready' or 'failed'), the
+            duration in seconds once over, and the error if it failed.
+    """
+    if _thread is None:
+        state = "idle"
+    elif not _ready.is_set():
+        state = "warming"
+    else:
+        state = "failed" if _error else "ready"
+
+    return {
+        "state": state,
+        "seconds": _seconds,
+        "error": repr(_error) if _error else None,
+    }
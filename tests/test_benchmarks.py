@@ -0,0 +1,35 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+BENCHMARK_PATH = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "run.py")
+
+
+@pytest.mark.skipif(not os.path.exists(BENCHMARK_PATH), reason="benchmarks not available")
+def test_benchmarks_smoke(tmp_path):
+    """Test that a tiny run of the benchmark suite writes a complete JSON report."""
+    output = tmp_path / "bench.json"
+    src = os.path.join(os.path.dirname(__file__), "..", "src")
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([src, os.environ.get("PYTHONPATH", "")])}
+
+    subprocess.run(
+        [
+            sys.executable, BENCHMARK_PATH, "--output", str(output),
+            "--files", "2", "--pages", "2", "--corpus-sizes", "100", "--k", "5",
+            "--queries", "5", "--concurrency", "2", "--questions", "2",
+            "--llm-latency", "0", "--embedding-size", "16",
+        ],
+        check=True,
+        env=env,
+        timeout=300,
+    )
+    report = json.loads(output.read_text())
+
+    assert report["ingestion"]["pages"] == 4
+    assert report["ingestion"]["chunks"] > 0
+    assert [r["k"] for r in report["retrieval"]] == [5]
+    assert report["ask"][0]["questions"] == 4
+    assert report["peak_rss_mb"] > 0
@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import Mock, patch
 from chat import Chat, QA, setup_retriever, setup_chain
+from semantic_cache import SemanticCache
 
 @pytest.fixture
 def mock_chat_components():
@@ -66,3 +67,288 @@ def test_chat_get_history(mock_chat_components):
     assert len(history) == 2, "The history should contain 2 interactions."
     assert history[0]["question"] == "Q1", "The first history item should match the mock data."
     assert history[1]["feedback"] == "Average", "The second feedback should match the mock data."
+
+
+@pytest.fixture
+def fake_chat(tmp_path):
+    """Fixture to provide a Chat backed by a fake LLM and an in-memory FAISS index."""
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.language_models import FakeListChatModel
+
+    embeddings = DeterministicFakeEmbedding(size=16)
+    llm = FakeListChatModel(
+        responses=["First answer", "Standalone question", "Second answer"]
+    )
+    retriever = FAISS.from_texts(["policy text"], embeddings).as_retriever()
+
+    with patch("chat.registry.get_embeddings", return_value=embeddings), \
+         patch("chat.registry.get_llm", return_value=llm), \
+         patch("chat.get_index_name", return_value="index.bin"), \
+         patch("chat.setup_retriever", return_value=retriever), \
+         patch("chat.config.semantic_cache_enabled", True), \
+         patch("chat.registry.get_semantic_cache", return_value=SemanticCache(embeddings)):
+        yield Chat(
+            store_folder_path=str(tmp_path),
+            db_path=str(tmp_path / "history.db"),
+            chat_template="{context}{question}{chat_history}",
+        )
+
+
+def test_chat_ask_stream(fake_chat):
+    """Test that ask_stream yields only the answer tokens and fills the QA at the end."""
+    for question, expected in [("Q1", "First answer"), ("Q2", "Second answer")]:
+        qa, tokens = fake_chat.ask_stream(question)
+        streamed = list(tokens)
+
+        assert len(streamed) > 1, "The answer should be streamed in several tokens."
+        assert "".join(streamed) == expected, "The condensed question should not be streamed."
+        assert qa.question == question
+        assert qa.answer == expected
+
+
+def test_chat_batch_ask(fake_chat):
+    """Test that batch_ask answers every question, in order, without touching the conversation."""
+    from langchain_core.language_models import FakeListChatModel
+
+    fake_chat._batch_chain.combine_docs_chain.llm_chain.llm = FakeListChatModel(
+        responses=["A"], sleep=0.05
+    )
+
+    qas = fake_chat.batch_ask(["Q1", "Q2", "Q3"], concurrency=3, rate_limit=100)
+
+    assert [qa.question for qa in qas] == ["Q1", "Q2", "Q3"]
+    assert [qa.answer for qa in qas] == ["A", "A", "A"]
+    assert fake_chat._qa_chain.memory.buffer == [], "Batch questions should not enter the chat memory."
+
+    qas = fake_chat.batch_ask(["Q4"], timeout=0.01)
+
+    assert qas[0].answer is None
+    assert "timed out" in qas[0].error
+
+
+def test_chat_semantic_cache(fake_chat):
+    """Test that a repeated standalone question is answered from the semantic cache."""
+    assert fake_chat.ask("Q1").answer == "First answer"
+
+    fake_chat._qa_chain.memory.clear()
+    qa = fake_chat.ask("Q1")
+
+    assert qa.answer == "First answer", "The cached answer should be returned."
+    assert fake_chat._semantic_cache.stats()["hits"] == 1
+    assert len(fake_chat._qa_chain.memory.chat_memory.messages) == 2, "The cached turn should enter the memory."
+
+
+def test_chat_batch_ask_cache_error(fake_chat):
+    """Test that a failing cache lookup only fails its own question."""
+    with patch.object(fake_chat._semantic_cache, "lookup", side_effect=[RuntimeError("down"), None]):
+        qas = fake_chat.batch_ask(["Q1", "Q2"], concurrency=1, rate_limit=100)
+
+    assert "down" in qas[0].error
+    assert qas[1].answer is not None and qas[1].error is None
+
+
+def test_chat_history_is_session_scoped(fake_chat):
+    """Test that get_history only returns the interactions of the chat's own conversation."""
+    fake_chat._db_handler.log_interaction("Other question", "Other answer", "other-session")
+    first = fake_chat.log(fake_chat.ask("Q1"))
+
+    history = fake_chat.get_history(limit=10)
+    assert [r[1] for r in history] == [first.question]
+
+    fake_chat.log(QA("Q2", "A2"))
+    assert [r[1] for r in fake_chat.get_history(after_id=history[-1][0])] == ["Q2"]
+
+
+def test_token_usage_callback():
+    """Test that the token usage reported by each LLM call is added up."""
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, LLMResult
+
+    from chat import TokenUsage
+
+    def result(input_tokens, output_tokens):
+        message = AIMessage(
+            content="",
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+        return LLMResult(generations=[[ChatGeneration(message=message)]])
+
+    usage = TokenUsage()
+    usage.on_llm_end(result(100, 10))
+    usage.on_llm_end(result(300, 50))
+
+    assert usage.usage == {
+        "input_tokens": 400,
+        "output_tokens": 60,
+        "total_tokens": 460,
+        "llm_calls": 2,
+    }
+
+
+def test_chat_ask_stage_spans(fake_chat):
+    """Test that the stages of a question are recorded when telemetry is enabled."""
+    import telemetry
+
+    events = []
+
+    class ListSink(telemetry.Sink):
+        def record(self, kind, name, value, labels):
+            events.append(name)
+
+    sink = ListSink()
+    telemetry.add_sink(sink)
+    try:
+        fake_chat.ask("Q1")
+        fake_chat.ask("Q2")
+    finally:
+        telemetry.remove_sink(sink)
+
+    assert events.count("ask.total") == 2
+    assert events.count("ask.answer") == 2, "Nested chains of a stage should not be timed twice."
+    assert events.count("ask.condense") == 1, "Only follow-up questions are condensed."
+    assert events.count("ask.llm") == 3
+
+
+@pytest.fixture
+def shards(tmp_path):
+    """Three shards of a folder, and the same chunks in a single vector store."""
+    import manifest as mf
+    import storage
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from langchain_community.vectorstores import FAISS
+
+    embeddings = DeterministicFakeEmbedding(size=16)
+    texts = {name: [f"{name} chunk {i}" for i in range(20)] for name in ("a", "b", "c")}
+
+    for name, shard_texts in texts.items():
+        folder = tmp_path / "store" / name
+        folder.mkdir(parents=True)
+        store = FAISS.from_texts(
+            shard_texts, embeddings, metadatas=[{"source": f"{name}.pdf"}] * len(shard_texts)
+        )
+        storage.save_vector_store(store, str(folder), f"shard-{name}.bin")
+        mf.save_manifest({**mf.empty_manifest(), "index_name": f"shard-{name}"}, str(folder))
+
+    combined = FAISS.from_texts([t for ts in texts.values() for t in ts], embeddings)
+    yield str(tmp_path / "store"), embeddings, combined
+
+    import registry
+
+    registry.invalidate()
+
+
+def test_sharded_retriever_merges_top_k(shards):
+    """Test that searching shards in parallel finds the global top-k."""
+    from chat import ShardedRetriever
+
+    folder, embeddings, combined = shards
+    retriever = setup_retriever(folder, embeddings, search_kwargs={"k": 7})
+
+    assert isinstance(retriever, ShardedRetriever)
+    assert set(retriever.shards) == {"a", "b", "c"}
+
+    for query in ["a chunk 3", "c chunk 12", "unrelated question"]:
+        expected = [d.page_content for d in combined.similarity_search(query, k=7)]
+        assert [d.page_content for d in retriever.invoke(query)] == expected
+
+    retriever.sources = ["b.pdf"]
+    assert {d.metadata["source"] for d in retriever.invoke("a chunk 3")} == {"b.pdf"}
+
+
+def test_sharded_retriever_load_unload(shards):
+    """Test that shards are loaded and unloaded independently."""
+    folder, embeddings, _ = shards
+    retriever = setup_retriever(folder, embeddings, search_kwargs={"k": 40})
+    index_id = retriever.index_id
+
+    retriever.unload_shard("b")
+
+    assert retriever.index_id == ("shard-a.bin", "shard-c.bin")
+    assert not any(d.page_content.startswith("b") for d in retriever.invoke("b chunk 1"))
+
+    retriever.load_shard("b", f"{folder}/b")
+
+    assert retriever.index_id == index_id
+    assert retriever.invoke("b chunk 1")[0].page_content == "b chunk 1"
+
+
+@pytest.fixture
+def condense_chain():
+    """Factory of chains with one turn of chat history, recording the retrieved queries."""
+    import asyncio
+
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.language_models import FakeListChatModel
+    from langchain_core.retrievers import BaseRetriever
+
+    class RecordingRetriever(BaseRetriever):
+        queries: list = []
+
+        def _get_relevant_documents(self, query, *, run_manager):
+            self.queries.append(query)
+            return [Document(page_content="policy text")]
+
+    class WordEmbeddings(Embeddings):
+        """One dimension per known word."""
+
+        words = ["carro", "casa", "seguro", "prazo"]
+
+        def embed_documents(self, texts):
+            return [self.embed_query(text) for text in texts]
+
+        def embed_query(self, text):
+            return [float(w in text.lower()) for w in self.words]
+
+    def build(mode, rewritten):
+        retriever = RecordingRetriever(queries=[])
+        llm = FakeListChatModel(responses=[rewritten, "Answer"])
+        chain = setup_chain(
+            retriever, llm, "{context}{question}{chat_history}",
+            condense_mode=mode, embeddings=WordEmbeddings(),
+        )
+        chain.memory.save_context({"question": "Seguro do carro?"}, {"answer": "Sim."})
+
+        def ask(question, use_async=False):
+            if use_async:
+                return asyncio.run(chain.ainvoke({"question": question}))["answer"]
+            return chain.invoke({"question": question})["answer"]
+
+        return ask, retriever.queries
+
+    return build
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_condense_modes(condense_chain, use_async):
+    """Test the retrieval of a follow-up question in each condense mode."""
+    ask, queries = condense_chain("always", "Prazo do seguro do carro?")
+    assert ask("E o prazo?", use_async) == "Answer"
+    assert queries == ["Prazo do seguro do carro?"]
+
+    ask, queries = condense_chain("never", "Answer")
+    assert ask("E o prazo?", use_async) == "Answer", "The question should not be rewritten."
+    assert queries == ["E o prazo?"]
+
+    # a rewritten question close to the original keeps the speculative retrieval
+    ask, queries = condense_chain("speculative", "Qual o prazo do seguro?")
+    assert ask("E o prazo do seguro?", use_async) == "Answer"
+    assert queries == ["E o prazo do seguro?"]
+
+    ask, queries = condense_chain("speculative", "Prazo do seguro do carro?")
+    assert ask("E o prazo?", use_async) == "Answer"
+    assert queries == ["E o prazo?", "Prazo do seguro do carro?"]
+
+
+def test_condense_mode_is_checked():
+    """Test that an unknown condense mode, or a speculative one without embeddings, is refused."""
+    with pytest.raises(ValueError):
+        setup_chain(Mock(), Mock(), "{context}{question}{chat_history}", condense_mode="maybe")
+
+    with pytest.raises(ValueError):
+        setup_chain(Mock(), Mock(), "{context}{question}{chat_history}", condense_mode="speculative")
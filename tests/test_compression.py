@@ -0,0 +1,104 @@
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import compression
+
+VOCABULARY = ["seguro", "carro", "casa", "vida", "prazo", "cobertura"]
+
+
+class WordEmbeddings(Embeddings):
+    """Bag-of-words embeddings over a small vocabulary."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        words = text.lower().replace(".", " ").split()
+        return [float(words.count(w)) for w in VOCABULARY]
+
+
+def test_split_sentences():
+    text = "Cobertura do carro. Prazo de 30 dias!\nCláusula 2\n\nFim; ok"
+
+    assert compression.split_sentences(text) == [
+        "Cobertura do carro.",
+        "Prazo de 30 dias!",
+        "Cláusula 2",
+        "Fim;",
+        "ok",
+    ]
+
+
+def test_keeps_relevant_sentences_in_order():
+    embeddings = WordEmbeddings()
+    compressor = compression.ContextCompressor(embeddings, max_tokens=100)
+    docs = [
+        Document(
+            page_content="A casa tem cobertura. O carro tem seguro. Vida longa.",
+            metadata={"source": "a.pdf"},
+        ),
+        Document(page_content="Prazo da vida.", metadata={"source": "b.pdf"}),
+        Document(
+            page_content="Seguro do carro com cobertura. Cobertura do carro com seguro.",
+            metadata={"source": "c.pdf"},
+        ),
+    ]
+
+    compressed = compressor.compress(embeddings.embed_query("seguro do carro"), docs)
+
+    # the second sentence of c.pdf repeats the first one
+    assert [(d.page_content, d.metadata["source"]) for d in compressed] == [
+        ("O carro tem seguro.", "a.pdf"),
+        ("Seguro do carro com cobertura.", "c.pdf"),
+    ]
+    assert compressor.stats["chunks"] == 3
+    assert compressor.stats["tokens_out"] < compressor.stats["tokens_in"]
+
+
+def test_fills_token_budget_with_most_similar_sentences():
+    embeddings = WordEmbeddings()
+    sentences = ["Seguro do carro.", "Seguro da casa e do carro.", "Seguro de vida e prazo."]
+    docs = [Document(page_content=" ".join(sentences))]
+    query = embeddings.embed_query("seguro do carro")
+
+    def compress(max_tokens):
+        return compression.ContextCompressor(
+            embeddings, max_tokens=max_tokens, min_similarity=0
+        ).compress(query, docs)
+
+    tokens = [compression.count_tokens(s) for s in sentences]
+    assert compress(tokens[0])[0].page_content == sentences[0]
+    assert compress(tokens[0] + tokens[1])[0].page_content == " ".join(sentences[:2])
+    assert compress(sum(tokens))[0].page_content == docs[0].page_content
+
+
+def test_keeps_best_sentence_below_min_similarity():
+    embeddings = WordEmbeddings()
+    compressor = compression.ContextCompressor(embeddings, min_similarity=0.99)
+    docs = [Document(page_content="Prazo do seguro. Casa.")]
+
+    compressed = compressor.compress(embeddings.embed_query("seguro"), docs)
+
+    assert [d.page_content for d in compressed] == ["Prazo do seguro."]
+    assert embeddings.calls == 1, "Sentences are embedded in a single batch."
+
+
+def test_sentence_embeddings_are_cached_in_memory():
+    embeddings = WordEmbeddings()
+    compressor = compression.ContextCompressor(embeddings, cache_size=2)
+    query = embeddings.embed_query("seguro")
+    docs = [Document(page_content="Prazo do seguro. Casa.")]
+
+    compressor.compress(query, docs)
+    compressor.compress(query, docs)
+    assert embeddings.calls == 1
+
+    compressor.compress(query, [Document(page_content="Vida.")])
+    compressor.compress(query, docs)
+    assert embeddings.calls == 3, "The least recently used sentence should be evicted."
@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+
+import pytest
+
+from database import DatabaseHandler
+
+
+@pytest.mark.parametrize("background_writes", [True, False])
+def test_concurrent_log_interaction(tmp_path, background_writes):
+    """Test that interactions logged from many threads are all stored."""
+    db_handler = DatabaseHandler(
+        db_path=str(tmp_path / "history.db"), background_writes=background_writes
+    )
+
+    def log(n):
+        for i in range(50):
+            db_handler.log_interaction(f"Q{n}-{i}", f"A{n}-{i}")
+
+    threads = [threading.Thread(target=log, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    rows = db_handler.fetch_all_interactions()
+
+    assert len(rows) == 400, "Every logged interaction should be readable."
+    assert {r[1] for r in rows} == {f"Q{n}-{i}" for n in range(8) for i in range(50)}
+
+
+def test_wal_mode(tmp_path):
+    """Test that connections use write-ahead logging."""
+    db_handler = DatabaseHandler(db_path=str(tmp_path / "history.db"))
+
+    with db_handler.pool.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_background_writer_isolates_failures(tmp_path):
+    """Test that a failing write does not drop the other writes of its batch."""
+    db_handler = DatabaseHandler(db_path=str(tmp_path / "history.db"))
+    writer = db_handler.writer
+
+    db_handler.log_interaction("Q1", "A1")
+    writer.submit("INSERT INTO missing_table VALUES (?)", (1,))
+    db_handler.log_interaction("Q2", "A2")
+
+    assert db_handler.flush(timeout=5)
+    assert [r[1] for r in db_handler.fetch_all_interactions()] == ["Q1", "Q2"]
+    assert writer._thread.is_alive(), "The writer should survive a failed write."
+
+
+def test_flush_timeout(tmp_path):
+    """Test that reads do not wait for the writes of other handlers."""
+    db_path = str(tmp_path / "history.db")
+    db_handler = DatabaseHandler(db_path=db_path)
+    other = DatabaseHandler(db_path=db_path)
+
+    db_handler.log_interaction("Q1", "A1")
+    assert db_handler.flush(timeout=5)
+
+    # block the writer, queueing writes behind it
+    with db_handler.pool.connection() as conn:
+        conn.execute("BEGIN EXCLUSIVE")
+        other.log_interaction("Q2", "A2")
+
+        assert not other.flush(timeout=0.1), "The write should still be pending."
+        assert db_handler.flush(timeout=0.1), "Earlier writes should already be done."
+
+        conn.rollback()
+
+    assert other.flush(timeout=10)
+
+
+def test_fetch_interactions_pages(tmp_path):
+    """Test that interactions are paged per conversation using row IDs as keys."""
+    db_handler = DatabaseHandler(db_path=str(tmp_path / "history.db"))
+
+    for i in range(5):
+        db_handler.log_interaction(f"Q{i}", f"A{i}", session_id="s1")
+        db_handler.log_interaction(f"other Q{i}", f"other A{i}", session_id="s2")
+
+    latest = db_handler.fetch_interactions("s1", limit=2)
+    assert [r[1] for r in latest] == ["Q3", "Q4"], "The latest page should be oldest first."
+
+    older = db_handler.fetch_interactions("s1", before_id=latest[0][0], limit=2)
+    assert [r[1] for r in older] == ["Q1", "Q2"]
+
+    db_handler.log_interaction("Q5", "A5", session_id="s1")
+    new = db_handler.fetch_interactions("s1", after_id=latest[-1][0])
+    assert [r[1] for r in new] == ["Q5"], "Only the rows since the last one seen should be returned."
+
+
+def test_create_table_migrates_session_id(tmp_path):
+    """Test that a table created before conversations were tracked gains the session_id column."""
+    db_path = str(tmp_path / "history.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE interactions (id INTEGER PRIMARY KEY AUTOINCREMENT, question TEXT, "
+        "answer TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)"
+    )
+    conn.execute("INSERT INTO interactions (question, answer) VALUES ('Q0', 'A0')")
+    conn.commit()
+    conn.close()
+
+    db_handler = DatabaseHandler(db_path=db_path)
+    db_handler.log_interaction("Q1", "A1", session_id="s1")
+
+    assert [r[1] for r in db_handler.fetch_interactions(None)] == ["Q0"]
+    assert [r[1] for r in db_handler.fetch_interactions("s1")] == ["Q1"]
+
+    with db_handler.pool.connection() as conn:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM interactions WHERE session_id IS ? AND id > ?",
+            ("s1", 0),
+        ).fetchall()
+    assert "interactions_session_id" in str(plan)
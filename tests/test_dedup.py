@@ -0,0 +1,58 @@
+from dedup import ChunkDeduplicator
+
+
+TEXT = " ".join(f"palavra{i}" for i in range(200))
+
+
+def test_exact_duplicates_ignore_case_and_whitespace():
+    deduplicator = ChunkDeduplicator()
+
+    assert deduplicator.deduplicate("a", TEXT) is None
+    assert deduplicator.deduplicate("b", "  " + TEXT.upper().replace(" ", "\n")) == "a"
+    assert deduplicator.stats == {"chunks": 2, "exact": 1, "near": 0, "chars": len(TEXT) + 2}
+
+
+def test_near_duplicates():
+    deduplicator = ChunkDeduplicator(threshold=0.8)
+    words = TEXT.split()
+
+    assert deduplicator.deduplicate("a", TEXT) is None
+    # one word changed: about 5 of 196 shingles differ
+    assert deduplicator.deduplicate("b", " ".join(words[:100] + ["outra"] + words[101:])) == "a"
+    # half of the text changed
+    assert deduplicator.deduplicate("c", " ".join(words[:100] + ["nova"] * 100)) is None
+    assert deduplicator.stats["near"] == 1
+
+
+def test_added_chunks_are_matched():
+    deduplicator = ChunkDeduplicator()
+    deduplicator.add("indexed", TEXT)
+
+    assert deduplicator.deduplicate("new", TEXT) == "indexed"
+    assert deduplicator.deduplicate("short", "texto curto") is None
+    assert deduplicator.deduplicate("short-copy", "Texto curto") == "short"
+
+
+def test_signatures_grow_past_initial_capacity():
+    deduplicator = ChunkDeduplicator()
+
+    for i in range(1500):
+        assert deduplicator.deduplicate(str(i), f"trecho distinto numero {i} " * 3) is None
+
+    assert deduplicator.deduplicate("copy", "trecho distinto numero 1499 " * 3) == "1499"
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "index.minhash.npz")
+    words = TEXT.split()
+    deduplicator = ChunkDeduplicator()
+    deduplicator.add("a", TEXT)
+    deduplicator.add("b", " ".join(words[:100] + ["nova"] * 100))
+    deduplicator.save(path)
+
+    loaded = ChunkDeduplicator()
+    assert loaded.load(path, {"a"}) == ["a"]
+    assert loaded.deduplicate("c", TEXT.upper()) == "a"
+    assert loaded.deduplicate("d", " ".join(words[:100] + ["nova"] * 100)) is None
+    assert ChunkDeduplicator(seed=1).load(path, {"a", "b"}) == []
+    assert ChunkDeduplicator().load(str(tmp_path / "missing.npz"), {"a"}) == []
@@ -0,0 +1,100 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+def test_cached_embeddings_reuse_vectors(tmp_path):
+    """Test that cached vectors are returned unchanged and counted as hits."""
+    model = DeterministicFakeEmbedding(size=8)
+    cache = EmbeddingCache(str(tmp_path), "fake-model")
+    embeddings = CachedEmbeddings(model, cache)
+
+    first = embeddings.embed_documents(["a", "b"])
+    second = embeddings.embed_documents(["b", "c"])
+
+    assert np.allclose(first, model.embed_documents(["a", "b"]))
+    assert np.allclose(second, model.embed_documents(["b", "c"]))
+    assert cache.stats()["hits"] == 1, "The repeated text should be a cache hit."
+    assert cache.stats()["misses"] == 3
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    """Test that the cache never grows past its size limit."""
+    cache = EmbeddingCache(str(tmp_path), "fake-model", max_size_mb=1)
+    dim = 1024 * 1024 // 4 // 16  # room for 16 vectors
+
+    cache.put([f"t{i}" for i in range(16)], [[float(i)] * dim for i in range(16)])
+    cache.get(["t0"])
+    cache.put(["new"], [[1.0] * dim])
+
+    assert cache.stats()["entries"] <= 16
+    assert cache.get(["t0"])[0] is not None, "Recently used entries should be kept."
+    assert cache.get(["t1"])[0] is None, "The least recently used entry should be evicted."
+
+
+def test_cache_eviction_keeps_batch_entries(tmp_path):
+    """Test that rewriting cached entries while evicting does not lose their rows."""
+    cache = EmbeddingCache(str(tmp_path), "fake-model", max_size_mb=1)
+    dim = 1024 * 1024 // 4 // 16  # room for 16 vectors
+
+    cache.put([f"t{i}" for i in range(16)], [[float(i)] * dim for i in range(16)])
+    cache.put([f"t{i}" for i in range(15)] + ["new"], [[float(i)] * dim for i in range(16)])
+
+    assert cache.stats()["entries"] == 16
+    assert cache.get(["t15"])[0] is None, "Only entries outside the batch should be evicted."
+    assert cache.get(["t0"])[0][0] == 0.0
+    assert cache.get(["new"])[0][0] == 15.0
+
+
+def test_caches_share_a_folder(tmp_path):
+    """Test that two caches on one folder, as in two processes, never share a row."""
+    first = EmbeddingCache(str(tmp_path), "fake-model", max_size_mb=1)
+    second = EmbeddingCache(str(tmp_path), "fake-model", max_size_mb=1)
+    dim = 1024 * 1024 // 4 // 16  # room for 16 vectors
+
+    first.put(["a"], [[1.0] * dim])
+    second.put(["b"], [[2.0] * dim])
+
+    assert first.get(["a", "b"])[0][0] == 1.0
+    assert first.get(["a", "b"])[1][0] == 2.0
+    assert second.get(["a"])[0][0] == 1.0
+
+    # fill the cache from both sides, evicting each other's entries
+    for i in range(40):
+        cache = first if i % 2 else second
+        cache.put([f"t{i}"], [[float(i)] * dim])
+
+    reopened = EmbeddingCache(str(tmp_path), "fake-model", max_size_mb=1)
+    for cache in (first, second, reopened):
+        vectors = cache.get([f"t{i}" for i in range(40)])
+        assert all(v is None or v[0] == i for i, v in enumerate(vectors))
+        assert cache.get(["t39"])[0][0] == 39.0
+    assert reopened.stats()["entries"] <= 16
+
+
+def test_cache_is_shared_by_processes(tmp_path):
+    """Test that processes writing to one cache, e.g. the app and the ingestion worker, keep their vectors apart."""
+    src = os.path.join(os.path.dirname(__file__), "..", "src")
+    code = (
+        "import sys; from embedding_cache import EmbeddingCache; "
+        "cache = EmbeddingCache(sys.argv[1], 'fake-model', max_size_mb=1); "
+        "p = int(sys.argv[2]); dim = 1024 * 1024 // 4 // 16; "
+        "[cache.put([f'p{p}-{i}'], [[p * 100.0 + i] * dim]) for i in range(30)]"
+    )
+    processes = [
+        subprocess.Popen([sys.executable, "-c", code, str(tmp_path), str(p)], cwd=src)
+        for p in range(3)
+    ]
+    assert all(process.wait(60) == 0 for process in processes)
+
+    cache = EmbeddingCache(str(tmp_path), "fake-model", max_size_mb=1)
+    keys = [(p, i) for p in range(3) for i in range(30)]
+    vectors = cache.get([f"p{p}-{i}" for p, i in keys])
+
+    assert 0 < sum(v is not None for v in vectors) <= 16
+    assert all(v is None or v[0] == p * 100 + i for (p, i), v in zip(keys, vectors))
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from indexes import (
+    INDEX_TYPES,
+    benchmark,
+    create_index,
+    is_outgrown,
+    remove_positions,
+    search_ranges,
+    supports_removal,
+    trained_params,
+)
+
+
+@pytest.fixture
+def vectors():
+    """Fixture to provide random float32 vectors."""
+    return np.random.default_rng(0).normal(size=(2000, 32)).astype(np.float32)
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_create_index(vectors, index_type):
+    """Test that every index type is trained and finds an indexed vector."""
+    index = create_index(vectors, index_type, {"nlist": 8, "nprobe": 8, "pq_m": 8})
+    index.add(vectors)
+
+    _, labels = index.search(vectors[:1], 5)
+
+    assert index.ntotal == len(vectors)
+    assert 0 in labels[0], "An indexed vector should be its own neighbour."
+    assert supports_removal(index) == (index_type != "hnsw")
+
+
+def test_benchmark(vectors):
+    """Test that the benchmark reports exact recall for the flat index."""
+    reports = benchmark(vectors, vectors[:20], ["flat", "ivf_flat"], {"nlist": 8}, k=5)
+
+    assert [r["index_type"] for r in reports] == ["flat", "ivf_flat"]
+    assert reports[0]["recall@5"] == 1.0
+    assert all(r["p99_ms"] >= r["p50_ms"] for r in reports)
+
+
+def test_is_outgrown(vectors):
+    """Test that an IVF index trained on a small corpus is rebuilt once the corpus grows."""
+    params = {"nlist": 64, "pq_m": 8, "pq_nbits": 8}
+    trained = trained_params(create_index(vectors[:200], "ivf_pq", params))
+
+    assert trained == {"nlist": 5, "pq_nbits": 2}, "Training should fit the small sample."
+    assert not is_outgrown("ivf_pq", trained, 300, params)
+    assert is_outgrown("ivf_pq", trained, 2000, params)
+    assert not is_outgrown("flat", trained_params(create_index(vectors, "flat")), 10**6)
+
+
+def test_remove_positions_renumbers_ivf():
+    """Test that the vectors of an IVF index keep consecutive positions after a removal."""
+    vectors = np.random.default_rng(0).random((500, 8), dtype=np.float32)
+    index = create_index(vectors, "ivf_flat", {"nlist": 4, "nprobe": 4})
+    index.add(vectors)
+
+    remove_positions(index, [0, 1, 100])
+
+    _, labels = index.search(vectors[[50, 200]], 1)
+    assert labels[:, 0].tolist() == [48, 197]
+
+
+def test_search_ranges():
+    """Test that only the vectors in the ranges are returned, k of them."""
+    vectors = np.random.default_rng(0).random((500, 8), dtype=np.float32)
+
+    for index_type in ("flat", "ivf_flat", "hnsw"):
+        index = create_index(vectors, index_type, {"nlist": 4, "nprobe": 4})
+        index.add(vectors)
+
+        _, labels = search_ranges(index, vectors[:1], 5, [(100, 150)])
+        assert all(100 <= i < 150 for i in labels[0]), index_type
+
+        _, labels = search_ranges(index, vectors[:1], 5, [(0, 2), (300, 400)])
+        assert labels[0][0] == 0
+        assert all(i < 2 or 300 <= i < 400 for i in labels[0]), index_type
@@ -0,0 +1,106 @@
+import pytest
+
+import jobs
+import vectorstore
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return jobs.JobQueue(str(tmp_path / "jobs.db"))
+
+
+@pytest.fixture
+def pdfs(tmp_path):
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"doc{i}.pdf"
+        path.write_bytes(b"%PDF-1.4 " + bytes([i]))
+        paths.append(str(path))
+    return paths
+
+
+def test_submit_merges_identical_jobs(queue, pdfs, tmp_path):
+    """Test that an identical request joins the queued job instead of queueing another."""
+    job_id = queue.submit(pdfs, "output")
+
+    assert queue.submit(pdfs[::-1], "output") == job_id
+    assert queue.submit(pdfs, "other") != job_id
+    assert queue.submit(pdfs[:1], "output") != job_id
+
+    # a changed file is new work
+    (tmp_path / "doc0.pdf").write_bytes(b"%PDF-1.4 changed")
+    changed = queue.submit(pdfs, "output")
+    assert changed != job_id
+
+    # a cancelled job is not joined
+    assert queue.cancel(changed)
+    assert queue.get(changed)["state"] == "cancelled"
+    assert queue.submit(pdfs, "output") not in (job_id, changed)
+
+
+def test_claim_runs_jobs_of_a_folder_one_at_a_time(queue, pdfs):
+    """Test that jobs are claimed in order, without two running jobs on the same folder."""
+    first = queue.submit(pdfs[:1], "output")
+    second = queue.submit(pdfs[1:], "output")
+    other = queue.submit(pdfs, "other")
+
+    assert queue.claim()["id"] == first
+    assert queue.claim()["id"] == other
+    assert queue.claim() is None
+    assert queue.latest("output")["id"] == second
+
+    queue.finish(first, "done", result="vector-id")
+    assert queue.claim()["id"] == second
+    assert queue.get(first)["result"] == "vector-id"
+
+
+def test_claim_requeues_stale_jobs(queue, pdfs, monkeypatch):
+    """Test that a job whose worker died is run again."""
+    job_id = queue.submit(pdfs, "output")
+    queue.claim()
+    monkeypatch.setattr(jobs, "STALE_AFTER", -1)
+
+    job = queue.claim()
+
+    assert job["id"] == job_id and job["state"] == "running"
+
+
+def test_run_job_reports_progress_and_cancellation(queue, pdfs, monkeypatch):
+    """Test that a running job records its progress and stops once cancelled."""
+    job_id = queue.submit(pdfs, "output")
+
+    def run(file_paths, output_folder_path, incremental, on_progress):
+        on_progress({"files_total": 2, "files_done": 1, "chunks_done": 10})
+        assert queue.get(job_id)["files_done"] == 1
+        queue.cancel(job_id)
+        on_progress({"files_total": 2, "files_done": 2, "chunks_done": 20})
+        raise AssertionError("the job should have been cancelled")
+
+    monkeypatch.setattr(vectorstore, "run", run)
+    jobs.run_job(queue, queue.claim())
+
+    job = queue.get(job_id)
+    assert job["state"] == "cancelled"
+    assert job["chunks_done"] == 20
+    assert not queue.cancel(job_id), "A job that is over cannot be cancelled."
+
+
+def test_work_runs_queued_jobs(queue, pdfs, monkeypatch):
+    """Test that the worker runs every queued job and records their outcome."""
+    done = queue.submit(pdfs[:1], "output")
+    failed = queue.submit(pdfs[1:], "output")
+
+    def run(file_paths, output_folder_path, incremental, on_progress):
+        if file_paths == pdfs[1:]:
+            raise Exception("no text chunks found in input files")
+        return "vector-id"
+
+    monkeypatch.setattr(vectorstore, "run", run)
+    monkeypatch.setattr(jobs, "get_queue", lambda db_path: queue)
+
+    assert jobs.work("jobs.db", poll_interval=0, idle_timeout=0) == 2
+    assert queue.get(done)["state"] == "done"
+    assert queue.get(done)["result"] == "vector-id"
+    assert queue.get(failed)["state"] == "failed"
+    assert "no text chunks" in queue.get(failed)["error"]
+    assert queue.latest("output") is None
@@ -0,0 +1,26 @@
+from manifest import diff_files, empty_manifest, load_manifest, save_manifest
+
+
+def test_diff_files():
+    """Test that new, changed and removed files are detected from content hashes."""
+    manifest = empty_manifest()
+    manifest["files"] = {
+        "a.pdf": {"hash": "1", "chunk_ids": ["a0"]},
+        "b.pdf": {"hash": "2", "chunk_ids": ["b0", "b1"]},
+        "c.pdf": {"hash": "3", "chunk_ids": []},
+    }
+
+    removed, added = diff_files(manifest, {"a.pdf": "1", "b.pdf": "9", "d.pdf": "4"})
+
+    assert sorted(removed) == ["b.pdf", "c.pdf"], "Changed and deleted files should be removed."
+    assert sorted(added) == ["b.pdf", "d.pdf"], "Changed and new files should be added."
+
+
+def test_save_and_load_manifest(tmp_path):
+    """Test that a saved manifest is loaded back unchanged."""
+    assert load_manifest(str(tmp_path)) == empty_manifest()
+
+    manifest = {"index_name": "abc", "files": {"a.pdf": {"hash": "1", "chunk_ids": ["a0"]}}}
+    save_manifest(manifest, str(tmp_path))
+
+    assert load_manifest(str(tmp_path)) == manifest
@@ -0,0 +1,25 @@
+from langchain_core.language_models import FakeListChatModel
+
+from memory import TokenBudgetMemory, count_tokens
+
+
+def test_token_budget_memory_summarizes_old_turns():
+    """Test that the history stays within its token budget, older turns being summarized."""
+    memory = TokenBudgetMemory(
+        llm=FakeListChatModel(responses=["Summary of the conversation."]),
+        max_token_limit=100,
+        memory_key="chat_history",
+        input_key="question",
+        output_key="answer",
+        return_messages=True,
+    )
+
+    for i in range(10):
+        memory.save_context({"question": f"Question {i} " * 5}, {"answer": f"Answer {i} " * 5})
+
+    history = memory.buffer
+
+    assert count_tokens(history) <= 100, "The history should fit the token budget."
+    assert history[0].content == "Summary of the conversation."
+    assert history[-1].content == "Answer 9 " * 5, "The latest turn should be kept verbatim."
+    assert len(history) % 2 == 1, "Whole turns should be summarized."
@@ -0,0 +1,105 @@
+import json
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+
+import models
+import onnx_embeddings
+
+
+class NoisyEmbeddings(Embeddings):
+    """
+    Embeddings of another model with Gaussian noise added, standing for a quantized model.
+    """
+
+    def __init__(self, embeddings: Embeddings, scale: float) -> None:
+        self.embeddings = embeddings
+        self.scale = scale
+
+    def _noisy(self, vector):
+        rng = np.random.default_rng(len(vector))
+        return (np.array(vector) + rng.normal(0, self.scale, len(vector))).tolist()
+
+    def embed_documents(self, texts):
+        return [self._noisy(v) for v in self.embeddings.embed_documents(texts)]
+
+    def embed_query(self, text):
+        return self._noisy(self.embeddings.embed_query(text))
+
+
+def test_mean_pool_ignores_padding():
+    token_embeddings = np.array(
+        [[[1.0, 0.0], [0.0, 1.0], [9.0, 9.0]], [[3.0, 4.0], [9.0, 9.0], [9.0, 9.0]]]
+    )
+    attention_mask = np.array([[1, 1, 0], [1, 0, 0]])
+
+    pooled = onnx_embeddings.mean_pool(token_embeddings, attention_mask)
+
+    np.testing.assert_allclose(pooled, [[0.5**0.5, 0.5**0.5], [0.6, 0.8]])
+
+
+def test_fidelity_report():
+    reference = DeterministicFakeEmbedding(size=64)
+    texts = [f"trecho {i}" for i in range(50)]
+    queries = texts[:10]
+
+    identical = onnx_embeddings.fidelity_report(reference, reference, texts, queries, k=5)
+    assert identical["cosine_min"] == pytest.approx(1.0)
+    assert identical["recall@5"] == 1.0
+
+    # fake embeddings are unrelated to the texts: large noise shuffles the neighbours
+    noisy = onnx_embeddings.fidelity_report(
+        reference, NoisyEmbeddings(reference, scale=3.0), texts, queries, k=5
+    )
+    assert noisy["cosine_mean"] < 0.5
+    assert noisy["recall@5"] < 1.0
+    assert noisy["texts"] == 50 and noisy["queries"] == 10
+
+
+def test_get_embeddings_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        models.get_embeddings(cache_folder_path=None, backend="tensorflow")
+
+
+def test_onnx_embeddings(tmp_path):
+    onnx = pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    tokenizers = pytest.importorskip("tokenizers")
+    from onnx import TensorProto, helper, numpy_helper
+
+    # a model whose token embeddings are rows of a table, and a whitespace tokenizer
+    table = np.array([[0, 0], [1, 1], [1, 0], [0, 1]], dtype=np.float32)
+    graph = helper.make_graph(
+        [helper.make_node("Gather", ["table", "input_ids"], ["last_hidden_state"])],
+        "table",
+        [
+            helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["batch", "tokens"]),
+            helper.make_tensor_value_info("attention_mask", TensorProto.INT64, ["batch", "tokens"]),
+        ],
+        [helper.make_tensor_value_info("last_hidden_state", TensorProto.FLOAT, None)],
+        [numpy_helper.from_array(table, "table")],
+    )
+    onnx.save(
+        helper.make_model(graph, opset_imports=[helper.make_opsetid("", 14)]),
+        str(tmp_path / onnx_embeddings.MODEL_FILE_NAME),
+    )
+
+    tokenizer = tokenizers.Tokenizer(
+        tokenizers.models.WordLevel({"[PAD]": 0, "[UNK]": 1, "a": 2, "b": 3}, unk_token="[UNK]")
+    )
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer.save(str(tmp_path / "tokenizer.json"))
+
+    with open(tmp_path / onnx_embeddings.CONFIG_FILE_NAME, "w") as f:
+        json.dump({"model_name": "table", "max_length": 8, "quantized": False}, f)
+
+    embeddings = onnx_embeddings.OnnxEmbeddings(str(tmp_path), num_threads=1, batch_size=1)
+
+    np.testing.assert_allclose(embeddings.embed_query("a"), [1, 0], atol=1e-6)
+    # embedded shortest first, one at a time, and returned in order
+    np.testing.assert_allclose(
+        embeddings.embed_documents(["a b a b", "b", "a b"]),
+        [[0.5**0.5, 0.5**0.5], [0, 1], [0.5**0.5, 0.5**0.5]],
+        atol=1e-6,
+    )
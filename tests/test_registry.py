@@ -0,0 +1,89 @@
+import threading
+import time
+
+import registry
+
+
+def test_get_resource_loads_once():
+    """Test that concurrent callers share a single load of a resource."""
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(registry.get_resource("test-key", factory)))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1, "The factory should be called only once."
+    assert all(r is results[0] for r in results), "Every caller should get the same instance."
+
+
+def test_invalidate_index():
+    """Test that an invalidated index is loaded again on next use."""
+    first = registry.get_index("index-a", object)
+    other = registry.get_index("index-b", object)
+
+    registry.invalidate("index-a")
+
+    assert registry.get_index("index-a", object) is not first
+    assert registry.get_index("index-b", object) is other
+
+
+def test_invalidate_closes_docstore():
+    """Test that invalidating an index closes the connections of its docstore."""
+    from unittest.mock import Mock
+
+    import storage
+
+    store = Mock(docstore=Mock(spec=storage.SQLiteDocstore))
+    registry.get_index("index-e", lambda: store)
+
+    registry.invalidate("index-e")
+
+    store.docstore.close.assert_called_once()
+
+
+def test_invalidate_clears_semantic_cache():
+    """Test that invalidating an index clears the semantic cache held by live sessions."""
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    embeddings = DeterministicFakeEmbedding(size=8)
+    cache = registry.get_semantic_cache("index-c", embeddings)
+    scoped = registry.get_semantic_cache("index-c", embeddings, scope=("a.pdf",))
+    sharded = registry.get_semantic_cache(("index-c", "index-d"), embeddings)
+    cache.add("Q", "A")
+    scoped.add("Q", "B")
+    sharded.add("Q", "C")
+
+    assert scoped is not cache, "Each selection of documents should have its own answers."
+
+    registry.invalidate("index-c")
+
+    assert cache.lookup("Q") is None, "Answers from the outdated index should not be served."
+    assert scoped.lookup("Q") is None
+    assert sharded.lookup("Q") is None, "Caches of shards searched together should be cleared."
+
+
+def test_context_compressor_skips_disk_cache(tmp_path):
+    """Test that sentences are embedded by the model, not through the on-disk cache."""
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+    model = DeterministicFakeEmbedding(size=8)
+    cached = CachedEmbeddings(model, EmbeddingCache(str(tmp_path), "fake-model"))
+
+    try:
+        assert registry.get_context_compressor(cached).embeddings is model
+        assert registry.get_context_compressor(model) is registry.get_context_compressor(cached)
+    finally:
+        registry._resources.pop(("context_compressor",), None)
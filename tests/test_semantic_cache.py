@@ -0,0 +1,37 @@
+import time
+
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+from semantic_cache import SemanticCache
+
+
+def test_lookup_and_eviction():
+    """Test cache hits, misses and least recently used eviction."""
+    cache = SemanticCache(DeterministicFakeEmbedding(size=16), max_entries=2)
+
+    assert cache.lookup("Q1") is None
+
+    cache.add("Q1", "A1")
+    cache.add("Q2", "A2")
+    assert cache.lookup("Q1") == "A1"
+
+    cache.add("Q3", "A3")
+
+    assert cache.lookup("Q2") is None, "The least recently used entry should be evicted."
+    assert cache.lookup("Q1") == "A1"
+    assert cache.lookup("Q3") == "A3"
+    assert cache.stats()["entries"] == 2
+
+
+def test_ttl_and_clear():
+    """Test that expired and cleared entries are not served."""
+    cache = SemanticCache(DeterministicFakeEmbedding(size=16), ttl=0.01)
+    cache.add("Q1", "A1")
+    time.sleep(0.02)
+
+    assert cache.lookup("Q1") is None
+
+    cache.add("Q2", "A2")
+    cache.clear()
+
+    assert cache.lookup("Q2") is None
@@ -0,0 +1,226 @@
+import http.client
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+import config
+import server
+
+
+class FakeQA:
+    def __init__(self, question, answer=None):
+        self.question = question
+        self.answer = answer
+
+
+class FakeChat:
+    """
+    Chat answering with the question reversed, after release is set.
+    """
+
+    def __init__(self, session_id, release):
+        self.session_id = session_id
+        self.release = release
+        self.sources = None
+        self.logged = []
+
+    def sync_history(self):
+        return 0
+
+    def set_sources(self, sources):
+        self.sources = sources
+
+    def ask(self, question):
+        self.release.wait(5)
+        return FakeQA(question, question[::-1])
+
+    def ask_stream(self, question):
+        qa = FakeQA(question)
+
+        def tokens():
+            for word in question.split():
+                yield word + " "
+            qa.answer = question
+
+        return qa, tokens()
+
+    def log(self, qa):
+        self.logged.append(qa)
+        return qa
+
+    def get_history(self, after_id=None, limit=None):
+        return [
+            (i + 1, qa.question, qa.answer, "2024-01-01 00:00:00")
+            for i, qa in enumerate(self.logged)
+        ][after_id or 0:][:limit]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(config, "warmup_enabled", False)
+    release = threading.Event()
+    release.set()
+    chats = {}
+
+    def factory(session_id):
+        chats[session_id] = FakeChat(session_id, release)
+        return chats[session_id]
+
+    sock = socket.create_server(("127.0.0.1", 0))
+    httpd = server.BoundedHTTPServer(
+        sock,
+        server.RequestHandler,
+        server.SessionPool(factory, max_sessions=10),
+        threads=1,
+        queue_size=1,
+    )
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={"poll_interval": 0.05})
+    thread.start()
+
+    def request(method, path, payload=None):
+        conn = http.client.HTTPConnection("127.0.0.1", httpd.server_port, timeout=10)
+        body = None if payload is None else json.dumps(payload)
+        conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        data = response.read().decode("utf-8")
+        conn.close()
+        return response.status, data
+
+    api = type("API", (), {})()
+    api.server, api.request, api.release, api.chats = httpd, request, release, chats
+    yield api
+
+    release.set()
+    if not httpd.stopping:
+        httpd.shutdown_gracefully(timeout=5)
+    thread.join(5)
+    sock.close()
+
+
+def test_ask_and_history(api):
+    status, body = api.request("POST", "/ask", {"question": "abc", "session_id": "s1"})
+
+    assert status == 200
+    assert json.loads(body) == {"session_id": "s1", "answer": "cba"}
+
+    status, body = api.request("GET", "/history?session_id=s1")
+    assert status == 200
+    assert [i["question"] for i in json.loads(body)["interactions"]] == ["abc"]
+
+    api.request("POST", "/ask", {"question": "de", "sources": ["a.pdf"]})
+    assert len(api.chats) == 2, "A question without session starts a new one."
+
+
+def test_ask_stream(api):
+    status, body = api.request(
+        "POST", "/ask/stream", {"question": "um dois", "session_id": "s1", "sources": ["a.pdf"]}
+    )
+
+    assert status == 200
+    done = "event: done\ndata: " + json.dumps({"session_id": "s1", "answer": "um dois"})
+    assert body.split("\n\n")[:3] == ['data: "um "', 'data: "dois "', done]
+    assert api.chats["s1"].sources == ["a.pdf"]
+    assert api.chats["s1"].logged[0].answer == "um dois"
+
+
+@pytest.mark.parametrize(
+    "method, path, payload, status",
+    [
+        ("POST", "/ask", {}, 400),
+        ("POST", "/ask", {"question": "a", "sources": "a.pdf"}, 400),
+        ("GET", "/history", None, 400),
+        ("GET", "/nothing", None, 404),
+    ],
+)
+def test_bad_requests(api, method, path, payload, status):
+    assert api.request(method, path, payload)[0] == status
+
+
+def test_overload_is_rejected(api):
+    """Test that requests beyond the running and queued ones get 429."""
+    api.release.clear()
+    results = []
+
+    def ask():
+        results.append(api.request("POST", "/ask", {"question": "abc", "session_id": "s"}))
+
+    # one request running, then one queued
+    threads = [threading.Thread(target=ask) for _ in range(2)]
+    threads[0].start()
+    while not api.chats:
+        threading.Event().wait(0.01)
+    threads[1].start()
+    while api.server.queue_size() < 1:
+        threading.Event().wait(0.01)
+
+    status, body = api.request("POST", "/ask", {"question": "abc"})
+    assert status == 429
+    assert json.loads(body) == {"error": "too many requests"}
+
+    api.release.set()
+    for thread in threads:
+        thread.join()
+    assert [s for s, _ in results] == [200, 200]
+
+
+def test_reject_does_not_wait_for_the_client(api):
+    """Test that a rejection is answered at once, then closed once the client is done."""
+    request, client = socket.socketpair()
+    start = time.monotonic()
+
+    api.server.reject(request, 429, "too many requests")
+
+    assert time.monotonic() - start < 0.04
+    client.settimeout(5)
+    response = b""
+    while chunk := client.recv(4096):
+        response += chunk
+    assert response.startswith(b"HTTP/1.0 429 Too Many Requests")
+    client.close()
+
+
+def test_graceful_shutdown(api):
+    """Test that shutdown waits for the running requests, then refuses new ones."""
+    api.release.clear()
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(api.request("POST", "/ask", {"question": "abc"}))
+    )
+    thread.start()
+    while not api.chats:
+        threading.Event().wait(0.01)
+
+    stopper = threading.Thread(target=api.server.shutdown_gracefully, kwargs={"timeout": 5})
+    stopper.start()
+    threading.Event().wait(0.2)
+    assert not results, "The running request should not be interrupted."
+
+    api.release.set()
+    stopper.join()
+    thread.join()
+    assert results[0][0] == 200
+
+
+def test_not_ready(api, monkeypatch):
+    monkeypatch.setattr(config, "warmup_enabled", True)
+    monkeypatch.setattr(server.warmup, "is_ready", lambda: False)
+    monkeypatch.setattr(server.warmup, "status", lambda: {"state": "warming"})
+
+    assert api.request("POST", "/ask", {"question": "abc"})[0] == 503
+    assert api.request("GET", "/health")[0] == 503
+
+
+def test_session_pool_evicts_least_recently_used():
+    created = []
+    pool = server.SessionPool(
+        lambda session_id: created.append(session_id) or session_id, max_sessions=1
+    )
+
+    assert pool.get("a")[1]() == "a"
+    pool.get("a")[1]()
+    pool.get("b")[1]()
+    pool.get("a")[1]()
+    assert created == ["a", "b", "a"]
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import manifest as mf
+import snapshots
+
+
+@pytest.fixture
+def folder(tmp_path):
+    """A folder with three versions of an index, the last one active."""
+    for i, vector_id in enumerate(["v1", "v2", "v3"]):
+        for extension in ("faiss", "db"):
+            (tmp_path / f"{vector_id}.bin.{extension}").touch()
+        state = {**mf.empty_manifest(), "index_name": vector_id, "build": {"created_at": i}}
+        snapshots.save_version(str(tmp_path), state)
+        mf.save_manifest(state, str(tmp_path))
+
+    return str(tmp_path)
+
+
+def test_activate_rolls_back(folder):
+    """Test that an earlier version can be served again, without losing a build in progress."""
+    manifest = mf.load_manifest(folder)
+    mf.save_manifest({**manifest, "pending_index": {"index_name": "v4"}}, folder)
+
+    snapshots.activate(folder, "v1")
+
+    manifest = mf.load_manifest(folder)
+    assert manifest["index_name"] == "v1"
+    assert manifest["pending_index"] == {"index_name": "v4"}
+    assert [(v["index_name"], v["active"]) for v in snapshots.list_versions(folder)] == [
+        ("v1", True),
+        ("v2", False),
+        ("v3", False),
+    ]
+
+    with pytest.raises(ValueError):
+        snapshots.activate(folder, "v5")
+
+
+def test_collect_garbage_keeps_versions_in_use(folder, monkeypatch):
+    """Test that only versions neither recent, active nor leased are removed."""
+    snapshots.activate(folder, "v1")
+    snapshots.acquire(folder, "v2")
+
+    assert snapshots.collect_garbage(folder, keep=1) == []
+
+    snapshots.release(folder, "v2")
+    assert snapshots.collect_garbage(folder, keep=1) == ["v2"]
+    assert not os.path.exists(os.path.join(folder, "v2.bin.faiss"))
+    assert [v["index_name"] for v in snapshots.list_versions(folder)] == ["v1", "v3"]
+
+    # a lease that was not renewed belongs to a process that died
+    snapshots.acquire(folder, "v3")
+    monkeypatch.setattr(snapshots, "LEASE_TTL", -1)
+    assert snapshots.collect_garbage(folder, keep=0) == ["v3"]
+    snapshots.release(folder, "v3")
+
+
+def test_leases_are_counted_per_process(folder):
+    snapshots.acquire(folder, "v1")
+    snapshots.acquire(folder, "v1")
+
+    assert not snapshots.release(folder, "v1")
+    assert snapshots.is_leased(folder, "v1")
+    assert snapshots.release(folder, "v1")
+    assert not snapshots.is_leased(folder, "v1")
@@ -0,0 +1,112 @@
+import datetime
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import config
+import storage
+import vectorstore
+
+TEXTS = [f"chunk {i}" for i in range(300)]
+
+
+def build(index_type="flat"):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    vectors = np.array(embeddings.embed_documents(TEXTS), dtype=np.float32)
+    store = vectorstore.new_vector_store(
+        embeddings, vectors, index_type, {**config.index_params, "nlist": 4, "pq_m": 4}
+    )
+    date = datetime.date(2024, 1, 1)
+    store.add_embeddings(
+        list(zip(TEXTS, vectors)),
+        metadatas=[{"source": "a.pdf", "page": i, "date": date} for i in range(300)],
+        ids=[f"id{i}" for i in range(300)],
+    )
+    return store, embeddings
+
+
+def test_open_vector_store(tmp_path):
+    """Test that a saved store is searched without unpickling nor reading every chunk."""
+    store, embeddings = build()
+    storage.save_vector_store(store, str(tmp_path), "test.bin")
+
+    assert sorted(os.listdir(tmp_path)) == ["test.bin.db", "test.bin.faiss"]
+
+    opened = storage.open_vector_store(str(tmp_path), "test.bin", embeddings)
+    expected = store.similarity_search_with_score("chunk 42", k=3)
+    found = opened.similarity_search_with_score("chunk 42", k=3)
+
+    assert [(d.id, d.page_content, d.metadata, s) for d, s in found] == [
+        (d.id, d.page_content, {**d.metadata, "date": "2024-01-01"}, s) for d, s in expected
+    ]
+    assert len(opened.index_to_docstore_id) == 300
+    assert opened.index_to_docstore_id[np.int64(7)] == "id7"
+
+
+def test_open_ivf_vector_store(tmp_path):
+    """Test that a memory-mapped IVF index returns the same results."""
+    store, embeddings = build("ivf_flat")
+    storage.save_vector_store(store, str(tmp_path), "test.bin")
+
+    opened = storage.open_vector_store(str(tmp_path), "test.bin", embeddings)
+
+    assert [d.id for d in opened.similarity_search("chunk 1", k=5)] == [
+        d.id for d in store.similarity_search("chunk 1", k=5)
+    ]
+
+
+def test_load_vector_store_is_writable(tmp_path):
+    """Test that a loaded store can be updated and saved again."""
+    store, embeddings = build()
+    storage.save_vector_store(store, str(tmp_path), "test.bin")
+
+    loaded = storage.load_vector_store(str(tmp_path), "test.bin", embeddings)
+    loaded.delete(["id0", "id1"])
+    loaded.add_texts(["new chunk"], ids=["new"])
+    storage.save_vector_store(loaded, str(tmp_path), "test.bin")
+
+    opened = storage.open_vector_store(str(tmp_path), "test.bin", embeddings)
+    assert len(opened.index_to_docstore_id) == 299
+    assert opened.similarity_search("new chunk", k=1)[0].id == "new"
+    assert opened.docstore.search("id0") == "ID id0 not found."
+
+
+def test_get_ranges(tmp_path):
+    """Test that the chunks of each document are found by ranges of positions."""
+    embeddings = DeterministicFakeEmbedding(size=16)
+    sources = ["a.pdf", "a.pdf", "b.pdf", "a.pdf", "c.pdf", "c.pdf"]
+    store = FAISS.from_texts(
+        [f"chunk {i}" for i in range(6)],
+        embeddings,
+        metadatas=[{"source": s, "doc_id": ord(s[0])} for s in sources],
+    )
+    storage.save_vector_store(store, str(tmp_path), "test.bin")
+
+    docstore = storage.open_vector_store(str(tmp_path), "test.bin", embeddings).docstore
+
+    assert docstore.get_ranges(["a.pdf"]) == [(0, 2), (3, 4)]
+    assert docstore.get_ranges(["c.pdf", "b.pdf", "d.pdf"]) == [(2, 3), (4, 6)]
+
+
+def test_close_docstore(tmp_path):
+    """Test that closing a docstore closes the connection of every thread, and reopens on use."""
+    store, embeddings = build()
+    storage.save_vector_store(store, str(tmp_path), "test.bin")
+    opened = storage.open_vector_store(str(tmp_path), "test.bin", embeddings)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda i: opened.docstore.search(f"id{i}"), range(20)))
+    connections = list(opened.docstore._connections)
+
+    opened.docstore.close()
+
+    assert connections and not opened.docstore._connections
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+    assert opened.similarity_search("chunk 42", k=1)[0].page_content == "chunk 42"
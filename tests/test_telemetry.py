@@ -0,0 +1,94 @@
+import json
+import urllib.request
+
+import pytest
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+import telemetry
+from chat import InstrumentedRetriever
+
+
+class ListSink(telemetry.Sink):
+    def __init__(self):
+        self.events = []
+
+    def record(self, kind, name, value, labels):
+        self.events.append((kind, name, value, labels))
+
+
+@pytest.fixture
+def sink():
+    sink = ListSink()
+    telemetry.add_sink(sink)
+    yield sink
+    telemetry.remove_sink(sink)
+
+
+def test_disabled_telemetry_is_a_no_op():
+    """Test that nothing is allocated nor recorded without sinks."""
+    assert not telemetry.enabled()
+    assert telemetry.span("a") is telemetry.span("b"), "A shared no-op span should be returned."
+
+    with telemetry.span("a"):
+        telemetry.observe("b", 1.0)
+        telemetry.count("c")
+
+
+def test_instrumented_retriever(sink):
+    """Test that retrieval records the embedding and search spans and the scores."""
+    vectorstore = FAISS.from_texts(["a", "b", "c"], DeterministicFakeEmbedding(size=8))
+    retriever = InstrumentedRetriever(vectorstore=vectorstore, search_kwargs={"k": 2})
+
+    assert len(retriever.invoke("a")) == 2
+
+    names = [(kind, name) for kind, name, _, _ in sink.events]
+    assert names == [
+        ("span", "retrieval.embed_query"),
+        ("span", "retrieval.search"),
+        ("value", "retrieval.score"),
+        ("value", "retrieval.score"),
+    ]
+
+
+def test_prometheus_sink():
+    """Test that the Prometheus endpoint exposes histograms, summaries and counters."""
+    sink = telemetry.PrometheusSink(port=0)
+    telemetry.add_sink(sink)
+    try:
+        telemetry.record_span("ask.llm", 0.2)
+        telemetry.record_span("ask.llm", 7)
+        telemetry.observe("retrieval.score", 0.5, index="a")
+        telemetry.count("semantic_cache.hits", 2)
+
+        port = sink._server.server_address[1]
+        body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+    finally:
+        telemetry.remove_sink(sink)
+
+    assert "# TYPE rag_ask_llm_seconds histogram" in body
+    assert 'rag_ask_llm_seconds_bucket{le="0.25"} 1' in body
+    assert 'rag_ask_llm_seconds_bucket{le="+Inf"} 2' in body
+    assert "rag_ask_llm_seconds_count 2" in body
+    assert 'rag_retrieval_score_sum{index="a"} 0.5' in body
+    assert "rag_semantic_cache_hits_total 2" in body
+
+
+def test_json_lines_sink(tmp_path):
+    """Test that every event is appended as a JSON line."""
+    path = tmp_path / "telemetry.jsonl"
+    sink = telemetry.JsonLinesSink(str(path))
+    telemetry.add_sink(sink)
+    try:
+        with telemetry.span("ingest.embed", batch="1"):
+            pass
+        telemetry.count("ingest.files")
+    finally:
+        telemetry.remove_sink(sink)
+
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(e["kind"], e["name"]) for e in events] == [
+        ("span", "ingest.embed"),
+        ("count", "ingest.files"),
+    ]
+    assert events[0]["batch"] == "1"
@@ -0,0 +1,335 @@
+import os
+import time
+from typing import List, Optional
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import config
+import manifest as mf
+import snapshots
+import vectorstore
+
+
+def write_pdf(path, pages):
+    """Write a minimal PDF with one line of text per page."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    path.write_bytes(out)
+
+    return str(path)
+
+
+@pytest.fixture
+def pdfs(tmp_path):
+    return [
+        write_pdf(tmp_path / f"doc{i}.pdf", [f"Document {i} page {p}" for p in range(2)])
+        for i in range(4)
+    ]
+
+
+def test_load_documents_order(pdfs):
+    """Test that documents are returned in the order of the input files."""
+    documents = vectorstore.load_documents_from_file_paths(pdfs[::-1])
+
+    assert [(d.metadata["source"], d.metadata["page"]) for d in documents] == [
+        (f, p) for f in pdfs[::-1] for p in range(2)
+    ]
+    assert documents[0].page_content == "Document 3 page 0"
+
+
+def test_iter_documents_isolates_failures(pdfs, tmp_path):
+    """Test that a file that fails to parse is skipped without affecting the others."""
+    broken = tmp_path / "broken.pdf"
+    broken.write_text("not a pdf")
+
+    loaded = dict(vectorstore.iter_documents([pdfs[0], str(broken), pdfs[1]], max_workers=2))
+
+    assert set(loaded) == {pdfs[0], pdfs[1]}
+    assert len(loaded[pdfs[0]]) == 2
+
+
+def test_iter_documents_in_input_order(pdfs, tmp_path):
+    """Test that ordered files are yielded in input order, skipping failures."""
+    broken = tmp_path / "broken.pdf"
+    broken.write_text("not a pdf")
+    file_paths = [pdfs[3], str(broken), *pdfs[:3]]
+
+    loaded = vectorstore.iter_documents(file_paths, max_workers=2, ordered=True)
+
+    assert [f for f, _ in loaded] == [pdfs[3], *pdfs[:3]]
+
+
+def test_load_file_timeout(pdfs, monkeypatch):
+    """Test that parsing is interrupted once the per-file timeout expires."""
+
+    class SlowLoader:
+        def __init__(self, file_path):
+            pass
+
+        def load_and_split(self):
+            time.sleep(5)
+
+    monkeypatch.setattr(vectorstore, "PyPDFLoader", SlowLoader)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        vectorstore.load_file(pdfs[0], timeout=1)
+
+    assert time.monotonic() - start < 3
+
+
+class FailingEmbeddings(DeterministicFakeEmbedding):
+    """Fake embeddings raising once a number of batches have been embedded."""
+
+    fail_after: Optional[int] = None
+    texts: List[str] = []
+
+    def embed_documents(self, texts):
+        if self.fail_after is not None and len(self.texts) >= self.fail_after:
+            raise KeyboardInterrupt
+        self.texts.extend(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def build(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "embedding_batch_size", 2)
+    monkeypatch.setattr(config, "index_checkpoint_batches", 1)
+    output = tmp_path / "output"
+    output.mkdir()
+
+    def build(file_paths, fail_after=None, incremental=True, **kwargs):
+        embeddings = FailingEmbeddings(size=16, fail_after=fail_after, texts=[])
+        monkeypatch.setattr(vectorstore.registry, "get_embeddings", lambda: embeddings)
+        vector_id = vectorstore.run(file_paths, str(output), incremental=incremental, **kwargs)
+
+        return vector_id, embeddings
+
+    build.output = str(output)
+    return build
+
+
+def test_run_resumes_interrupted_build(pdfs, build):
+    """Test that an interrupted build resumes from its last checkpoint."""
+    with pytest.raises(KeyboardInterrupt):
+        build(pdfs, fail_after=4)
+
+    manifest = mf.load_manifest(build.output)
+    assert manifest["index_name"] is None, "An unfinished build should not be served."
+    assert manifest["pending_index"]["files"], "Checkpoints should record completed files."
+
+    vector_id, embeddings = build(pdfs)
+
+    manifest = mf.load_manifest(build.output)
+    assert manifest["index_name"] == vector_id
+    assert "pending_index" not in manifest
+    assert len(embeddings.texts) == 4, "Checkpointed chunks should not be embedded again."
+
+    store = vectorstore.load_vector_store(build.output, vector_id, embeddings)
+    assert store.index.ntotal == 8
+
+
+def test_run_reports_progress(pdfs, build):
+    """Test that progress is reported after each batch, and that the callback can stop the build."""
+    reports = []
+
+    def stop_after_two(progress):
+        reports.append(progress)
+        if len(reports) == 3:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        build(pdfs, on_progress=stop_after_two)
+
+    assert reports[0] == {"files_total": 4, "files_done": 0, "chunks_done": 0}
+    assert [r["chunks_done"] for r in reports] == [0, 2, 4]
+
+    reports.clear()
+    _, embeddings = build(pdfs, on_progress=reports.append)
+
+    assert len(embeddings.texts) == 4, "The stopped build should resume from its checkpoint."
+    assert reports[-1]["files_done"] == reports[-1]["files_total"]
+
+
+def test_run_keeps_previous_index_until_complete(pdfs, build):
+    """Test that an interrupted rebuild leaves the previous index in place."""
+    previous_id, _ = build(pdfs)
+
+    with pytest.raises(KeyboardInterrupt):
+        build(pdfs, fail_after=4, incremental=False)
+
+    manifest = mf.load_manifest(build.output)
+    assert manifest["index_name"] == previous_id
+    assert os.path.exists(os.path.join(build.output, f"{previous_id}.bin.faiss"))
+
+    vector_id, _ = build(pdfs, incremental=False)
+
+    assert vector_id != previous_id
+    assert os.path.exists(os.path.join(build.output, f"{previous_id}.bin.faiss")), (
+        "The previous version should be kept for rollback."
+    )
+    assert mf.load_manifest(build.output)["index_name"] == vector_id
+
+
+def test_run_invalidates_previous_index(pdfs, build):
+    """Test that sessions stop using the shared copy of a replaced index."""
+    previous_id, _ = build(pdfs)
+    vectorstore.registry.get_index(f"{previous_id}.bin", object)
+
+    build(pdfs[:2])
+
+    assert ("index", f"{previous_id}.bin") not in vectorstore.registry._resources
+
+
+def test_run_rebuilds_pickled_index(pdfs, build):
+    """Test that an index saved in the legacy pickle format is rebuilt instead of updated."""
+    previous_id, _ = build(pdfs)
+    os.remove(os.path.join(build.output, f"{previous_id}.bin.db"))
+    open(os.path.join(build.output, f"{previous_id}.bin.pkl"), "wb").close()
+
+    vector_id, embeddings = build(pdfs)
+
+    assert vector_id != previous_id
+    assert len(embeddings.texts) == 8, "Every chunk should be embedded again."
+    assert sorted(os.listdir(build.output)) == sorted(
+        [
+            "manifest.json",
+            f"{vector_id}.bin.db",
+            f"{vector_id}.bin.faiss",
+            f"{vector_id}.bin.minhash.npz",
+            f"{vector_id}{snapshots.VERSION_SUFFIX}",
+        ]
+    )
+
+
+def test_retriever_searches_selected_sources(pdfs, build, monkeypatch):
+    """Test that retrieval can be restricted to some documents without rebuilding the index."""
+    import chat
+
+    monkeypatch.setattr(config, "index_type", "ivf_flat")
+    monkeypatch.setattr(config, "index_params", {**config.index_params, "nlist": 1})
+    build(pdfs)
+    # an incremental removal must keep the positions of the other documents right
+    _, embeddings = build(pdfs[1:])
+
+    retriever = chat.setup_retriever(build.output, embeddings, search_kwargs={"k": 4})
+    retriever.sources = [pdfs[2]]
+    docs = retriever.invoke("Document 2 page 1")
+
+    assert [d.metadata["source"] for d in docs] == [pdfs[2], pdfs[2]]
+    assert docs[0].page_content == "Document 2 page 1"
+
+    retriever.sources = [pdfs[0]]
+    assert retriever.invoke("Document 0 page 0") == [], "Removed documents have no chunks."
+    vectorstore.registry.invalidate()
+
+
+def test_run_stores_duplicate_chunks_once(tmp_path, build, monkeypatch):
+    """Test that chunks repeated across documents are embedded once and found in each."""
+    import chat
+
+    words = [f"c{i}" for i in range(150)]
+    general = " ".join(words)
+    # one word differs: a near-duplicate
+    edited = " ".join(words[:75] + ["alterada"] + words[76:])
+    pdfs = [
+        write_pdf(tmp_path / "a.pdf", [general, "Produto A cobertura especial"]),
+        write_pdf(tmp_path / "b.pdf", [general, "Produto B assistencia"]),
+        write_pdf(tmp_path / "c.pdf", [edited, "Produto C franquia"]),
+    ]
+
+    vector_id, embeddings = build(pdfs)
+
+    assert len(embeddings.texts) == 4
+    files = mf.load_manifest(build.output)["files"]
+    assert files[pdfs[1]]["chunk_ids"][0] == files[pdfs[0]]["chunk_ids"][0]
+    assert files[pdfs[2]]["chunk_ids"][0] == files[pdfs[0]]["chunk_ids"][0]
+
+    retriever = chat.setup_retriever(build.output, embeddings, search_kwargs={"k": 4})
+    retriever.sources = [pdfs[2]]
+    docs = retriever.invoke(general)
+    assert {d.page_content for d in docs} == {general, "Produto C franquia"}
+    shared = next(d for d in docs if d.page_content == general)
+    assert shared.metadata["source"] == pdfs[0]
+    assert [d["source"] for d in shared.metadata["duplicates"]] == pdfs[1:]
+
+    # the shared chunk outlives the document it was first stored for, and the signatures
+    # of the indexed chunks are loaded rather than computed again
+    signature = vectorstore.dedup.ChunkDeduplicator.signature
+    signed = []
+    monkeypatch.setattr(
+        vectorstore.dedup.ChunkDeduplicator,
+        "signature",
+        lambda self, text: signed.append(text) or signature(self, text),
+    )
+    vector_id, embeddings = build(pdfs[1:])
+
+    store = vectorstore.load_vector_store(build.output, vector_id, embeddings)
+    assert store.index.ntotal == 3
+    docs = store.similarity_search(general, k=1)
+    assert docs[0].metadata["source"] == pdfs[1]
+    assert [d["source"] for d in docs[0].metadata["duplicates"]] == pdfs[2:]
+    assert signed == []
+    vectorstore.registry.invalidate()
+
+
+def test_chat_switches_versions(pdfs, build, tmp_path, monkeypatch):
+    """Test that a running Chat switches to a new or rolled back version, releasing the previous one."""
+    from langchain_core.language_models import FakeListChatModel
+
+    import chat
+
+    monkeypatch.setattr(config, "semantic_cache_enabled", False)
+    monkeypatch.setattr(config, "index_keep_versions", 0)
+    monkeypatch.setattr(chat.registry, "get_llm", lambda: FakeListChatModel(responses=["A"]))
+    first, _ = build(pdfs[:2])
+    chat_ins = chat.Chat(build.output, str(tmp_path / "history.db"), "{context}{question}")
+
+    second, _ = build(pdfs)
+    assert os.path.exists(os.path.join(build.output, f"{first}.bin.faiss")), (
+        "A version in use should not be removed."
+    )
+
+    assert chat_ins.refresh()
+    assert chat_ins._retriever.vectorstore.index.ntotal == 8
+    assert not chat_ins.refresh(), "The active version is already served."
+    assert not os.path.exists(os.path.join(build.output, f"{first}.bin.faiss"))
+
+    third, _ = build(pdfs[:1])
+    snapshots.activate(build.output, second)
+
+    assert not chat_ins.refresh(), "The rolled back version is already served."
+    assert snapshots.is_leased(build.output, second)
+
+    snapshots.activate(build.output, third)
+    assert chat_ins.refresh()
+    assert chat_ins._retriever.vectorstore.index.ntotal == 2
+    assert not os.path.exists(os.path.join(build.output, f"{second}.bin.faiss"))
+    vectorstore.registry.invalidate()
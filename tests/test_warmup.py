@@ -0,0 +1,126 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+
+import config
+import manifest as mf
+import registry
+import storage
+import warmup
+
+
+@pytest.fixture
+def fresh_warmup(monkeypatch):
+    monkeypatch.setattr(warmup, "_thread", None)
+    monkeypatch.setattr(warmup, "_ready", threading.Event())
+    monkeypatch.setattr(warmup, "_error", None)
+    monkeypatch.setattr(warmup, "_seconds", None)
+
+
+def test_chat_import_defers_model_clients():
+    """Test that importing chat does not import the LLM client nor the embedding model."""
+    src = os.path.join(os.path.dirname(__file__), "..", "src")
+    code = (
+        "import sys, chat, warmup; "
+        "heavy = {'langchain_google_genai', 'sentence_transformers', 'torch'}; "
+        "print(sorted(heavy & set(sys.modules)))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=src, capture_output=True, text=True, check=True
+    ).stdout
+
+    assert out.strip() == "[]"
+
+
+def test_warm_up_loads_shared_resources(tmp_path, monkeypatch):
+    """Test that warm-up loads the embedding model, the LLM and the existing index."""
+    embeddings = DeterministicFakeEmbedding(size=8)
+    llm = FakeListChatModel(responses=["ok"])
+    monkeypatch.setattr(registry.models, "get_embeddings", lambda model_name: embeddings)
+    monkeypatch.setattr(registry.models, "get_llm", lambda model: llm)
+    storage.save_vector_store(
+        FAISS.from_texts(["a", "b"], embeddings), str(tmp_path), "warm.bin"
+    )
+    registry.invalidate()
+
+    try:
+        warmup.warm_up(str(tmp_path))
+
+        assert registry.get_embeddings() is embeddings
+        assert registry.get_llm() is llm
+        assert ("index", "warm.bin") in registry._resources
+    finally:
+        registry._resources.clear()
+
+
+def test_warm_up_loads_shards(tmp_path, monkeypatch):
+    """Test that warm-up loads every shard of a sharded folder, and nothing from an empty one."""
+    embeddings = DeterministicFakeEmbedding(size=8)
+    monkeypatch.setattr(registry.models, "get_embeddings", lambda model_name: embeddings)
+    monkeypatch.setattr(registry.models, "get_llm", lambda model: FakeListChatModel(responses=["ok"]))
+    for name in ("a", "b"):
+        folder = tmp_path / "store" / name
+        folder.mkdir(parents=True)
+        storage.save_vector_store(FAISS.from_texts([name], embeddings), str(folder), f"{name}.bin")
+        mf.save_manifest({**mf.empty_manifest(), "index_name": name}, str(folder))
+    registry.invalidate()
+
+    try:
+        warmup.warm_up(str(tmp_path / "empty"))
+        assert not [key for key in registry._resources if key[0] == "index"]
+
+        warmup.warm_up(str(tmp_path / "store"))
+        assert {("index", "a.bin"), ("index", "b.bin")} <= set(registry._resources)
+    finally:
+        registry._resources.clear()
+
+
+def test_start_reports_readiness(tmp_path, monkeypatch, fresh_warmup):
+    """Test that warm-up runs once in the background and reports when it is over."""
+    release = threading.Event()
+    calls = []
+
+    def warm_up(store_folder_path):
+        calls.append(store_folder_path)
+        release.wait(5)
+
+    ready_file = tmp_path / "ready"
+    ready_file.write_text("stale")
+    monkeypatch.setattr(config, "warmup_ready_file", str(ready_file))
+    monkeypatch.setattr(warmup, "warm_up", warm_up)
+
+    assert warmup.status()["state"] == "idle"
+
+    warmup.start("store")
+    warmup.start("store")
+
+    assert warmup.status()["state"] == "warming"
+    assert not ready_file.exists(), "A file left by a previous process should be removed."
+
+    release.set()
+    assert warmup.wait(5)
+
+    assert calls == ["store"]
+    assert warmup.status()["state"] == "ready"
+    assert ready_file.read_text() == "ready"
+
+
+def test_start_reports_failure(monkeypatch, fresh_warmup):
+    """Test that a failed warm-up still ends, so that sessions load on first use."""
+
+    def warm_up(store_folder_path):
+        raise RuntimeError("no model")
+
+    monkeypatch.setattr(warmup, "warm_up", warm_up)
+
+    warmup.start("store")
+
+    assert warmup.wait(5)
+    assert warmup.status()["state"] == "failed"
+    assert "no model" in warmup.status()["error"]